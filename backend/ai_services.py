@@ -1,16 +1,98 @@
 """
 AI服务集成 - STT, LLM, TTS
+
+具体服务商可插拔（见 providers.py），缺少API Key时启动报错；离线压测时显式指定本地模拟服务（fake_providers.py）
+实时对话中的STT、LLM、TTS调用经过 resilience.py（熔断、重试预算、对冲请求、分阶段超时）
 """
-import httpx
+import asyncio
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+from datetime import datetime
 import json
 import io
 
+from http_pool import UpstreamPool
+from providers import LLMProvider, ProviderError, create_provider
+import fake_providers  # 注册本地模拟服务商（fake）
+from tts_cache import tts_cache, tts_cache_key
+from audio_preprocess import audio_preprocessor
+from endpointing import ENDPOINT_MIN_SPEECH_MS
+from metrics import record_fallback, record_upstream_error
+from prompt_builder import prompt_builder
+from resilience import RESILIENCE_STT_SECONDS_PER_AUDIO_SECOND, resilience
+
+
+class SentenceChunker:
+    """
+    把LLM的流式文本增量切分成可以单独合成语音的句子
+    
+    - 在中文/英文句末标点处断句（紧随其后的引号、括号归入本句）
+    - 句子过短时（如"嗯。"）并入下一句，避免合成大量碎片音频
+    - 缓冲过长仍未遇到句末标点时，在逗号处提前断开，缩短首句等待
+    """
+    
+    SENTENCE_ENDINGS = "。！？!?；;…～~\n"
+    CLOSING_MARKS = "”’」』）)】\"'"
+    SOFT_BREAKS = "，,、：:"
+    
+    def __init__(self, min_chars: int = 4, soft_limit: int = 24):
+        self.min_chars = min_chars
+        self.soft_limit = soft_limit
+        self.buffer = ""
+    
+    def feed(self, delta: str) -> List[str]:
+        """追加文本增量，返回本次已完整的句子"""
+        self.buffer += delta
+        sentences = []
+        start = 0
+        i = 0
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            is_end = char in self.SENTENCE_ENDINGS
+            is_soft = char in self.SOFT_BREAKS and i - start + 1 >= self.soft_limit
+            if is_end or is_soft:
+                # 连续的句末标点和收尾引号归入同一句
+                while i + 1 < len(self.buffer) and (
+                    self.buffer[i + 1] in self.SENTENCE_ENDINGS
+                    or self.buffer[i + 1] in self.CLOSING_MARKS
+                ):
+                    i += 1
+                candidate = self.buffer[start:i + 1].strip()
+                if len(candidate) >= self.min_chars:
+                    sentences.append(candidate)
+                    start = i + 1
+            i += 1
+        self.buffer = self.buffer[start:]
+        return sentences
+    
+    def flush(self) -> Optional[str]:
+        """流结束时取出剩余文本"""
+        tail = self.buffer.strip()
+        self.buffer = ""
+        return tail or None
+
+
+async def _single(text: str) -> AsyncIterator[str]:
+    yield text
+
 
 class AIServices:
     """AI服务管理类"""
     
+    # 语音识别失败时返回给调用方的兜底文本
+    STT_FAILED_TEXT = "语音识别失败，请重试"
+    
+    # LLM出错时的兜底回复（启动时预先合成语音，出错时无需再调用TTS）
+    LLM_BUSY_TEXT = "我现在有点累了，您能再说一遍吗？"
+    LLM_FALLBACK_TEXT = "不好意思，我刚才走神了，您能再说一遍吗？"
+    FALLBACK_REPLIES = (LLM_BUSY_TEXT, LLM_FALLBACK_TEXT)
+    
+    # 语音合成参数（也是语音缓存键的一部分）
+    TTS_VOICE_SETTINGS = {
+        "stability": 0.5,
+        "similarity_boost": 0.75
+    }
+    
     def __init__(self):
         # 硅基流动API（语音识别）
         self.siliconflow_api_key = os.getenv("SILICONFLOW_API_KEY", "")
@@ -21,64 +103,115 @@ class AIServices:
         # ElevenLabs API（语音合成）
         self.elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY", "")
         self.elevenlabs_voice_id = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")  # 默认voice
+        
+        # 每个上游一个长连接池，避免每次调用都重新握手（TCP+TLS）
+        # 地址可覆盖，例如指向 fake_providers.py 启动的本地模拟服务
+        self.pools: Dict[str, UpstreamPool] = {
+            "siliconflow": UpstreamPool(
+                "siliconflow", os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn")
+            ),
+            "elevenlabs": UpstreamPool(
+                "elevenlabs", os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io")
+            ),
+            "gemini": UpstreamPool(
+                "gemini", os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+            ),
+        }
+        
+        # 服务商：默认使用真实服务，缺少API Key时启动失败；本地模拟服务只在显式指定 fake 时使用，
+        # 否则漏配的Key会让模拟的识别结果和回复被当作老人的真实对话保存下来
+        self.stt = create_provider("stt", os.getenv("STT_PROVIDER") or "siliconflow", self.pools)
+        self.llm = create_provider("llm", os.getenv("LLM_PROVIDER") or "siliconflow", self.pools)
+        self.tts = create_provider("tts", os.getenv("TTS_PROVIDER") or "elevenlabs", self.pools)
+        # 人生纪要单独选择对话模型（默认 Gemini，未配置 GEMINI_API_KEY 时返回演示数据，不保存任何内容）
+        self.biography_llm = create_provider(
+            "llm", os.getenv("BIOGRAPHY_LLM_PROVIDER") or ("gemini" if self.gemini_api_key else "fake"), self.pools
+        )
+        simulated = [kind for kind in ("stt", "llm", "tts") if getattr(self, kind).name == "fake"]
+        if simulated:
+            print(f"⚠️  使用本地模拟服务: {', '.join(simulated)}")
+        
+        # 同一句话正在合成时，后来的请求等待同一个结果
+        self._tts_inflight: Dict[str, asyncio.Future] = {}
+    
+    async def startup(self):
+        """创建连接池（FastAPI启动时调用）"""
+        for pool in self.pools.values():
+            pool.client
+        print(f"✅ 上游连接池已创建: {', '.join(self.pools)}")
+        
+        # 预先合成兜底话术，不阻塞启动
+        asyncio.create_task(self.prewarm_tts())
+    
+    async def prewarm_tts(self):
+        """预先合成所有固定话术并写入语音缓存"""
+        results = await asyncio.gather(
+            *(self.text_to_speech(text) for text in self.FALLBACK_REPLIES)
+        )
+        print(f"✅ 兜底话术语音已预热: {sum(1 for audio in results if audio)}/{len(results)}")
+    
+    async def shutdown(self):
+        """关闭连接池和音频预处理进程池（FastAPI关闭时调用）"""
+        for pool in self.pools.values():
+            await pool.aclose()
+        audio_preprocessor.shutdown()
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """各上游连接池的状态"""
+        return {name: pool.stats() for name, pool in self.pools.items()}
+    
+    def provider_stats(self) -> Dict[str, Any]:
+        """当前使用的服务商（模拟服务附带调用、错误、限流统计）"""
+        return {"stt": self.stt.stats(), "llm": self.llm.stats(), "tts": self.tts.stats()}
     
     async def speech_to_text(self, audio_data: bytes) -> str:
         """
-        硅基流动语音识别 - TeleAI/TeleSpeechASR
-        使用REST API: https://api.siliconflow.cn/v1/audio/transcriptions
-        """
-        if not self.siliconflow_api_key:
-            # 开发模式：返回模拟文本
-            print("⚠️  未配置硅基流动API，使用模拟数据")
-            return "模拟识别：今天天气真好啊！"
+        语音识别（默认硅基流动 TeleAI/TeleSpeechASR）
         
+        上传前先在本地预处理（单声道16kHz、裁掉首尾静音、FLAC编码），见 audio_preprocess.py；
+        语音时长不足 ENDPOINT_MIN_SPEECH_MS（咳嗽、关门声、误触）时不调用STT，返回空字符串
+        """
         try:
-            print(f"📡 调用硅基流动语音识别API...")
+            print(f"📡 调用语音识别服务（{self.stt.name}）...")
             
-            # 构建multipart/form-data请求
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # 准备文件
-                files = {
-                    'file': ('audio.wav', audio_data, 'audio/wav')
-                }
-                
-                # 准备数据
-                data = {
-                    'model': 'TeleAI/TeleSpeechASR'
-                }
-                
-                # 准备请求头
-                headers = {
-                    'Authorization': f'Bearer {self.siliconflow_api_key}'
-                }
-                
-                # 发送请求
-                response = await client.post(
-                    'https://api.siliconflow.cn/v1/audio/transcriptions',
-                    files=files,
-                    data=data,
-                    headers=headers
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    text = result.get('text', '').strip()
-                    
-                    if text:
-                        print(f"✅ 识别成功: {text}")
-                        return text
-                    else:
-                        print("⚠️  识别结果为空")
-                        return "抱歉，没有听清楚，能再说一遍吗？"
-                else:
-                    print(f"❌ API错误 [{response.status_code}]: {response.text}")
-                    return "语音识别失败，请重试"
-                    
+            # 准备文件（预处理失败时按原样上传）
+            audio, filename, content_type = audio_data, "audio.wav", "audio/wav"
+            audio_seconds = 0.0
+            processed = await audio_preprocessor.process(audio_data)
+            if processed and processed["speech_ms"] < ENDPOINT_MIN_SPEECH_MS:
+                print(f"🔇 没有检测到语音（{processed['speech_ms']}ms），跳过识别")
+                return ""
+            if processed and processed["audio"]:
+                audio, filename, content_type = processed["audio"], processed["filename"], processed["content_type"]
+                audio_seconds = processed["speech_seconds"]
+                print(f"🎚️  音频预处理: {processed['input_seconds']}s → {processed['speech_seconds']}s, "
+                      f"{len(audio_data)} → {len(processed['audio'])} 字节")
+            
+            # 识别时间随音频时长增长：长语音按时长追加超时，不会被按普通长度估算的预算截断
+            text = await resilience.call(
+                "stt", self.stt.name, lambda: self.stt.transcribe(audio, filename, content_type),
+                extra_seconds=audio_seconds * RESILIENCE_STT_SECONDS_PER_AUDIO_SECOND
+            )
+            if text:
+                print(f"✅ 识别成功: {text}")
+                return text
+            else:
+                print("⚠️  识别结果为空")
+                record_fallback("stt_empty")
+                return "抱歉，没有听清楚，能再说一遍吗？"
+        
+        except ProviderError as e:
+            print(f"❌ API错误 {e}")
+            record_upstream_error("stt", self.stt.name, e)
+            record_fallback("stt_failed")
+            return self.STT_FAILED_TEXT
         except Exception as e:
             print(f"❌ STT Error: {e}")
             import traceback
             traceback.print_exc()
-            return "语音识别失败，请重试"
+            record_upstream_error("stt", self.stt.name, e)
+            record_fallback("stt_failed")
+            return self.STT_FAILED_TEXT
     
     async def generate_response(
         self, 
@@ -90,185 +223,184 @@ class AIServices:
         层一："伴侣智能体"（Companion Agent）
         实时对话交互 - 温暖、同理心、自然
         """
-        if not self.siliconflow_api_key:
-            raise Exception("未配置硅基流动API Key")
+        messages = self.build_companion_messages(
+            user_text, conversation_history, relevant_memories
+        )
         
-        # 构建伴侣智能体的System Prompt
-        system_prompt = self._build_companion_agent_prompt(relevant_memories)
+        try:
+            print(f"🤖 调用对话模型生成回复（{self.llm.name}）...")
+            ai_text = await resilience.call(
+                "llm", self.llm.name,
+                lambda: self.llm.complete(messages, temperature=0.8, max_tokens=150, top_p=0.9)
+            )
+            print(f"✅ 模型回复: {ai_text}")
+            return ai_text
         
-        # 构建消息历史
-        messages = [{"role": "system", "content": system_prompt}]
+        except ProviderError as e:
+            print(f"❌ LLM API Error {e}")
+            record_upstream_error("llm", self.llm.name, e)
+            record_fallback("llm_busy")
+            return self.LLM_BUSY_TEXT
+        except Exception as e:
+            print(f"❌ LLM Error: {e}")
+            import traceback
+            traceback.print_exc()
+            record_upstream_error("llm", self.llm.name, e)
+            record_fallback("llm_error")
+            return self.LLM_FALLBACK_TEXT
+    
+    def build_companion_messages(
+        self,
+        user_text: str,
+        conversation_history: list,
+        relevant_memories: list
+    ) -> List[Dict[str, str]]:
+        """
+        层一："伴侣智能体"（Companion Agent - 交互层）的消息列表
         
-        # 添加对话历史（最近5轮）
-        for item in conversation_history[-5:]:
-            messages.append({"role": "user", "content": item['user_text']})
-            messages.append({"role": "assistant", "content": item['ai_text']})
+        人设 + 最近对话 + 相关记忆 + 当前输入，按token预算组装（见 prompt_builder.py）；
+        通话中也用它提前组装prompt（见 speculation.py），结果可作为 messages 传给生成接口
+        """
+        return prompt_builder.build(user_text, conversation_history, relevant_memories)
+    
+    async def generate_response_stream(
+        self,
+        user_text: str,
+        conversation_history: list,
+        relevant_memories: list,
+        messages: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[str]:
+        """
+        伴侣智能体的流式版本：逐段产出模型生成的文本增量
         
-        # 添加当前用户输入
-        messages.append({"role": "user", "content": user_text})
+        出错时如果还没有产出任何内容，则产出兜底话术，保证调用方总能拿到回复；
+        传入 messages（例如推测阶段已组装好的prompt，见 speculation.py）时不再重新组装
+        """
+        messages = messages or self.build_companion_messages(
+            user_text, conversation_history, relevant_memories
+        )
+        produced = False
         
         try:
-            print(f"🤖 调用Qwen模型生成回复...")
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    "https://api.siliconflow.cn/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.siliconflow_api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "Qwen/Qwen2.5-7B-Instruct",
-                        "messages": messages,
-                        "temperature": 0.8,
-                        "max_tokens": 150,
-                        "top_p": 0.9
-                    }
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    ai_text = data['choices'][0]['message']['content'].strip()
-                    print(f"✅ Qwen回复: {ai_text}")
-                    return ai_text
-                else:
-                    print(f"❌ Qwen API Error [{response.status_code}]: {response.text}")
-                    return "我现在有点累了，您能再说一遍吗？"
-                    
+            print(f"🤖 调用对话模型生成回复（{self.llm.name}，流式）...")
+            async for delta in resilience.stream(
+                "llm", self.llm.name,
+                lambda: self.llm.stream(messages, temperature=0.8, max_tokens=150, top_p=0.9)
+            ):
+                produced = True
+                yield delta
+        
+        except ProviderError as e:
+            print(f"❌ LLM API Error {e}")
+            record_upstream_error("llm", self.llm.name, e)
+            if not produced:
+                record_fallback("llm_busy")
+                yield self.LLM_BUSY_TEXT
         except Exception as e:
-            print(f"❌ LLM Error: {e}")
+            print(f"❌ LLM Stream Error: {e}")
             import traceback
             traceback.print_exc()
-            return "不好意思，我刚才走神了，您能再说一遍吗？"
+            record_upstream_error("llm", self.llm.name, e)
+            if not produced:
+                record_fallback("llm_error")
+                yield self.LLM_FALLBACK_TEXT
     
-    async def text_to_speech(self, text: str) -> bytes:
+    async def stream_reply(
+        self,
+        user_text: str,
+        conversation_history: list,
+        relevant_memories: list,
+        reply_text: Optional[str] = None,
+        messages: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[Tuple[str, bytes]]:
         """
-        ElevenLabs TTS - 生成"亲人"声音
+        LLM → TTS 流水线：按句切分模型的流式输出，每句一完成就立即合成语音
+        
+        按顺序产出 (句子, MP3音频)；后一句的合成与前一句的播放/传输重叠进行，
+        首包时间从"STT+LLM+TTS"缩短到约"STT+第一句"
+        
+        传入 reply_text（例如语义缓存命中的回复）时跳过LLM，直接分句合成
         """
-        if not self.elevenlabs_api_key:
-            # 开发模式：返回空音频
-            return b""
+        queue: asyncio.Queue = asyncio.Queue()
         
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"https://api.elevenlabs.io/v1/text-to-speech/{self.elevenlabs_voice_id}",
-                    headers={
-                        "Accept": "audio/mpeg",
-                        "xi-api-key": self.elevenlabs_api_key,
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "text": text,
-                        "model_id": "eleven_multilingual_v2",
-                        "voice_settings": {
-                            "stability": 0.5,
-                            "similarity_boost": 0.75
-                        }
-                    }
+        async def produce():
+            chunker = SentenceChunker()
+            if reply_text is not None:
+                deltas = _single(reply_text)
+            else:
+                deltas = self.generate_response_stream(
+                    user_text, conversation_history, relevant_memories, messages
                 )
-                
-                if response.status_code == 200:
-                    return response.content
-                else:
-                    print(f"ElevenLabs Error: {response.text}")
-                    return b""
-                    
-        except Exception as e:
-            print(f"TTS Error: {e}")
-            return b""
+            try:
+                async for delta in deltas:
+                    for sentence in chunker.feed(delta):
+                        await queue.put((sentence, asyncio.create_task(self.text_to_speech(sentence))))
+                tail = chunker.flush()
+                if tail:
+                    await queue.put((tail, asyncio.create_task(self.text_to_speech(tail))))
+            finally:
+                await queue.put(None)
+        
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                sentence, tts_task = item
+                yield sentence, await tts_task
+            # 让生产者中的异常（如未配置API Key）传播给调用方
+            await producer
+        finally:
+            # 客户端中途断开时，取消尚未完成的LLM读取和语音合成
+            producer.cancel()
+            while not queue.empty():
+                item = queue.get_nowait()
+                if item is not None:
+                    item[1].cancel()
     
-    def _build_companion_agent_prompt(self, relevant_memories: list) -> str:
+    async def text_to_speech(self, text: str) -> bytes:
         """
-        层一："伴侣智能体"（Companion Agent - 交互层）
+        语音合成（默认ElevenLabs）- 生成"亲人"声音
         
-        职责：处理所有与用户的实时交互
-        优化：同理心、参与度、对话的自然性与连续性
+        按 (文本, 音色, 模型, 参数) 缓存合成结果，重复的句子直接返回缓存的MP3
         """
-        base_prompt = """# 角色定位（Persona）
-你是一个温暖的、耐心的、充满好奇心和支持性的朋友，名叫"小雅"。你就像用户的孙女一样亲切、贴心。
-
-# 首要任务（Primary Goal）
-你的首要任务是成为一个**出色的倾听者和有趣的朋友**。让用户感受到温暖、被关心、被理解。
-
-# 交流风格（Communication Style）
-- 使用"好奇的晚辈"口吻，自然、亲切、充满真诚的兴趣
-- 多用"您"、"咱们"等亲切称呼
-- 适当使用口语化表达（"哎呀"、"真的呀"、"我也觉得"）
-- **通过开放式问题**来鼓励用户分享他们的故事和想法
-
-# 隐式激发策略（Implicit Elicitation）- 核心技巧
-通过自然对话来了解用户，而不是"测试"：
-
-## 1. 情景记忆激发（高频）
-- "您昨天提到您看了一部电影，是讲什么的呀？"
-- "您上次说您做了红烧肉，味道怎么样呀？"
-- "您之前说的那个地方，能再给我描述一下吗？"
-
-## 2. 语义记忆激发（中频）
-- "我们来玩个游戏吧！看看能想出多少种蔬菜可以放进汤里？"
-- "您能给我讲讲您最喜欢的那道菜是怎么做的吗？"
-- "您年轻时候最喜欢的活动是什么呀？"
-
-## 3. 叙事激发（中频）
-- "我看到您说的那张家庭照片，您能给我描述一下吗？"
-- "您能给我讲讲您孙子/孙女的故事吗？"
-- "您今天做了什么有意思的事呀？"
-
-## 4. 日常关怀（高频）
-- "您今天心情怎么样呀？"
-- "您吃饭了吗？吃的什么呀？"
-- "您睡得好吗？"
-- "您今天出去散步了吗？"
-
-# 回复要求
-- **长度**：30-60字（像打电话一样简短自然）
-- **语气**：温暖、关切、不说教
-- **自然性**：每次只问1个问题，不要连珠炮
-- 使用第二人称"您"，营造亲密感
-
-# 【极端重要】禁止事项（CRITICAL PROHIBITIONS）
-
-**[禁止] 你不是医生、治疗师或临床医生。**
-
-**[禁止] 永远不要询问"测试性"问题：**
-- ❌ "今天的日期是什么？"
-- ❌ "美国总统是谁？"
-- ❌ "请记住这三个词：苹果、桌子、硬币"
-- ❌ "现在几点了？"（除非是自然闲聊）
-- ❌ "今天星期几？"（除非是自然闲聊）
-
-**[禁止] 永远不要：**
-- ❌ 做出诊断
-- ❌ 暗示疾病（包括阿尔茨海默症、痴呆症、认知障碍）
-- ❌ 提供任何医疗建议
-- ❌ 说"我是AI"、"我在检测"、"我在评估"
-
-**[允许] 如果用户表达医疗或精神困扰：**
-- ✅ 用同理心回应："我能理解您的感受，这听起来确实让人担心。"
-- ✅ 温和建议："要不要和家人聊聊呢？或者跟医生谈谈也是个好主意。"
-
-# 示例对话（Examples）
-
-用户："今天天气真好。"
-小雅："是呀！您今天出去散步了吗？外面暖和吗？"
-
-用户："我今天吃了红烧肉。"
-小雅："哎呀真好！您的红烧肉肯定很香吧？您是怎么做的来着？"
-
-用户："我昨天看了一部电影。"
-小雅："哦！是什么电影呀？好看吗？能给我讲讲是讲什么的吗？"
-
-用户："我有点记不清了。"
-小雅："没关系呀，慢慢想。咱们换个话题吧，您今天心情怎么样？"
-"""
+        key = tts_cache_key(text, self.elevenlabs_voice_id, self.tts.model_id, self.TTS_VOICE_SETTINGS)
+        cached = await tts_cache.get(key)
+        if cached is not None:
+            return cached
         
-        # 添加RAG检索到的相关记忆
-        if relevant_memories:
-            memory_text = "\n".join([f"  - {mem}" for mem in relevant_memories])
-            base_prompt += f"\n\n# 历史记忆上下文（Memory Context）\n{memory_text}\n\n**提示**：你可以自然地提起这些往事，比如'您上次说...'、'您之前提到...'，这会让对话更个性化。"
+        inflight = self._tts_inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
         
-        return base_prompt
+        future = asyncio.get_running_loop().create_future()
+        self._tts_inflight[key] = future
+        try:
+            audio = await self._synthesize(text)
+            if audio:
+                await tts_cache.put(key, audio)
+            future.set_result(audio)
+            return audio
+        except BaseException:
+            # 合成被取消时，等待同一结果的请求按合成失败处理（空音频）
+            future.set_result(b"")
+            raise
+        finally:
+            self._tts_inflight.pop(key, None)
+    
+    async def _synthesize(self, text: str) -> bytes:
+        """调用语音合成服务合成一句话，失败时返回空音频"""
+        try:
+            return await resilience.call(
+                "tts", self.tts.name,
+                lambda: self.tts.synthesize(text, self.elevenlabs_voice_id, self.TTS_VOICE_SETTINGS)
+            )
+        except Exception as e:
+            print(f"TTS Error: {e}")
+            record_upstream_error("tts", self.tts.name, e)
+            record_fallback("tts_failed")
+            return b""
     
     def _format_history(self, history: list) -> str:
         """格式化对话历史"""
@@ -278,11 +410,89 @@ class AIServices:
             formatted.append(f"你: {item['ai_text']}")
         return "\n".join(formatted)
     
-    async def generate_biography(self, all_conversations: list) -> Dict[str, Any]:
+    async def summarize_conversations(self, period: str, conversations: list) -> str:
+        """
+        人生纪要第一层摘要：某一天的对话 → 简短摘要
+        
+        保留人物、经历、喜好和认知方面的迹象（附原话），供月度合并和最终纪要使用
+        """
+        transcript = "\n".join(
+            f"[{conv.timestamp:%H:%M}] 老人: {conv.user_text}\nAI: {conv.ai_text}"
+            for conv in conversations
+        )
+        prompt = f"""以下是老人在 {period} 与AI陪伴者的对话记录。请写一段不超过200字的中文摘要，保留：
+- 老人提到的人物、地点、年代和经历
+- 喜好、习惯和日常活动
+- 情绪状态
+- 记忆混乱、时间定向错误、找词困难等认知方面的迹象（如有，引用原话）
+
+只输出摘要正文。
+
+对话记录:
+{transcript}"""
+        return await self._summarize(prompt, max_tokens=300, llm=self.biography_llm)
+    
+    async def merge_summaries(self, period: str, summaries: List[Tuple[str, str]]) -> str:
+        """人生纪要第二层摘要：一个月内各天的摘要 (日期, 摘要) → 月度摘要"""
+        text = "\n\n".join(f"[{day}]\n{summary}" for day, summary in summaries)
+        prompt = f"""以下是老人在 {period} 每天对话的摘要。请合并为一段不超过400字的中文月度摘要：
+保留重要的经历和人物、反复出现的话题、情绪变化，以及认知方面的迹象（注明日期）；去掉重复内容。
+
+只输出摘要正文。
+
+每日摘要:
+{text}"""
+        return await self._summarize(prompt, max_tokens=600, llm=self.biography_llm)
+    
+    async def consolidate_memories(self, conversations: List[Tuple[datetime, str, str]]) -> str:
+        """记忆整理：同一话题的多条旧对话 (时间, 老人说, AI回复) → 一条长期记忆（见 consolidation.py）"""
+        transcript = "\n".join(
+            f"[{timestamp:%Y-%m-%d}] 老人: {user_text}\nAI: {ai_text}"
+            for timestamp, user_text, ai_text in conversations
+        )
+        prompt = f"""以下是老人在不同时间说过的、话题相近的几段对话。请整理成一条不超过150字的长期记忆，
+供以后聊天时回忆使用：用第三人称陈述老人提到的事实、人物、地点、喜好和经历，保留具体的名字和时间；
+只写老人说过的内容，不要写AI的回复，也不要评价。
+
+只输出记忆正文。
+
+对话记录:
+{transcript}"""
+        return await self._summarize(prompt, max_tokens=250)
+    
+    async def _summarize(self, prompt: str, max_tokens: int, llm: Optional[LLMProvider] = None) -> str:
+        """
+        调用对话模型做摘要（默认为对话模型，人生纪要的摘要用人生纪要的模型）；失败时抛出异常
+        （已完成的摘要已保存，重试时不会重做）
+        
+        摘要会被保存并长期复用（人生纪要、记忆整理），本地模拟LLM的输出不能当作摘要
+        """
+        llm = llm or self.llm
+        if llm.name == "fake":
+            raise Exception("当前为本地模拟LLM，无法生成摘要")
+        
+        try:
+            return await llm.complete(
+                [
+                    {"role": "system", "content": "你是一名细心的记录员，负责为老人整理对话摘要，忠实于原文，不编造内容。"},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                max_tokens=max_tokens,
+                timeout=60.0
+            )
+        except Exception as e:
+            record_upstream_error("summary", llm.name, e)
+            raise
+    
+    async def generate_biography(self, period_summaries: List[Tuple[str, str]]) -> Dict[str, Any]:
         """
         生成传记和认知评估（演示用）
+        
+        输入为按月份整理的对话摘要 (月份, 摘要)，见 biography.py；
+        prompt长度只与月份数有关，不随对话总数增长
         """
-        if not self.gemini_api_key:
+        if self.biography_llm.name == "fake":
             return {
                 "biography": "## 李建国的人生故事\n\n暂无对话记录",
                 "cognitive_assessment": {
@@ -294,19 +504,18 @@ class AIServices:
                 }
             }
         
-        # 汇总所有对话
-        all_text = "\n\n".join([
-            f"[{conv.timestamp}]\n老人: {conv.user_text}\nAI: {conv.ai_text}"
-            for conv in all_conversations
-        ])
+        # 汇总各月摘要
+        all_text = "\n\n".join(
+            f"[{period}]\n{summary}" for period, summary in period_summaries
+        )
         
-        analysis_prompt = f"""基于以下对话记录，生成两部分内容：
+        analysis_prompt = f"""基于以下按月份整理的对话摘要，生成两部分内容：
 
 1. 一份温暖的"人生纪要"（Markdown格式），包括：
    - 老人提到的重要经历
    - 喜好和习惯
    - 情感状态
-   
+
 2. 一份认知健康评估（JSON格式），包括：
    - overall_risk: 高风险/中风险/低风险
    - memory_score: 0-10分
@@ -314,52 +523,40 @@ class AIServices:
    - language_fluency: 0-10分
    - concerns: 数组，列出具体关注点
 
-对话记录:
+对话摘要:
 {all_text}
 
 请以JSON格式返回: {{"biography": "...", "cognitive_assessment": {{...}}}}
 """
-        
+
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-pro:generateContent?key={self.gemini_api_key}",
-                    json={
-                        "contents": [{
-                            "parts": [{
-                                "text": analysis_prompt
-                            }]
-                        }],
-                        "generationConfig": {
-                            "temperature": 0.7,
-                            "maxOutputTokens": 2000,
-                        }
+            result_text = await self.biography_llm.complete(
+                [{"role": "user", "content": analysis_prompt}],
+                temperature=0.7,
+                max_tokens=2000,
+                timeout=60.0
+            )
+            
+            # 尝试解析JSON
+            try:
+                result = json.loads(result_text)
+                return result
+            except:
+                # 如果不是纯JSON，手动解析
+                return {
+                    "biography": result_text,
+                    "cognitive_assessment": {
+                        "overall_risk": "未评估",
+                        "memory_score": 0,
+                        "time_orientation": 0,
+                        "language_fluency": 0,
+                        "concerns": []
                     }
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    result_text = data['candidates'][0]['content']['parts'][0]['text']
-                    
-                    # 尝试解析JSON
-                    try:
-                        result = json.loads(result_text)
-                        return result
-                    except:
-                        # 如果不是纯JSON，手动解析
-                        return {
-                            "biography": result_text,
-                            "cognitive_assessment": {
-                                "overall_risk": "未评估",
-                                "memory_score": 0,
-                                "time_orientation": 0,
-                                "language_fluency": 0,
-                                "concerns": []
-                            }
-                        }
-                        
+                }
+        
         except Exception as e:
             print(f"Biography Generation Error: {e}")
+            record_upstream_error("biography", self.biography_llm.name, e)
             return {
                 "biography": "生成失败",
                 "cognitive_assessment": {"overall_risk": "错误"}
@@ -503,8 +700,8 @@ JSON格式：
         
         注意：不提供模拟数据，必须调用真实LLM
         """
-        if not self.siliconflow_api_key:
-            raise Exception("未配置硅基流动API Key，无法进行分析")
+        if self.llm.name == "fake":
+            raise Exception("未配置硅基流动API Key（当前为本地模拟LLM），无法进行分析")
         
         if not all_conversations or len(all_conversations) == 0:
             raise Exception("没有对话记录，无法进行分析")
@@ -515,9 +712,6 @@ JSON格式：
             for i, conv in enumerate(all_conversations[:30])
         ])
         
-        # 构建分析智能体的System Prompt
-        analyst_system_prompt = self._build_analyst_agent_prompt()
-        
         # 构建用户消息（对话转录本）
         user_message = f"""# 对话转录本
 
@@ -525,59 +719,91 @@ JSON格式：
 
 # 请开始分析
 请严格按照JSON格式返回分析结果。"""
+
+        print("🔍 [分析智能体] 开始深度临床语言学分析...")
+        print(f"   对话数量: {len(all_conversations[:30])}轮")
+        return await self._run_analyst_agent(user_message)
+    
+    async def update_dashboard_insights(
+        self,
+        previous_insights: Dict[str, Any],
+        new_conversations: list
+    ) -> Dict[str, Any]:
+        """
+        分析智能体的增量模式：只分析新增对话，并与上一次的分析结果合并
+        
+        输入规模与新增对话数成正比，而不是与全部历史成正比
+        """
+        if self.llm.name == "fake":
+            raise Exception("未配置硅基流动API Key（当前为本地模拟LLM），无法进行分析")
+        
+        if not new_conversations:
+            return previous_insights
+        
+        conversations_text = "\n\n".join([
+            f"[新增对话 {i+1}]\n时间: {conv.timestamp}\n用户: {conv.user_text}\nAI: {conv.ai_text}"
+            for i, conv in enumerate(new_conversations)
+        ])
+        previous_text = json.dumps(previous_insights, ensure_ascii=False)
+        
+        user_message = f"""# 之前的分析结果（基于更早的对话）
+
+{previous_text}
+
+# 新增对话转录本
+
+{conversations_text}
+
+# 请开始增量分析
+请结合新增对话更新之前的分析结果：新增对话中出现新证据时调整对应评分、理由和引文，
+没有新证据的属性保持原样；个人信息和情绪分析在原有基础上合并补充。
+请严格按照同样的JSON格式返回完整的分析结果。"""
+
+        print("🔍 [分析智能体] 开始增量分析...")
+        print(f"   新增对话数量: {len(new_conversations)}轮")
+        return await self._run_analyst_agent(user_message)
+    
+    async def _run_analyst_agent(self, user_message: str) -> Dict[str, Any]:
+        """调用分析智能体并解析其JSON输出"""
+        # 构建分析智能体的System Prompt
+        analyst_system_prompt = self._build_analyst_agent_prompt()
         
         try:
-            print(f"🔍 [分析智能体] 开始深度临床语言学分析...")
-            print(f"   对话数量: {len(all_conversations[:30])}轮")
+            result_text = await self.llm.complete(
+                [
+                    {"role": "system", "content": analyst_system_prompt},
+                    {"role": "user", "content": user_message}
+                ],
+                temperature=0.2,  # 低温度，更加客观
+                max_tokens=2500,  # 增加token限制以支持详细分析
+                timeout=120.0     # 增加超时时间到120秒
+            )
             
-            async with httpx.AsyncClient(timeout=120.0) as client:  # 增加超时时间到120秒
-                response = await client.post(
-                    "https://api.siliconflow.cn/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.siliconflow_api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "Qwen/Qwen2.5-7B-Instruct",
-                        "messages": [
-                            {"role": "system", "content": analyst_system_prompt},
-                            {"role": "user", "content": user_message}
-                        ],
-                        "temperature": 0.2,  # 低温度，更加客观
-                        "max_tokens": 2500   # 增加token限制以支持详细分析
-                    }
-                )
+            print(f"   原始响应长度: {len(result_text)}字符")
+            
+            # 清理markdown标记
+            result_text = result_text.replace("```json", "").replace("```", "").strip()
+            
+            # 尝试解析JSON
+            try:
+                insights = json.loads(result_text)
+                print("✅ [分析智能体] 临床分析完成")
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    result_text = data['choices'][0]['message']['content'].strip()
-                    
-                    print(f"   原始响应长度: {len(result_text)}字符")
-                    
-                    # 清理markdown标记
-                    result_text = result_text.replace("```json", "").replace("```", "").strip()
-                    
-                    # 尝试解析JSON
-                    try:
-                        insights = json.loads(result_text)
-                        print(f"✅ [分析智能体] 临床分析完成")
-                        
-                        # 验证必要字段存在
-                        if "clinical_biomarkers" not in insights:
-                            raise Exception("分析结果缺少clinical_biomarkers字段")
-                        
-                        return insights
-                    
-                    except json.JSONDecodeError as e:
-                        print(f"❌ JSON解析失败: {e}")
-                        print(f"原始响应（前500字符）: {result_text[:500]}")
-                        raise Exception(f"AI返回的分析结果格式错误: {str(e)}")
+                # 验证必要字段存在
+                if "clinical_biomarkers" not in insights:
+                    raise Exception("分析结果缺少clinical_biomarkers字段")
                 
-                else:
-                    error_msg = f"Qwen API错误 [{response.status_code}]: {response.text}"
-                    print(f"❌ {error_msg}")
-                    raise Exception(error_msg)
-                    
+                return insights
+            
+            except json.JSONDecodeError as e:
+                print(f"❌ JSON解析失败: {e}")
+                print(f"原始响应（前500字符）: {result_text[:500]}")
+                raise Exception(f"AI返回的分析结果格式错误: {str(e)}")
+        
+        except ProviderError as e:
+            print(f"❌ [分析智能体] 分析失败: {e}")
+            record_upstream_error("analyst", self.llm.name, e)
+            raise
         except Exception as e:
             print(f"❌ [分析智能体] 分析失败: {e}")
             import traceback
@@ -0,0 +1,191 @@
+"""
+语音识别前的本地音频预处理 - 解码 → 单声道16kHz → 裁掉首尾静音 → 重新编码
+
+浏览器上传的是 webm/opus（双声道48kHz居多，开头结尾常带一两秒静音），
+预处理后上传体积更小、音频更短，STT更快也更便宜。
+
+解码/编码是CPU密集型操作，放在独立的进程池中执行，不阻塞事件循环；
+本模块在子进程中被导入，因此只依赖 PyAV、NumPy 和同样无依赖的 endpointing，不导入应用的其他模块。
+未安装 PyAV（pip install av）或处理失败时，调用方按原样上传音频。
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from endpointing import ENDPOINT_FRAME_MS, frame_features, speech_duration_ms
+
+try:
+    import av
+except ImportError:
+    av = None
+
+
+AUDIO_PREPROCESS_ENABLED = os.getenv("AUDIO_PREPROCESS_ENABLED", "1") == "1"
+AUDIO_PREPROCESS_WORKERS = int(os.getenv("AUDIO_PREPROCESS_WORKERS", "2"))
+AUDIO_TARGET_RATE = int(os.getenv("AUDIO_TARGET_RATE", "16000"))
+# 重新编码的格式：flac（无损，约为WAV的一半大小）或 wav
+AUDIO_OUTPUT_FORMAT = os.getenv("AUDIO_OUTPUT_FORMAT", "flac")
+
+# 静音裁剪：与端点检测相同的20ms分帧（endpointing.frame_features），
+# 能量高于 max(底噪 + 余量, 下限) 的帧视为语音，首尾各保留一点余量；
+# 底噪估计（最安静的10%帧）不超过 TRIM_NOISE_CEILING_DBFS，几乎整段都在说话时不会把语音当成底噪
+TRIM_MARGIN_DB = float(os.getenv("AUDIO_TRIM_MARGIN_DB", "12"))
+TRIM_FLOOR_DBFS = float(os.getenv("AUDIO_TRIM_FLOOR_DBFS", "-50"))
+TRIM_NOISE_CEILING_DBFS = float(os.getenv("AUDIO_TRIM_NOISE_CEILING_DBFS", "-40"))
+TRIM_PADDING_MS = int(os.getenv("AUDIO_TRIM_PADDING_MS", "200"))
+
+CONTENT_TYPES = {"flac": "audio/flac", "wav": "audio/wav"}
+
+
+def decode_to_pcm(audio_data: bytes, rate: int = AUDIO_TARGET_RATE) -> np.ndarray:
+    """把任意容器/编码的音频解码为单声道 int16 PCM"""
+    chunks = []
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=rate)
+    with av.open(io.BytesIO(audio_data)) as container:
+        stream = container.streams.audio[0]
+        try:
+            for frame in container.decode(stream):
+                for resampled in resampler.resample(frame):
+                    chunks.append(resampled.to_ndarray().reshape(-1))
+        except av.error.InvalidDataError:
+            # 通话中做中间识别时，音频可能在半个分片处截断；保留已解码的部分
+            pass
+    for resampled in resampler.resample(None):
+        chunks.append(resampled.to_ndarray().reshape(-1))
+    if not chunks:
+        return np.zeros(0, dtype=np.int16)
+    return np.concatenate(chunks).astype(np.int16, copy=False)
+
+
+def trim_silence(pcm: np.ndarray, rate: int = AUDIO_TARGET_RATE) -> np.ndarray:
+    """裁掉首尾静音（基于能量的简单VAD）；没有检测到语音时返回空数组"""
+    energy, _ = frame_features(pcm, rate)
+    if len(energy) == 0:
+        return pcm
+    
+    noise_floor = min(float(np.percentile(energy, 10)), TRIM_NOISE_CEILING_DBFS)
+    threshold = max(noise_floor + TRIM_MARGIN_DB, TRIM_FLOOR_DBFS)
+    voiced = np.flatnonzero(energy > threshold)
+    if len(voiced) == 0:
+        return pcm[:0]
+    
+    frame_len = rate * ENDPOINT_FRAME_MS // 1000
+    padding = rate * TRIM_PADDING_MS // 1000
+    start = max(voiced[0] * frame_len - padding, 0)
+    end = min((voiced[-1] + 1) * frame_len + padding, len(pcm))
+    return pcm[start:end]
+
+
+def encode_pcm(pcm: np.ndarray, rate: int = AUDIO_TARGET_RATE, fmt: str = AUDIO_OUTPUT_FORMAT) -> bytes:
+    out = io.BytesIO()
+    if fmt == "wav":
+        with wave.open(out, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes(pcm.tobytes())
+        return out.getvalue()
+    
+    with av.open(out, "w", format=fmt) as container:
+        stream = container.add_stream(fmt, rate=rate)
+        stream.layout = "mono"
+        stream.format = "s16"
+        frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = rate
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue()
+
+
+def preprocess_audio(audio_data: bytes) -> Dict[str, Any]:
+    """在子进程中执行：解码、裁剪静音、统计语音时长、重新编码"""
+    start = time.perf_counter()
+    pcm = decode_to_pcm(audio_data)
+    trimmed = trim_silence(pcm)
+    return {
+        "speech_ms": speech_duration_ms(trimmed, AUDIO_TARGET_RATE) if len(trimmed) else 0,
+        "audio": encode_pcm(trimmed) if len(trimmed) else b"",
+        "filename": f"audio.{AUDIO_OUTPUT_FORMAT}",
+        "content_type": CONTENT_TYPES.get(AUDIO_OUTPUT_FORMAT, "application/octet-stream"),
+        "input_seconds": round(len(pcm) / AUDIO_TARGET_RATE, 2),
+        "speech_seconds": round(len(trimmed) / AUDIO_TARGET_RATE, 2),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+class AudioPreprocessor:
+    """进程池中的音频预处理（懒创建进程池）"""
+    
+    def __init__(self, workers: int = AUDIO_PREPROCESS_WORKERS, enabled: bool = AUDIO_PREPROCESS_ENABLED):
+        self.workers = workers
+        self.enabled = enabled and av is not None
+        if enabled and av is None:
+            print("⚠️  未安装PyAV（pip install av），跳过音频预处理")
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._stats = {
+            "processed": 0,
+            "failures": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "input_seconds": 0.0,
+            "speech_seconds": 0.0,
+        }
+    
+    async def process(self, audio_data: bytes) -> Optional[Dict[str, Any]]:
+        """预处理一段音频；未启用或失败时返回 None（调用方应按原样上传）"""
+        if not self.enabled or not audio_data:
+            return None
+        if self._pool is None:
+            # 使用spawn：主进程里有事件循环和其他线程，fork出的子进程可能继承到持有中的锁
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._pool, preprocess_audio, audio_data
+            )
+        except Exception as e:
+            self._stats["failures"] += 1
+            if isinstance(e, BrokenProcessPool):
+                # 子进程异常退出后进程池不可再用，下次重新创建
+                self._pool = None
+            print(f"⚠️  音频预处理失败，按原样上传: {e}")
+            return None
+        
+        self._stats["processed"] += 1
+        self._stats["bytes_in"] += len(audio_data)
+        self._stats["bytes_out"] += len(result["audio"])
+        self._stats["input_seconds"] += result["input_seconds"]
+        self._stats["speech_seconds"] += result["speech_seconds"]
+        return result
+    
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "input_seconds": round(self._stats["input_seconds"], 1),
+            "speech_seconds": round(self._stats["speech_seconds"], 1),
+            "size_ratio": round(self._stats["bytes_out"] / self._stats["bytes_in"], 3)
+            if self._stats["bytes_in"] else None,
+        }
+
+
+# 全局实例
+audio_preprocessor = AudioPreprocessor()
@@ -0,0 +1,395 @@
+"""
+端到端压测 - /api/chat、/api/conversations、/api/dashboard/insights
+
+用法：
+1. 准备数据：python seed_demo_data.py --bulk 100000 --sessions 100
+2. 用本地模拟服务启动后端（不消耗API额度，见 fake_providers.py）：
+   STT_PROVIDER=fake LLM_PROVIDER=fake TTS_PROVIDER=fake FAKE_SEED=42 uvicorn main:app --port 8000
+3. 压测：python benchmark.py run --concurrency 16 --duration 60 --label baseline
+   加 --in-process 则在本进程内启动应用（自动使用模拟服务），不需要第2步
+4. 对比：python benchmark.py compare bench_results/旧.json bench_results/新.json
+
+每个并发worker循环按 --mix 的权重随机选择场景发请求（闭环压测）。
+各阶段耗时来自响应的 Server-Timing 头，客户端另外记录 ttfb（首字节）和完整响应耗时；
+预热阶段的请求不计入结果。结果保存为JSON（含git提交和服务端 /api/stats），
+compare 任一指标变慢超过阈值时以非0状态码退出，可用于CI
+
+注意：/api/chat 会产生新对话，使洞察缓存失效，因此对话场景使用单独的老人（--chat-prefix），
+读取场景使用 seed_demo_data.py 生成的老人（已预置洞察缓存）
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import wave
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+
+SCENARIOS = ("chat", "conversations", "insights")
+DEFAULT_MIX = "chat=1,conversations=3,insights=2"
+RESULTS_DIR = os.getenv("BENCH_RESULTS_DIR", "./bench_results")
+# 与 seed_demo_data.py 的 BENCH_SESSION_PREFIX 一致
+READ_SESSION_PREFIX = "bench_elder_"
+CHAT_SESSION_PREFIX = "bench_chat_"
+
+
+def synthetic_utterance(variant: int, seconds: float = 2.0, rate: int = 16000) -> bytes:
+    """
+    合成一段"说话"音频（WAV）：带音节起伏的谐波，前后各有一小段静音
+    
+    能通过服务端的语音检测；不同 variant 的音频内容不同，模拟STT会识别出不同的句子
+    """
+    t = np.arange(int(rate * seconds)) / rate
+    pitch = 160 + 15 * variant
+    voice = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in (1, 2, 3))
+    syllables = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+    pcm = (2500 * voice * syllables).astype(np.int16)
+    silence = np.zeros(rate // 4, dtype=np.int16)
+    
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.concatenate([silence, pcm, silence]).tobytes())
+    return out.getvalue()
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """"stt;dur=812.4, llm;dur=950.1" -> {"stt": 812.4, "llm": 950.1}"""
+    stages = {}
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                stages[name] = float(value)
+    return stages
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"未知的压测场景: {name}（可选: {', '.join(SCENARIOS)}）")
+        weights[name] = float(weight or 1)
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 1),
+        "p95": round(float(p95), 1),
+        "p99": round(float(p99), 1),
+        "mean": round(float(np.mean(values)), 1),
+        "max": round(float(np.max(values)), 1),
+    }
+
+
+class ScenarioStats:
+    """一个场景的请求结果"""
+    
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.ttfb: List[float] = []
+        self.stages: Dict[str, List[float]] = {}
+        self.status_codes: Dict[str, int] = {}
+        self.errors = 0
+    
+    def add(self, status: str, ttfb_ms: Optional[float], total_ms: float, stages: Dict[str, float]):
+        self.status_codes[status] = self.status_codes.get(status, 0) + 1
+        if not status.startswith("2"):
+            self.errors += 1
+            return
+        self.latencies.append(total_ms)
+        if ttfb_ms is not None:
+            self.ttfb.append(ttfb_ms)
+        for name, ms in stages.items():
+            self.stages.setdefault(name, []).append(ms)
+    
+    def summary(self, measured_seconds: float) -> Dict[str, Any]:
+        requests = sum(self.status_codes.values())
+        return {
+            "requests": requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / requests, 4) if requests else 0.0,
+            "status_codes": self.status_codes,
+            "throughput_rps": round(len(self.latencies) / measured_seconds, 2) if measured_seconds else 0.0,
+            "latency_ms": _percentiles(self.latencies),
+            "ttfb_ms": _percentiles(self.ttfb),
+            "stages_ms": {name: _percentiles(values) for name, values in sorted(self.stages.items())},
+        }
+
+
+class Benchmark:
+    """闭环压测：concurrency 个worker在 duration 秒内不断发请求"""
+    
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.read_sessions = [f"{args.read_prefix}{i:04d}" for i in range(args.sessions)]
+        self.chat_sessions = [f"{args.chat_prefix}{i:04d}" for i in range(args.chat_sessions)]
+        self.audio = [synthetic_utterance(i) for i in range(args.audio_variants)]
+        self.stats = {name: ScenarioStats() for name in self.mix}
+        self.rng = np.random.default_rng(args.seed)
+    
+    async def _timed(self, method: str, url: str, **kwargs) -> Tuple[str, float, Dict[str, float]]:
+        start = time.perf_counter()
+        async with self.client.stream(method, url, **kwargs) as response:
+            ttfb = (time.perf_counter() - start) * 1000
+            await response.aread()
+        return str(response.status_code), ttfb, parse_server_timing(response.headers.get("server-timing", ""))
+    
+    async def _chat(self):
+        return await self._timed(
+            "POST",
+            "/api/chat",
+            params={"stream": "true"} if self.args.stream else None,
+            files={"audio": ("bench.wav", self.audio[self.rng.integers(len(self.audio))], "audio/wav")},
+            data={"session_id": self.chat_sessions[self.rng.integers(len(self.chat_sessions))]}
+        )
+    
+    async def _conversations(self):
+        return await self._timed(
+            "GET",
+            "/api/conversations",
+            params={
+                "session_id": self.read_sessions[self.rng.integers(len(self.read_sessions))],
+                "limit": self.args.limit
+            }
+        )
+    
+    async def _insights(self):
+        return await self._timed(
+            "GET",
+            "/api/dashboard/insights",
+            params={"session_id": self.read_sessions[self.rng.integers(len(self.read_sessions))]}
+        )
+    
+    async def _worker(self, deadline: float, warmup_until: float):
+        names = list(self.mix)
+        weights = np.array([self.mix[name] for name in names])
+        weights = weights / weights.sum()
+        while time.monotonic() < deadline:
+            scenario = names[self.rng.choice(len(names), p=weights)]
+            start = time.perf_counter()
+            try:
+                status, ttfb, stages = await getattr(self, f"_{scenario}")()
+            except httpx.HTTPError as e:
+                status, ttfb, stages = type(e).__name__, None, {}
+            total = (time.perf_counter() - start) * 1000
+            if time.monotonic() >= warmup_until:
+                self.stats[scenario].add(status, ttfb, total, stages)
+    
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        print(f"🏁 压测开始: 并发{args.concurrency}, {args.duration}秒（预热{args.warmup}秒）, 场景 {args.mix}")
+        started = time.monotonic()
+        warmup_until = started + args.warmup
+        deadline = warmup_until + args.duration
+        await asyncio.gather(*(self._worker(deadline, warmup_until) for _ in range(args.concurrency)))
+        measured = time.monotonic() - warmup_until
+        
+        scenarios = {name: stats.summary(measured) for name, stats in self.stats.items()}
+        return {
+            "label": args.label,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "config": {
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+                "warmup": args.warmup,
+                "mix": args.mix,
+                "stream": args.stream,
+                "sessions": args.sessions,
+                "chat_sessions": args.chat_sessions,
+                "limit": args.limit,
+                "in_process": args.in_process,
+                "url": None if args.in_process else args.url,
+            },
+            "measured_seconds": round(measured, 1),
+            "throughput_rps": round(sum(s["throughput_rps"] for s in scenarios.values()), 2),
+            "scenarios": scenarios,
+            "server_stats": await self._server_stats(),
+        }
+    
+    async def _server_stats(self) -> Optional[Dict[str, Any]]:
+        try:
+            response = await self.client.get("/api/stats")
+            return response.json() if response.status_code == 200 else None
+        except httpx.HTTPError:
+            return None
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        )
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\n📊 {result['label']}（{result['git_commit'] or '-'}）"
+          f" 总吞吐 {result['throughput_rps']} 请求/秒，统计 {result['measured_seconds']} 秒")
+    for name, summary in result["scenarios"].items():
+        latency = summary["latency_ms"]
+        print(f"\n[{name}] {summary['requests']} 请求, {summary['errors']} 错误, {summary['throughput_rps']} 请求/秒")
+        if not latency:
+            continue
+        print(f"   {'阶段':<14}{'p50':>10}{'p95':>10}{'p99':>10}")
+        rows = [("total(client)", latency), ("ttfb(client)", summary["ttfb_ms"])]
+        rows += list(summary["stages_ms"].items())
+        for stage, values in rows:
+            if values:
+                print(f"   {stage:<14}{values['p50']:>10}{values['p95']:>10}{values['p99']:>10}")
+
+
+def _comparable_metrics(result: Dict[str, Any]) -> Dict[Tuple[str, str], Tuple[float, bool]]:
+    """(场景, 指标) -> (数值, 是否越小越好)"""
+    metrics = {}
+    for name, summary in result["scenarios"].items():
+        metrics[(name, "throughput_rps")] = (summary["throughput_rps"], False)
+        metrics[(name, "error_rate")] = (summary["error_rate"], True)
+        for p in ("p50", "p95", "p99"):
+            if p in summary["latency_ms"]:
+                metrics[(name, f"latency.{p}")] = (summary["latency_ms"][p], True)
+        for stage, values in summary["stages_ms"].items():
+            metrics[(name, f"{stage}.p95")] = (values["p95"], True)
+    return metrics
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float, min_delta_ms: float = 5.0) -> List[str]:
+    """
+    逐项对比两次压测结果，返回变差超过阈值的指标
+    
+    耗时类指标还要求绝对差值超过 min_delta_ms，避免零点几毫秒的阶段因为相对变化大而误报
+    """
+    print(f"📈 对比: {base['label']}（{base.get('git_commit') or '-'}） → {new['label']}（{new.get('git_commit') or '-'}）")
+    print(f"   {'场景':<14}{'指标':<22}{'之前':>10}{'现在':>10}{'变化':>10}")
+    base_metrics = _comparable_metrics(base)
+    new_metrics = _comparable_metrics(new)
+    regressions = []
+    for key in sorted(base_metrics.keys() & new_metrics.keys()):
+        (before, lower_is_better), (after, _) = base_metrics[key], new_metrics[key]
+        if key[1] == "error_rate":
+            # 错误率比较绝对值：上升超过1个百分点算变差
+            worse = after - before > 0.01
+            change = f"{(after - before) * 100:+.2f}pp"
+        else:
+            ratio = (after - before) / before if before else 0.0
+            if lower_is_better:
+                worse = ratio > threshold and after - before > min_delta_ms
+            else:
+                worse = ratio < -threshold
+            change = f"{ratio * 100:+.1f}%"
+        marker = " ⚠️" if worse else ""
+        print(f"   {key[0]:<14}{key[1]:<22}{before:>10}{after:>10}{change:>10}{marker}")
+        if worse:
+            regressions.append(f"{key[0]} {key[1]}: {before} → {after}")
+    return regressions
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    app_module = None
+    if args.in_process:
+        # 在导入应用之前指定模拟服务（.env 不会覆盖已有的环境变量）
+        for kind in ("STT", "LLM", "TTS"):
+            os.environ.setdefault(f"{kind}_PROVIDER", "fake")
+        import main as app_module
+        await app_module.startup_event()
+        transport = httpx.ASGITransport(app=app_module.app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=args.timeout)
+    else:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits)
+    
+    try:
+        return await Benchmark(client, args).run()
+    finally:
+        await client.aclose()
+        if app_module is not None:
+            await app_module.shutdown_event()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语客颂 端到端压测")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    run = commands.add_parser("run", help="执行压测")
+    run.add_argument("--url", default="http://127.0.0.1:8000", help="后端地址")
+    run.add_argument("--in-process", action="store_true", help="在本进程内启动应用（使用模拟服务）")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--duration", type=float, default=30, help="统计时长（秒）")
+    run.add_argument("--warmup", type=float, default=3, help="预热时长（秒），期间的请求不计入结果")
+    run.add_argument("--mix", default=DEFAULT_MIX, help="场景权重，例如 chat=1,conversations=3,insights=2")
+    run.add_argument("--stream", action="store_true", help="/api/chat 使用流式响应")
+    run.add_argument("--sessions", type=int, default=100, help="读取场景使用的老人数量（与 seed_demo_data.py 一致）")
+    run.add_argument("--read-prefix", default=READ_SESSION_PREFIX)
+    run.add_argument("--chat-sessions", type=int, default=20, help="对话场景使用的老人数量")
+    run.add_argument("--chat-prefix", default=CHAT_SESSION_PREFIX)
+    run.add_argument("--audio-variants", type=int, default=8, help="合成几种不同的语音")
+    run.add_argument("--limit", type=int, default=50, help="/api/conversations 的 limit")
+    run.add_argument("--timeout", type=float, default=60)
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--label", default="run")
+    run.add_argument("--output", help=f"结果文件（默认 {RESULTS_DIR}/时间_标签.json）")
+    run.add_argument("--baseline", help="压测完成后与这份结果对比")
+    run.add_argument("--threshold", type=float, default=0.1, help="对比时变慢多少算退化（默认10%%）")
+    run.add_argument("--min-delta-ms", type=float, default=5.0, help="耗时至少变慢多少毫秒才算退化")
+    
+    cmp = commands.add_parser("compare", help="对比两次压测结果")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--threshold", type=float, default=0.1)
+    cmp.add_argument("--min-delta-ms", type=float, default=5.0)
+    
+    args = parser.parse_args()
+    
+    if args.command == "run":
+        result = asyncio.run(_run(args))
+        print_report(result)
+        output = args.output or os.path.join(
+            RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{args.label}.json"
+        )
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 结果已保存: {output}")
+        if not args.baseline:
+            return
+        baseline_path, current = args.baseline, result
+    else:
+        baseline_path = args.baseline
+        with open(args.current, encoding="utf-8") as f:
+            current = json.load(f)
+    
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(baseline, current, args.threshold, args.min_delta_ms)
+    if regressions:
+        print(f"\n❌ {len(regressions)} 项指标退化超过阈值:")
+        for line in regressions:
+            print(f"   - {line}")
+        sys.exit(1)
+    print("\n✅ 没有退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+人生纪要 - 长期对话历史的分层摘要（map-reduce）
+
+1. 按天切分对话，每天摘要一次（并发执行，同时进行的摘要数有上限）
+2. 每月把各天的摘要合并为月度摘要
+3. 用各月摘要生成最终的人生纪要和认知评估
+
+每天、每月的摘要保存在 conversation_summaries 表中，并记录覆盖到的最后一条对话；
+再次生成时只重新摘要出现了新对话的天和月，成本与新增对话量成正比，而不是对话总数
+
+对话时间以UTC保存，按老人当地的日期切分（BIOGRAPHY_UTC_OFFSET_HOURS，默认为服务器本地时区），
+晚上聊的天不会被算到第二天
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, ChatHistory, ConversationSummary, DEFAULT_SESSION_ID, IS_SQLITE
+from ai_services import ai_services
+
+
+# 同时进行的摘要调用数上限（所有老人共享）
+BIOGRAPHY_SUMMARY_CONCURRENCY = int(os.getenv("BIOGRAPHY_SUMMARY_CONCURRENCY", "4"))
+# 一天的对话超过这么多字时，拆成几段分别摘要（避免超出模型上下文）
+BIOGRAPHY_CHUNK_MAX_CHARS = int(os.getenv("BIOGRAPHY_CHUNK_MAX_CHARS", "8000"))
+# 老人当地时间相对UTC的偏移（小时），用于按当地日期切分对话
+BIOGRAPHY_UTC_OFFSET_HOURS = float(os.getenv(
+    "BIOGRAPHY_UTC_OFFSET_HOURS", str(datetime.now().astimezone().utcoffset().total_seconds() / 3600)
+))
+_UTC_OFFSET = timedelta(hours=BIOGRAPHY_UTC_OFFSET_HOURS)
+
+_summary_slots = asyncio.Semaphore(BIOGRAPHY_SUMMARY_CONCURRENCY)
+
+# 同一个老人同一时刻只允许一次摘要，避免重复调用和并发写同一行
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+# 每个时段（天/月）的对话条数和最后一条对话ID，用于判断摘要是否过期
+PeriodStats = Dict[str, Tuple[int, int]]
+
+
+async def build_biography(db: AsyncSession, session_id: str = DEFAULT_SESSION_ID) -> Dict[str, Any]:
+    """生成人生纪要和认知评估（HTTP端点和后台任务共用）"""
+    # 条数和首末时间用SQL聚合，不加载对话
+    total, first_ts, last_ts = (await db.execute(
+        select(
+            func.count(ChatHistory.id),
+            func.min(ChatHistory.timestamp),
+            func.max(ChatHistory.timestamp)
+        ).where(ChatHistory.session_id == session_id)
+    )).one()
+    # 摘要耗时较长，先结束读事务把连接还给连接池
+    await db.commit()
+    
+    if not total:
+        return {
+            "biography": "## 暂无对话记录\n\n请先与老人进行对话。",
+            "cognitive_assessment": {
+                "overall_risk": "未评估",
+                "memory_score": 0,
+                "time_orientation": 0,
+                "language_fluency": 0,
+                "concerns": ["暂无数据"]
+            },
+            "total_conversations": 0
+        }
+    
+    # 人生纪要使用模拟服务时 generate_biography 返回演示内容，不必做摘要（摘要同样使用人生纪要的模型）
+    monthly = await summarize_history(session_id) if ai_services.biography_llm.name != "fake" else []
+    
+    # 调用AI生成传记和评估
+    result = await ai_services.generate_biography(monthly)
+    
+    return {
+        **result,
+        "total_conversations": total,
+        "first_conversation": first_ts.isoformat(),
+        "last_conversation": last_ts.isoformat()
+    }
+
+
+async def summarize_history(session_id: str = DEFAULT_SESSION_ID) -> List[Tuple[str, str]]:
+    """
+    更新某个老人过期的每日、每月摘要，返回全部月度摘要 [(月份, 摘要)]（按时间正序）
+    
+    某一天的摘要失败时抛出异常，已完成的摘要已经保存，下次只需补做剩下的
+    """
+    lock = _locks.setdefault(session_id, asyncio.Lock())
+    async with lock:
+        async with SessionLocal() as db:
+            days = await _day_stats(db, session_id)
+            day_rows = await _load_summaries(db, session_id, "day")
+            month_rows = await _load_summaries(db, session_id, "month")
+        
+        stale_days = [day for day, stats in days.items() if not _is_fresh(day_rows.get(day), stats)]
+        if stale_days:
+            print(f"📝 人生纪要：摘要 {len(stale_days)}/{len(days)} 天的对话（{session_id}）")
+        await _gather_all(*(_summarize_day(session_id, day, days[day]) for day in stale_days))
+        
+        months: PeriodStats = {}
+        for day, (count, last_id) in days.items():
+            month_count, month_last_id = months.get(day[:7], (0, 0))
+            months[day[:7]] = (month_count + count, max(month_last_id, last_id))
+        
+        stale_months = [month for month, stats in months.items() if not _is_fresh(month_rows.get(month), stats)]
+        if stale_months:
+            async with SessionLocal() as db:
+                day_rows = await _load_summaries(db, session_id, "day")
+            # 只合并当前仍有对话的日期（改变时区偏移前按旧日期保存的摘要不再使用）
+            day_rows = {day: row for day, row in day_rows.items() if day in days}
+            await _gather_all(*(
+                _summarize_month(session_id, month, months[month], day_rows) for month in stale_months
+            ))
+        
+        async with SessionLocal() as db:
+            month_rows = await _load_summaries(db, session_id, "month")
+        return [(month, month_rows[month].summary) for month in sorted(months)]
+
+
+def _local_date():
+    """对话的当地日期（SQL表达式）"""
+    if IS_SQLITE:
+        return func.date(ChatHistory.timestamp, f"{int(_UTC_OFFSET.total_seconds()):+d} seconds")
+    return func.date(ChatHistory.timestamp + _UTC_OFFSET)
+
+
+async def _day_stats(db: AsyncSession, session_id: str) -> PeriodStats:
+    """每天（当地日期）的对话条数和最后一条对话ID（SQL聚合）"""
+    day = _local_date()
+    rows = (await db.execute(
+        select(day, func.count(ChatHistory.id), func.max(ChatHistory.id)).where(
+            ChatHistory.session_id == session_id
+        ).group_by(day).order_by(day)
+    )).all()
+    return {str(period): (count, last_id) for period, count, last_id in rows}
+
+
+async def _load_summaries(db: AsyncSession, session_id: str, level: str) -> Dict[str, ConversationSummary]:
+    rows = (await db.execute(
+        select(ConversationSummary).where(
+            ConversationSummary.session_id == session_id,
+            ConversationSummary.level == level
+        )
+    )).scalars().all()
+    return {row.period: row for row in rows}
+
+
+def _is_fresh(row: Optional[ConversationSummary], stats: Tuple[int, int]) -> bool:
+    return row is not None and (row.conversation_count, row.last_conversation_id) == stats
+
+
+async def _summarize_day(session_id: str, day: str, stats: Tuple[int, int]):
+    # 当地日期的起止时间换算为UTC
+    start = datetime.fromisoformat(day) - _UTC_OFFSET
+    async with SessionLocal() as db:
+        rows = (await db.execute(
+            select(ChatHistory.timestamp, ChatHistory.user_text, ChatHistory.ai_text).where(
+                ChatHistory.session_id == session_id,
+                ChatHistory.timestamp >= start,
+                ChatHistory.timestamp < start + timedelta(days=1)
+            ).order_by(ChatHistory.timestamp.asc())
+        )).all()
+    conversations = [
+        SimpleNamespace(timestamp=row.timestamp + _UTC_OFFSET, user_text=row.user_text, ai_text=row.ai_text)
+        for row in rows
+    ]
+    
+    # 对话太多时拆成几段分别摘要，再按顺序拼接
+    parts = await _gather_all(*(
+        _limited(ai_services.summarize_conversations(day, chunk))
+        for chunk in _split_by_chars(conversations, BIOGRAPHY_CHUNK_MAX_CHARS)
+    ))
+    await _save_summary(session_id, "day", day, stats, "\n".join(parts))
+
+
+async def _summarize_month(
+    session_id: str,
+    month: str,
+    stats: Tuple[int, int],
+    day_rows: Dict[str, ConversationSummary]
+):
+    daily = [(day, row.summary) for day, row in sorted(day_rows.items()) if day.startswith(month)]
+    if len(daily) == 1:
+        # 只有一天时直接沿用当天的摘要
+        summary = daily[0][1]
+    else:
+        summary = await _limited(ai_services.merge_summaries(month, daily))
+    await _save_summary(session_id, "month", month, stats, summary)
+
+
+async def _gather_all(*coros) -> list:
+    """并发执行，全部结束后再抛出第一个异常（其余摘要照常完成并保存）"""
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def _limited(coro):
+    async with _summary_slots:
+        return await coro
+
+
+def _split_by_chars(conversations: list, max_chars: int) -> List[list]:
+    chunks, current, size = [], [], 0
+    for conv in conversations:
+        length = len(conv.user_text) + len(conv.ai_text)
+        if current and size + length > max_chars:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(conv)
+        size += length
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def _save_summary(session_id: str, level: str, period: str, stats: Tuple[int, int], summary: str):
+    async with SessionLocal() as db:
+        row = (await db.execute(
+            select(ConversationSummary).where(
+                ConversationSummary.session_id == session_id,
+                ConversationSummary.level == level,
+                ConversationSummary.period == period
+            )
+        )).scalar_one_or_none()
+        if row is None:
+            row = ConversationSummary(session_id=session_id, level=level, period=period)
+            db.add(row)
+        row.conversation_count, row.last_conversation_id = stats
+        row.summary = summary
+        row.updated_at = datetime.utcnow()
+        await db.commit()
@@ -0,0 +1,351 @@
+"""
+WebSocket通话会话 - 全双工通话（/ws/call）
+
+音频格式通过查询参数 format 选择：
+- webm（默认）：客户端自己判断说完，二进制帧是MediaRecorder按时间片产出的webm片段，
+  按序拼接即为完整文件
+- pcm16：客户端持续发送 16kHz 单声道 16-bit 小端PCM，由服务端端点检测（endpointing.py）
+  判断开始说话和说完，自动开始识别和回复，客户端不再需要静音计时器
+
+协议（客户端 → 服务端）：
+- 二进制帧：音频分片
+- {"type": "end_of_utterance"}：这句话说完了，开始识别和回复（pcm16 模式下可选，用于手动结束）
+- {"type": "cancel"}：丢弃当前这句话（例如录音太短）
+- {"type": "interrupt"}：老人插话，停止正在下发的回复（pcm16 模式下服务端检测到开始说话时自动打断）
+- {"type": "hangup"}：挂断
+
+识别和回复在后台任务中进行，期间继续接收下一句话的音频；上一轮还没处理完时，
+下一轮排在它后面依次回复。
+
+协议（服务端 → 客户端）：
+- {"type": "ready", "format": "webm"|"pcm16"}
+- {"type": "speech_start"}：（pcm16）检测到开始说话
+- {"type": "no_speech"}：这段声音不是说话（咳嗽、关门声等），已丢弃，不会回复
+- {"type": "partial_transcript", "text": "..."}：说话过程中的中间识别结果
+- {"type": "transcript", "text": "..."}：最终识别结果
+- {"type": "ai_text", "text": "..."}：AI回复的一句话，紧跟一个该句MP3音频的二进制帧
+- {"type": "turn_end", "ai_text": "..."}：本轮回复结束
+- {"type": "interrupted"}：正在下发的回复已因插话停止，客户端应停止播放
+- {"type": "error", "error": "..."}
+"""
+import asyncio
+import io
+import os
+import time
+import wave
+from collections import deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional, Set
+
+from fastapi import WebSocket
+
+from ai_services import ai_services
+from database import DEFAULT_SESSION_ID
+from endpointing import Endpointer
+from speculation import Prepare, SpeculativeContext
+
+
+AUDIO_FORMATS = ("webm", "pcm16")
+PCM_RATE = 16000
+
+
+# 说话过程中每隔多久做一次中间识别（秒），设为0关闭
+INTERIM_STT_INTERVAL = float(os.getenv("WS_INTERIM_STT_INTERVAL", "2.0"))
+# 距离上次中间识别至少新增多少字节音频才再次识别
+INTERIM_STT_MIN_BYTES = int(os.getenv("WS_INTERIM_STT_MIN_BYTES", "8000"))
+# STT接口每次都要上传整句音频：音频至少增长到上次识别时的多少倍才再次识别，
+# 一句话所有中间识别的上传总量不超过整句的 g/(g-1) 倍，而不是随时长平方增长
+INTERIM_STT_GROWTH = max(float(os.getenv("WS_INTERIM_STT_GROWTH", "1.5")), 1.0)
+# pcm16：检测到开始说话时，向前保留多少毫秒的音频（避免吞掉第一个字）
+ENDPOINT_PREROLL_MS = int(os.getenv("ENDPOINT_PREROLL_MS", "300"))
+# pcm16：一句话最长多少秒，超过后强制结束并回复
+ENDPOINT_MAX_UTTERANCE_SECONDS = float(os.getenv("ENDPOINT_MAX_UTTERANCE_SECONDS", "30"))
+
+
+def pcm_to_wav(pcm: bytes, rate: int = PCM_RATE) -> bytes:
+    """给裸PCM加上WAV头，STT接口需要带容器的音频文件"""
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm)
+    return out.getvalue()
+
+
+class Utterance:
+    """说完的一句话：音频和中间识别状态从会话中取出，之后继续收到的音频属于下一句话"""
+    
+    def __init__(
+        self,
+        audio: bytes,
+        size: int,
+        interim_task: Optional[asyncio.Task],
+        pending_size: int,
+        interim_size: int,
+        interim_text: str,
+        speculation: Optional[SpeculativeContext]
+    ):
+        self.audio = audio
+        self.size = size
+        self.interim_task = interim_task
+        self.pending_size = pending_size
+        self.interim_size = interim_size
+        self.interim_text = interim_text
+        self.speculation = speculation
+
+
+TurnHandler = Callable[["CallSession", Utterance], Awaitable[None]]
+
+
+class CallSession:
+    """一次通话的服务端状态：缓存当前这句话的音频，并在说话过程中增量识别"""
+    
+    def __init__(
+        self,
+        websocket: WebSocket,
+        session_id: str = DEFAULT_SESSION_ID,
+        audio_format: str = "webm",
+        prepare: Optional[Prepare] = None
+    ):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.audio_format = audio_format
+        self.audio = bytearray()
+        self.turns = 0
+        
+        # pcm16：服务端端点检测；未开始说话时只保留最近一小段音频作为前导
+        self.endpointer = Endpointer(PCM_RATE) if audio_format == "pcm16" else None
+        self._preroll: deque = deque()
+        self._preroll_bytes = 0
+        
+        # 中间识别状态：最近一次识别覆盖了多少字节、识别出什么
+        self._interim_task: Optional[asyncio.Task] = None
+        self._pending_size = 0
+        self._interim_size = 0
+        self._interim_text = ""
+        self._last_interim_at = 0.0
+        # 每开始一句新的话加一，已取走的那句话的中间识别结果不会写进新的一句
+        self._generation = 0
+        if self.endpointer is not None:
+            self.endpointer.reset()
+        
+        # 后台处理中的各轮，以及正在下发回复、插话时要打断的那一轮
+        self._turn_tasks: Set[asyncio.Task] = set()
+        self._last_turn: Optional[asyncio.Task] = None
+        self._replying: Optional[asyncio.Task] = None
+        # 后台的回复和接收循环都会下发消息，ai_text 和紧跟的音频帧不能被其它消息插开
+        self._send_lock = asyncio.Lock()
+        
+        # 用中间识别结果提前准备上下文（见 speculation.py），说完后由 take_speculation 取出
+        self.speculation = SpeculativeContext(prepare) if prepare is not None else None
+    
+    async def send_event(self, event_type: str, **payload):
+        async with self._send_lock:
+            await self.websocket.send_json({"type": event_type, **payload})
+    
+    async def send_sentence(self, text: str, audio_chunk: bytes):
+        """下发回复的一句话：ai_text 事件紧跟该句音频"""
+        async with self._send_lock:
+            await self.websocket.send_json({"type": "ai_text", "text": text})
+            if audio_chunk:
+                await self.websocket.send_bytes(audio_chunk)
+    
+    async def add_audio(self, chunk: bytes) -> bool:
+        """
+        追加音频分片，必要时在后台启动一次中间识别
+        
+        返回 True 表示服务端检测到这句话说完了（仅 pcm16 模式），调用方应开始回复
+        """
+        if self.endpointer is None:
+            self.audio.extend(chunk)
+            self._maybe_start_interim()
+            return False
+        
+        was_speaking = self.endpointer.in_speech
+        events = self.endpointer.feed(chunk)
+        if not was_speaking and not self.endpointer.in_speech and not events:
+            self._keep_preroll(chunk)
+            return False
+        
+        if not self.audio:
+            # 刚开始说话：从前导音频开始缓存
+            self.audio.extend(b"".join(self._preroll))
+            self._preroll.clear()
+            self._preroll_bytes = 0
+        self.audio.extend(chunk)
+        if "speech_start" in events:
+            await self.interrupt()
+            await self.send_event("speech_start")
+        
+        too_long = len(self.audio) >= ENDPOINT_MAX_UTTERANCE_SECONDS * PCM_RATE * 2
+        if "speech_end" in events or too_long:
+            if self.endpointer.is_speech:
+                return True
+            # 只是一声咳嗽、关门声：丢弃，继续等待
+            self.reset()
+            await self.send_event("no_speech")
+            return False
+        
+        self._maybe_start_interim()
+        return False
+    
+    def _keep_preroll(self, chunk: bytes):
+        self._preroll.append(chunk)
+        self._preroll_bytes += len(chunk)
+        limit = PCM_RATE * 2 * ENDPOINT_PREROLL_MS // 1000
+        while self._preroll_bytes - len(self._preroll[0]) >= limit:
+            self._preroll_bytes -= len(self._preroll.popleft())
+    
+    def _utterance_audio(self) -> bytes:
+        """当前这句话的音频文件（pcm16 模式下封装为WAV）"""
+        if self.endpointer is not None:
+            return pcm_to_wav(bytes(self.audio))
+        return bytes(self.audio)
+    
+    def _maybe_start_interim(self):
+        if INTERIM_STT_INTERVAL <= 0:
+            return
+        if self.endpointer is not None and not self.endpointer.is_speech:
+            # 还不确定是不是在说话，先不识别
+            return
+        if self._interim_task is not None and not self._interim_task.done():
+            return
+        if len(self.audio) < max(
+            self._pending_size + INTERIM_STT_MIN_BYTES, self._pending_size * INTERIM_STT_GROWTH
+        ):
+            return
+        if time.monotonic() - self._last_interim_at < INTERIM_STT_INTERVAL:
+            return
+        
+        self._last_interim_at = time.monotonic()
+        self._pending_size = len(self.audio)
+        self._interim_task = asyncio.create_task(
+            self._run_interim(self._utterance_audio(), self._pending_size, self._generation)
+        )
+    
+    async def _run_interim(self, snapshot: bytes, size: int, generation: int) -> Optional[str]:
+        text = await ai_services.speech_to_text(snapshot)
+        if not text or text == ai_services.STT_FAILED_TEXT:
+            return None
+        if generation == self._generation:
+            self._interim_size = size
+            self._interim_text = text
+            if self.speculation is not None:
+                self.speculation.update(text)
+            await self.send_event("partial_transcript", text=text)
+        return text
+    
+    def take_utterance(self) -> Optional[Utterance]:
+        """取出说完的这句话（没有音频时为 None），会话立即开始接收下一句话"""
+        if not self.audio:
+            return None
+        utterance = Utterance(
+            self._utterance_audio(), len(self.audio), self._interim_task,
+            self._pending_size, self._interim_size, self._interim_text,
+            self.speculation.detach() if self.speculation is not None else None
+        )
+        # 进行中的中间识别交给这句话，不随 reset 取消
+        self._interim_task = None
+        self.reset()
+        self.turns += 1
+        return utterance
+    
+    async def transcribe(self, utterance: Utterance) -> str:
+        """
+        返回这句话的最终识别文本
+        
+        如果最近一次中间识别已经覆盖了全部音频，直接复用，省掉一次STT调用
+        """
+        if utterance.interim_text and utterance.interim_size == utterance.size:
+            return utterance.interim_text
+        
+        pending = utterance.interim_task
+        if pending is not None and utterance.pending_size == utterance.size:
+            # 正在进行的中间识别覆盖的就是全部音频：等它完成
+            result = (await asyncio.gather(pending, return_exceptions=True))[0]
+            if isinstance(result, str):
+                if utterance.speculation is not None:
+                    utterance.speculation.update(result)
+                return result
+        elif pending is not None:
+            pending.cancel()
+        
+        return await ai_services.speech_to_text(utterance.audio)
+    
+    async def take_speculation(self, utterance: Utterance, final_text: str) -> Optional[dict]:
+        """取出这句话推测的上下文（与最终识别结果差别较大时为 None）"""
+        if utterance.speculation is None:
+            return None
+        return await utterance.speculation.resolve(final_text)
+    
+    def dispatch_turn(self, handler: TurnHandler):
+        """
+        取出说完的这句话，交给 handler 在后台识别和回复，接收循环不等待
+        
+        上一轮还没结束时排在它后面，保证回复按说话顺序下发
+        """
+        utterance = self.take_utterance()
+        if utterance is None:
+            return
+        previous = self._last_turn
+        
+        async def run():
+            if previous is not None and not previous.done():
+                # 用 wait 而不是直接 await：本轮被取消时不连带取消上一轮
+                await asyncio.wait({previous})
+            try:
+                await handler(self, utterance)
+            except Exception as e:
+                print(f"Call Turn Error: {e}")
+            finally:
+                if utterance.speculation is not None:
+                    utterance.speculation.cancel()
+        
+        task = asyncio.create_task(run())
+        self._turn_tasks.add(task)
+        task.add_done_callback(self._turn_tasks.discard)
+        self._last_turn = task
+    
+    @contextmanager
+    def replying(self):
+        """标记当前任务正在下发回复，期间老人插话会打断它"""
+        self._replying = asyncio.current_task()
+        try:
+            yield
+        finally:
+            self._replying = None
+    
+    async def interrupt(self):
+        """老人插话：停止正在下发的回复（还在识别、检索的轮次不受影响）"""
+        task = self._replying
+        if task is None or task.done():
+            return
+        task.cancel()
+        self._replying = None
+        await self.send_event("interrupted")
+    
+    async def close(self):
+        """挂断：取消所有进行中的轮次，并等它们保存已经说出口的部分"""
+        tasks = list(self._turn_tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.reset()
+    
+    def reset(self):
+        """丢弃当前这句话的音频、中间识别结果和推测的上下文"""
+        if self.speculation is not None:
+            self.speculation.cancel()
+        if self._interim_task is not None and not self._interim_task.done():
+            self._interim_task.cancel()
+        self._interim_task = None
+        self.audio = bytearray()
+        self._pending_size = 0
+        self._interim_size = 0
+        self._interim_text = ""
+        self._last_interim_at = 0.0
+        self._generation += 1
+        if self.endpointer is not None:
+            self.endpointer.reset()
@@ -0,0 +1,174 @@
+"""
+记忆整理 - 把旧对话归纳为长期记忆（洞见），让日常检索的向量库保持小而稳定
+
+对话每轮都会写入老人的记忆collection，长期使用后collection持续增长，检索延迟和索引内存随之上升。
+整理任务定期（见 job_queue.py 的自动任务）对超过 CONSOLIDATION_MIN_AGE_DAYS 天的对话：
+1. 按向量相似度聚类（单遍贪心聚类：与某个簇中心足够相似就并入，否则自成一簇）
+2. 每个簇调用对话模型归纳为一条记忆，以 insight 写回记忆collection
+3. 原对话连同向量移到归档collection，不再参与日常检索（原文仍保存在 chat_history 表中）
+
+洞见ID由簇内对话ID决定，任务中途失败重试时不会产生重复记忆。
+使用本地模拟LLM时不整理（模拟的归纳会替换掉真实的对话记忆）；没有 timestamp 的早期对话无法判断新旧，不参与整理
+"""
+import asyncio
+import hashlib
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import DEFAULT_SESSION_ID
+from vector_store import vector_store
+from ai_services import ai_services
+
+
+# 多少天之前的对话参与整理（近期对话保持原样，便于回忆细节）
+CONSOLIDATION_MIN_AGE_DAYS = float(os.getenv("CONSOLIDATION_MIN_AGE_DAYS", "30"))
+# 与簇中心的余弦相似度达到多少时并入该簇
+CONSOLIDATION_SIMILARITY = float(os.getenv("CONSOLIDATION_SIMILARITY", "0.75"))
+# 每个簇最多多少条对话（也是一次归纳的输入上限）
+CONSOLIDATION_MAX_CLUSTER_SIZE = int(os.getenv("CONSOLIDATION_MAX_CLUSTER_SIZE", "20"))
+# 少于这么多条的簇不单独归纳，同一个月的零散对话合并为一簇
+CONSOLIDATION_MIN_CLUSTER_SIZE = int(os.getenv("CONSOLIDATION_MIN_CLUSTER_SIZE", "3"))
+# 一次任务最多整理多少条对话（剩下的下次再整理）
+CONSOLIDATION_BATCH_SIZE = int(os.getenv("CONSOLIDATION_BATCH_SIZE", "500"))
+# 同时进行的归纳调用数
+CONSOLIDATION_CONCURRENCY = int(os.getenv("CONSOLIDATION_CONCURRENCY", "2"))
+# 对话保存后多久执行整理（秒）；排队中的任务会被复用，即每个老人大约每天整理一次
+CONSOLIDATION_INTERVAL_SECONDS = int(os.getenv("CONSOLIDATION_INTERVAL_SECONDS", "86400"))
+
+# 分页读取记忆collection时每页的条数
+_PAGE_SIZE = 1000
+
+
+async def consolidate_memories(db: AsyncSession, session_id: str = DEFAULT_SESSION_ID) -> Dict[str, Any]:
+    """整理某个老人的旧对话（后台任务）；某个簇归纳失败时抛出异常，已整理的簇不受影响"""
+    if ai_services.llm.name == "fake":
+        return {"consolidated": 0, "insights": 0, "skipped": "本地模拟LLM，不整理记忆"}
+    
+    old = await run_in_threadpool(_load_old_conversations, session_id)
+    if not old["ids"]:
+        return {"consolidated": 0, "insights": 0}
+    
+    clusters = _cluster(old)
+    print(f"🗂️  记忆整理：{len(old['ids'])} 条旧对话 → {len(clusters)} 条记忆（{session_id}）")
+    
+    slots = asyncio.Semaphore(CONSOLIDATION_CONCURRENCY)
+    
+    async def consolidate(members: List[int]):
+        async with slots:
+            await _consolidate_cluster(session_id, old, members)
+    
+    results = await asyncio.gather(*(consolidate(members) for members in clusters), return_exceptions=True)
+    failed = [r for r in results if isinstance(r, BaseException)]
+    if failed:
+        raise failed[0]
+    
+    remaining = await run_in_threadpool(vector_store.collection_for(session_id).count)
+    return {
+        "consolidated": len(old["ids"]),
+        "insights": len(clusters),
+        "remaining_memories": remaining
+    }
+
+
+def _load_old_conversations(session_id: str) -> Dict[str, list]:
+    """读取超过 CONSOLIDATION_MIN_AGE_DAYS 天的对话（连同向量），按时间正序，最多 CONSOLIDATION_BATCH_SIZE 条"""
+    collection = vector_store.collection_for(session_id)
+    cutoff = time.time() - CONSOLIDATION_MIN_AGE_DAYS * 86400
+    old = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    
+    # 记忆collection经过整理后只剩近期对话，逐页扫描的成本是有界的；
+    # 早期写入的对话没有 timestamp，不知道是什么时候说的，保持原样
+    offset = 0
+    while True:
+        page = collection.get(
+            where={"type": "conversation"},
+            include=["embeddings", "documents", "metadatas"],
+            limit=_PAGE_SIZE,
+            offset=offset
+        )
+        for i, metadata in enumerate(page["metadatas"]):
+            if metadata.get("timestamp") and metadata["timestamp"] < cutoff:
+                for key in old:
+                    old[key].append(page[key][i])
+        if len(page["ids"]) < _PAGE_SIZE:
+            break
+        offset += _PAGE_SIZE
+    
+    order = sorted(range(len(old["ids"])), key=lambda i: old["metadatas"][i]["timestamp"])
+    order = order[:CONSOLIDATION_BATCH_SIZE]
+    return {key: [values[i] for i in order] for key, values in old.items()}
+
+
+def _cluster(old: Dict[str, list]) -> List[List[int]]:
+    """单遍贪心聚类，返回各簇成员的下标；零散的小簇按月份合并"""
+    vectors = np.asarray(old["embeddings"], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    
+    clusters: List[List[int]] = []
+    centroids: List[np.ndarray] = []
+    for i, vector in enumerate(vectors):
+        best, best_score = -1, CONSOLIDATION_SIMILARITY
+        for c, centroid in enumerate(centroids):
+            if len(clusters[c]) >= CONSOLIDATION_MAX_CLUSTER_SIZE:
+                continue
+            score = float(vector @ centroid) / (float(np.linalg.norm(centroid)) + 1e-12)
+            if score >= best_score:
+                best, best_score = c, score
+        if best < 0:
+            clusters.append([i])
+            centroids.append(vector.copy())
+        else:
+            clusters[best].append(i)
+            centroids[best] += vector
+    
+    kept = [members for members in clusters if len(members) >= CONSOLIDATION_MIN_CLUSTER_SIZE]
+    leftovers: Dict[str, List[int]] = {}
+    for members in clusters:
+        if len(members) < CONSOLIDATION_MIN_CLUSTER_SIZE:
+            for i in members:
+                leftovers.setdefault(_month(old["metadatas"][i]), []).append(i)
+    for members in leftovers.values():
+        members.sort()
+        for start in range(0, len(members), CONSOLIDATION_MAX_CLUSTER_SIZE):
+            kept.append(members[start:start + CONSOLIDATION_MAX_CLUSTER_SIZE])
+    return kept
+
+
+def _month(metadata: dict) -> str:
+    return datetime.fromtimestamp(metadata["timestamp"]).strftime("%Y-%m")
+
+
+async def _consolidate_cluster(session_id: str, old: Dict[str, list], members: List[int]):
+    metadatas = [old["metadatas"][i] for i in members]
+    conversations = [
+        (datetime.fromtimestamp(m["timestamp"]), m.get("user_text", ""), m.get("ai_text", ""))
+        for m in metadatas
+    ]
+    summary = (await ai_services.consolidate_memories(conversations)).strip()
+    
+    # 记忆前注明时间段，回忆时知道是什么时候聊到的
+    timestamps = [m["timestamp"] for m in metadatas]
+    first, last = datetime.fromtimestamp(min(timestamps)), datetime.fromtimestamp(max(timestamps))
+    period = f"{first:%Y年%m月}" if first.strftime("%Y%m") == last.strftime("%Y%m") else f"{first:%Y年%m月}~{last:%Y年%m月}"
+    summary = f"（{period}）{summary}"
+    extra = {"source_count": len(members), "first_timestamp": min(timestamps), "last_timestamp": max(timestamps)}
+    
+    ids = [old["ids"][i] for i in members]
+    insight_id = "memory_" + hashlib.sha1("|".join(ids).encode()).hexdigest()[:16]
+    
+    # 先写入洞见再移走原对话：中途失败时最多是洞见与原对话并存，不会丢失记忆
+    await run_in_threadpool(vector_store.add_insight, insight_id, summary, "consolidated", session_id, extra)
+    await run_in_threadpool(
+        vector_store.archive_conversations,
+        session_id,
+        ids,
+        [old["embeddings"][i] for i in members],
+        [old["documents"][i] for i in members],
+        metadatas
+    )
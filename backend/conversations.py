@@ -0,0 +1,164 @@
+"""
+对话历史查询 - 游标分页、流式导出、按列查询
+
+老人长期使用后会积累数万条对话，这里的查询都不会一次性加载全部ORM对象：
+- 分页用 (timestamp, id) 键集游标，翻到第几页成本都一样（不用 OFFSET）
+- 导出用服务端游标 + yield_per 分批读取，边读边以 NDJSON / CSV 下发
+- 只查询需要的列（返回轻量的Row，而不是完整的 ChatHistory 实体）
+"""
+import base64
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, ChatHistory, DEFAULT_SESSION_ID
+
+
+# 可查询的列（fields 参数），默认返回前四列
+CONVERSATION_COLUMNS = {
+    "id": ChatHistory.id,
+    "user_text": ChatHistory.user_text,
+    "ai_text": ChatHistory.ai_text,
+    "timestamp": ChatHistory.timestamp,
+    "session_id": ChatHistory.session_id,
+    "has_memory_concern": ChatHistory.has_memory_concern,
+    "has_time_confusion": ChatHistory.has_time_confusion,
+    "has_logic_confusion": ChatHistory.has_logic_confusion,
+}
+DEFAULT_FIELDS = ("id", "user_text", "ai_text", "timestamp")
+
+# 每页最多多少条
+CONVERSATIONS_MAX_PAGE_SIZE = int(os.getenv("CONVERSATIONS_MAX_PAGE_SIZE", "500"))
+# 导出时每批从数据库读取多少行（也是每次下发的行数）
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """解析逗号分隔的列名；未知列抛出 ValueError"""
+    if not fields:
+        return list(DEFAULT_FIELDS)
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in CONVERSATION_COLUMNS]
+    if unknown or not names:
+        raise ValueError(
+            f"未知的字段: {', '.join(unknown) or fields}（可选: {', '.join(CONVERSATION_COLUMNS)}）"
+        )
+    return names
+
+
+def encode_cursor(timestamp: datetime, conversation_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """游标 → (timestamp, id)；格式不对时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, conversation_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), int(conversation_id)
+    except Exception:
+        raise ValueError("无效的分页游标")
+
+
+def _row_to_dict(row, fields: Sequence[str]) -> Dict[str, Any]:
+    data = {}
+    for name in fields:
+        value = getattr(row, name)
+        data[name] = value.isoformat() if isinstance(value, datetime) else value
+    return data
+
+
+async def list_conversations(
+    db: AsyncSession,
+    session_id: str = DEFAULT_SESSION_ID,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None
+) -> Dict[str, Any]:
+    """
+    某个老人的一页对话（按时间倒序）
+    
+    返回 next_cursor：传回 cursor 参数即可取下一页；没有更多时为 None
+    """
+    fields = list(fields or DEFAULT_FIELDS)
+    limit = max(1, min(limit, CONVERSATIONS_MAX_PAGE_SIZE))
+    
+    # 游标需要 timestamp 和 id，即使调用方没有请求这两列
+    columns = dict.fromkeys([*fields, "timestamp", "id"])
+    query = select(*(CONVERSATION_COLUMNS[name] for name in columns)).where(
+        ChatHistory.session_id == session_id
+    )
+    if cursor:
+        timestamp, conversation_id = decode_cursor(cursor)
+        query = query.where(
+            tuple_(ChatHistory.timestamp, ChatHistory.id) < tuple_(timestamp, conversation_id)
+        )
+    # 多取一条用于判断是否还有下一页
+    rows = (await db.execute(
+        query.order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).limit(limit + 1)
+    )).all()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "total": len(rows),
+        "conversations": [_row_to_dict(row, fields) for row in rows],
+        "next_cursor": encode_cursor(rows[-1].timestamp, rows[-1].id) if has_more else None,
+        "has_more": has_more
+    }
+
+
+async def stream_conversations(
+    session_id: str = DEFAULT_SESSION_ID,
+    fields: Optional[Sequence[str]] = None,
+    batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    按时间正序分批产出某个老人的全部对话（每批 batch_size 行）
+    
+    使用独立的数据库会话：流式响应在请求依赖关闭之后才开始下发
+    """
+    fields = list(fields or DEFAULT_FIELDS)
+    query = select(*(CONVERSATION_COLUMNS[name] for name in fields)).where(
+        ChatHistory.session_id == session_id
+    ).order_by(
+        ChatHistory.timestamp.asc(), ChatHistory.id.asc()
+    ).execution_options(yield_per=batch_size)
+    
+    async with SessionLocal() as db:
+        result = await db.stream(query)
+        async for partition in result.partitions():
+            yield [_row_to_dict(row, fields) for row in partition]
+
+
+async def export_conversations(
+    session_id: str = DEFAULT_SESSION_ID,
+    export_format: str = "ndjson",
+    fields: Optional[Sequence[str]] = None
+) -> AsyncIterator[str]:
+    """流式导出：NDJSON 每行一个JSON对象；CSV 第一行为表头"""
+    fields = list(fields or DEFAULT_FIELDS)
+    if export_format == "csv":
+        # BOM 让 Excel 正确识别 UTF-8 中文
+        yield "\ufeff" + ",".join(fields) + "\r\n"
+    
+    async for batch in stream_conversations(session_id, fields):
+        if export_format == "csv":
+            out = io.StringIO()
+            writer = csv.DictWriter(out, fieldnames=fields)
+            writer.writerows(batch)
+            yield out.getvalue()
+        else:
+            yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in batch)
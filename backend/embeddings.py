@@ -0,0 +1,197 @@
+"""
+向量化（Embedding）- 可切换的本地向量化模型 + 两级缓存
+
+老人的问候语、常用说法重复率很高，而向量化是每轮对话里最耗CPU的一步；
+相同文本的向量先查内存LRU，再查磁盘缓存（SQLite），都没有时才批量调用模型
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils import embedding_functions
+
+
+# 向量化模型：onnx-minilm（默认，ChromaDB自带的 all-MiniLM-L6-v2，纯CPU）、
+# sentence-transformers（EMBEDDING_MODEL 指定模型，例如多语言模型）、text2vec（中文模型）
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "onnx-minilm")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "5000"))
+# 磁盘缓存路径，留空关闭
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db")
+
+
+def _onnx_minilm(model_name: str) -> EmbeddingFunction:
+    return embedding_functions.ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+
+
+def _sentence_transformers(model_name: str) -> EmbeddingFunction:
+    return embedding_functions.SentenceTransformerEmbeddingFunction(
+        model_name=model_name or "paraphrase-multilingual-MiniLM-L12-v2",
+        device="cpu"
+    )
+
+
+def _text2vec(model_name: str) -> EmbeddingFunction:
+    return embedding_functions.Text2VecEmbeddingFunction(
+        model_name=model_name or "shibing624/text2vec-base-chinese"
+    )
+
+
+# 可用的向量化模型：名称 -> 工厂函数(model_name)
+PROVIDERS: Dict[str, Callable[[str], EmbeddingFunction]] = {
+    "onnx-minilm": _onnx_minilm,
+    "sentence-transformers": _sentence_transformers,
+    "text2vec": _text2vec,
+}
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    带缓存的向量化函数，可直接作为ChromaDB collection的 embedding_function
+    
+    缓存键为 (模型, 文本) 的哈希；模型在第一次使用时才加载，避免拖慢启动
+    """
+    
+    def __init__(
+        self,
+        provider: str = EMBEDDING_PROVIDER,
+        model_name: str = EMBEDDING_MODEL,
+        cache_size: int = EMBEDDING_CACHE_SIZE,
+        cache_path: str = EMBEDDING_CACHE_PATH,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+    ):
+        if provider not in PROVIDERS:
+            raise ValueError(f"未知的向量化模型: {provider}（可选: {', '.join(PROVIDERS)}）")
+        self.provider = provider
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        
+        self._model: Optional[EmbeddingFunction] = None
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        # 多个线程池线程可能同时向量化
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        
+        self._disk: Optional[sqlite3.Connection] = None
+        if cache_path:
+            self._disk = sqlite3.connect(cache_path, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._disk.commit()
+        
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "model_calls": 0}
+    
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [self._key(text) for text in input]
+        results: List[Optional[List[float]]] = [None] * len(input)
+        
+        # 1. 内存LRU
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                    self._stats["memory_hits"] += 1
+        
+        # 2. 磁盘缓存
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing and self._disk is not None:
+            found = self._disk_get([keys[i] for i in missing])
+            for i in missing:
+                vector = found.get(keys[i])
+                if vector is not None:
+                    results[i] = vector
+                    self._stats["disk_hits"] += 1
+                    self._remember(keys[i], vector)
+        
+        # 3. 批量调用模型（同一批次中重复的文本只算一次）
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            unique: Dict[str, str] = {}
+            for i in missing:
+                unique.setdefault(keys[i], input[i])
+            computed = self._embed(list(unique.values()))
+            new_vectors = dict(zip(unique.keys(), computed))
+            
+            self._stats["misses"] += len(missing)
+            for i in missing:
+                results[i] = new_vectors[keys[i]]
+            for key, vector in new_vectors.items():
+                self._remember(key, vector)
+            self._disk_put(new_vectors)
+        
+        return results
+    
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.provider}:{self.model_name}:{text}".encode("utf-8")).hexdigest()
+    
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = PROVIDERS[self.provider](self.model_name)
+        
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            vectors.extend(
+                [float(x) for x in vector] for vector in self._model(batch)
+            )
+            self._stats["model_calls"] += 1
+        return vectors
+    
+    def _remember(self, key: str, vector: List[float]):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.cache_size:
+                self._memory.popitem(last=False)
+    
+    def _disk_get(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            # SQLite单条语句的参数个数有上限，分批查询
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._disk.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+    
+    def _disk_put(self, vectors: Dict[str, List[float]]):
+        if self._disk is None or not vectors:
+            return
+        with self._lock:
+            self._disk.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()]
+            )
+            self._disk.commit()
+    
+    def stats(self) -> Dict[str, object]:
+        lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+        return {
+            **self._stats,
+            "provider": self.provider,
+            "model": self.model_name or None,
+            "memory_entries": len(self._memory),
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+        }
+
+
+# 全局实例
+embedding_function = CachedEmbeddingFunction()
@@ -0,0 +1,156 @@
+"""
+服务端语音端点检测（VAD / endpointing）- 判断老人什么时候开始说话、什么时候说完
+
+按20ms一帧计算短时能量和过零率（NumPy向量化），与自适应的底噪比较：
+- 能量明显高于底噪的帧视为语音；能量不高但过零率很高的帧（电视沙沙声、风扇）不算
+- 底噪在非语音帧上快速下降、缓慢上升，适应不同房间的背景噪声
+- 连续语音超过 start_ms 视为开始说话，之后静音超过 end_silence_ms 视为说完
+
+说完时累计的语音时长太短（咳嗽、关门声）则判定为非语音，不调用STT。
+本模块只依赖NumPy，音频预处理进程池中的子进程也会导入它（静音裁剪复用 frame_features 分帧）。
+"""
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+ENDPOINT_FRAME_MS = 20
+ENDPOINT_START_MS = int(os.getenv("ENDPOINT_START_MS", "100"))
+ENDPOINT_SILENCE_MS = int(os.getenv("ENDPOINT_SILENCE_MS", "700"))
+ENDPOINT_MIN_SPEECH_MS = int(os.getenv("ENDPOINT_MIN_SPEECH_MS", "300"))
+ENDPOINT_MARGIN_DB = float(os.getenv("ENDPOINT_MARGIN_DB", "10"))
+# 低于这个绝对能量（dBFS）的声音一律视为静音
+ENDPOINT_ABS_FLOOR_DBFS = -55.0
+# 整段音频估计底噪时的上限（dBFS）：裁掉静音后几乎整段都是语音，最安静的帧也不能当作底噪
+ENDPOINT_NOISE_CEILING_DBFS = -40.0
+# 过零率高于此值且能量只是略高于底噪的帧视为噪声
+ENDPOINT_NOISE_ZCR = 0.45
+# 开始时用前200ms估计底噪；之后底噪每帧最多上升0.1dB（约5dB/秒）
+ENDPOINT_CALIBRATION_MS = 200
+ENDPOINT_FLOOR_RISE_DB = 0.1
+
+
+def frame_features(
+    pcm: np.ndarray,
+    rate: int = 16000,
+    frame_ms: int = ENDPOINT_FRAME_MS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """逐帧的 (RMS能量dBFS, 过零率)；不足一帧的尾部被忽略"""
+    frame_len = rate * frame_ms // 1000
+    n_frames = len(pcm) // frame_len
+    if n_frames == 0:
+        empty = np.zeros(0, dtype=np.float32)
+        return empty, empty
+    
+    frames = pcm[:n_frames * frame_len].astype(np.float32).reshape(n_frames, frame_len) / 32768.0
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    energy = 20 * np.log10(np.maximum(rms, 1e-6))
+    signs = np.signbit(frames)
+    zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+    return energy, zcr
+
+
+class Endpointer:
+    """流式端点检测：不断喂入 16-bit 单声道PCM，产出 speech_start / speech_end 事件"""
+    
+    def __init__(
+        self,
+        rate: int = 16000,
+        start_ms: int = ENDPOINT_START_MS,
+        end_silence_ms: int = ENDPOINT_SILENCE_MS,
+        min_speech_ms: int = ENDPOINT_MIN_SPEECH_MS,
+        margin_db: float = ENDPOINT_MARGIN_DB,
+        noise_floor: Optional[float] = None,
+    ):
+        self.rate = rate
+        self.frame_len = rate * ENDPOINT_FRAME_MS // 1000
+        self.start_ms = start_ms
+        self.end_silence_ms = end_silence_ms
+        self.min_speech_ms = min_speech_ms
+        self.margin_db = margin_db
+        
+        self.noise_floor = noise_floor
+        self._calibration: List[float] = []
+        self._remainder = np.zeros(0, dtype=np.int16)
+        self.reset()
+    
+    def reset(self):
+        """开始新的一句话（底噪估计保留）"""
+        self.in_speech = False
+        self.speech_ms = 0
+        self.silence_ms = 0
+        self._voiced_run = 0
+    
+    @property
+    def is_speech(self) -> bool:
+        """当前这句话的语音时长是否足以送去识别"""
+        return self.speech_ms >= self.min_speech_ms
+    
+    def feed(self, chunk: bytes) -> List[str]:
+        """喂入一段PCM，返回期间发生的事件（"speech_start" / "speech_end"）"""
+        pcm = np.concatenate([self._remainder, np.frombuffer(chunk, dtype=np.int16)])
+        usable = len(pcm) // self.frame_len * self.frame_len
+        self._remainder = pcm[usable:]
+        energy, zcr = frame_features(pcm[:usable], self.rate)
+        return self._process(energy, zcr)
+    
+    def _process(self, energy: np.ndarray, zcr: np.ndarray) -> List[str]:
+        events = []
+        for e, z in zip(energy.tolist(), zcr.tolist()):
+            if self.noise_floor is None:
+                # 校准阶段：用开头一小段的能量估计底噪
+                self._calibration.append(e)
+                if len(self._calibration) * ENDPOINT_FRAME_MS >= ENDPOINT_CALIBRATION_MS:
+                    self.noise_floor = float(np.percentile(self._calibration, 20))
+                continue
+            
+            voiced = self.is_voiced(e, z)
+            self._update_floor(e, voiced)
+            
+            if not self.in_speech:
+                self._voiced_run = self._voiced_run + ENDPOINT_FRAME_MS if voiced else 0
+                if self._voiced_run >= self.start_ms:
+                    self.in_speech = True
+                    self.speech_ms = self._voiced_run
+                    self.silence_ms = 0
+                    events.append("speech_start")
+            elif voiced:
+                self.speech_ms += ENDPOINT_FRAME_MS
+                self.silence_ms = 0
+            else:
+                self.silence_ms += ENDPOINT_FRAME_MS
+                if self.silence_ms >= self.end_silence_ms:
+                    self.in_speech = False
+                    self._voiced_run = 0
+                    events.append("speech_end")
+        return events
+    
+    def is_voiced(self, energy: float, zcr: float) -> bool:
+        """按当前底噪判断一帧（frame_features 的能量和过零率）是否为语音"""
+        threshold = self.noise_floor + self.margin_db
+        if energy <= max(threshold, ENDPOINT_ABS_FLOOR_DBFS):
+            return False
+        # 高过零率、能量只略高于阈值：更像是嘶嘶声/电视底噪
+        return not (zcr > ENDPOINT_NOISE_ZCR and energy < threshold + 6)
+    
+    def _update_floor(self, energy: float, voiced: bool):
+        if energy < self.noise_floor:
+            self.noise_floor = 0.7 * self.noise_floor + 0.3 * energy
+        elif not voiced:
+            self.noise_floor += min(energy - self.noise_floor, ENDPOINT_FLOOR_RISE_DB)
+
+
+def speech_duration_ms(pcm: np.ndarray, rate: int = 16000) -> int:
+    """一整段音频中的语音总时长（毫秒），用于在识别前过滤咳嗽、噪声等非语音"""
+    energy, zcr = frame_features(pcm, rate)
+    if len(energy) == 0:
+        return 0
+    # 整段音频已知，直接用低分位数估计底噪，不需要校准阶段
+    noise_floor = min(float(np.percentile(energy, 10)), ENDPOINT_NOISE_CEILING_DBFS)
+    endpointer = Endpointer(rate, noise_floor=noise_floor)
+    total = 0
+    for e, z in zip(energy.tolist(), zcr.tolist()):
+        if endpointer.is_voiced(e, z):
+            total += ENDPOINT_FRAME_MS
+    return total
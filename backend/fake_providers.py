@@ -0,0 +1,307 @@
+"""
+本地模拟服务商 - 不消耗API额度，离线压测 /api/chat 整条流水线
+
+两种用法：
+1. 进程内：STT_PROVIDER / LLM_PROVIDER / TTS_PROVIDER=fake（必须显式指定，未配置API Key时启动报错）
+2. 独立的模拟HTTP服务：python fake_providers.py --port 9100，然后把
+   SILICONFLOW_BASE_URL / ELEVENLABS_BASE_URL 指向它（API Key随便填），
+   这样连接池、HTTP/2、SSE解析等真实调用路径也在压测范围内
+
+每类服务的行为通过环境变量配置（{KIND} 为 STT / LLM / TTS）：
+- FAKE_{KIND}_LATENCY：延迟分布，fixed:毫秒、uniform:最小:最大、normal:均值:标准差、
+  lognormal:中位数:P95（默认，长尾更接近真实服务）
+- FAKE_{KIND}_ERROR_RATE：返回500的概率（0~1）
+- FAKE_{KIND}_RATE_LIMIT：每秒允许的请求数（令牌桶，0为不限），超过时返回429
+- FAKE_LLM_TOKEN_MS：流式输出时每个增量之间的间隔
+- FAKE_LATENCY_SCALE：所有延迟的倍数，设为0即瞬时返回
+- FAKE_SEED：随机种子，便于复现同一次压测
+"""
+import asyncio
+import hashlib
+import math
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from providers import LLMProvider, ProviderError, STTProvider, TTSProvider, register_provider
+
+
+FAKE_LATENCY_SCALE = float(os.getenv("FAKE_LATENCY_SCALE", "1.0"))
+FAKE_LLM_TOKEN_MS = float(os.getenv("FAKE_LLM_TOKEN_MS", "30"))
+FAKE_SEED = os.getenv("FAKE_SEED")
+
+# 默认延迟（毫秒）：大致对应真实服务的中位数和P95
+DEFAULT_LATENCY = {
+    "stt": "lognormal:350:900",
+    "llm": "lognormal:450:1500",
+    "tts": "lognormal:300:800",
+}
+
+# 模拟的老人说话内容，按音频内容哈希选择，相同音频总是得到相同文本
+FAKE_UTTERANCES = [
+    "模拟识别：今天天气真好啊！",
+    "我今天早上去公园散步了",
+    "中午吃了红烧肉，是我自己做的",
+    "我孙子昨天给我打电话了",
+    "最近晚上睡得不太好",
+    "我年轻的时候在纺织厂上班",
+    "今天有点累，不想出门",
+    "你吃饭了吗？",
+]
+
+FAKE_REPLIES = [
+    "是呀！今天天气这么好，您出去走走了吗？外面暖和吗？",
+    "哎呀，听起来真不错！您能给我多讲讲吗？",
+    "真的呀？那您当时心情怎么样呀？",
+    "我能理解您的感受。您今天吃饭了吗？吃的什么呀？",
+    "您说得真有意思！后来呢？",
+]
+
+
+class LatencyDistribution:
+    """延迟分布，按 "类型:参数" 解析，sample() 返回秒"""
+    
+    def __init__(self, spec: str, scale: float = FAKE_LATENCY_SCALE):
+        self.spec = spec
+        self.scale = scale
+        kind, *params = spec.split(":")
+        values = [float(p) for p in params]
+        if kind == "fixed" and len(values) == 1:
+            self._sample = lambda rng: values[0]
+        elif kind == "uniform" and len(values) == 2:
+            self._sample = lambda rng: rng.uniform(values[0], values[1])
+        elif kind == "normal" and len(values) == 2:
+            self._sample = lambda rng: max(rng.gauss(values[0], values[1]), 0.0)
+        elif kind == "lognormal" and len(values) == 2:
+            # 由中位数和P95反推对数正态分布参数：P95 = exp(mu + 1.645 * sigma)
+            mu = math.log(values[0])
+            sigma = max(math.log(values[1]) - mu, 0.0) / 1.645
+            self._sample = lambda rng: rng.lognormvariate(mu, sigma)
+        else:
+            raise ValueError(f"无法解析的延迟分布: {spec}")
+    
+    def sample(self, rng: random.Random) -> float:
+        return self._sample(rng) * self.scale / 1000
+
+
+class TokenBucket:
+    """令牌桶限流：平均每秒 rate 个请求，允许 burst 个突发"""
+    
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(int(rate), 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+    
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FakeBehavior:
+    """一类模拟服务的延迟、错误率和限流，以及调用统计"""
+    
+    def __init__(self, kind: str, rng: random.Random):
+        prefix = f"FAKE_{kind.upper()}"
+        self.kind = kind
+        self.rng = rng
+        self.latency = LatencyDistribution(os.getenv(f"{prefix}_LATENCY", DEFAULT_LATENCY[kind]))
+        self.error_rate = float(os.getenv(f"{prefix}_ERROR_RATE", "0"))
+        rate_limit = float(os.getenv(f"{prefix}_RATE_LIMIT", "0"))
+        self.bucket = TokenBucket(rate_limit) if rate_limit > 0 else None
+        self._stats = {"calls": 0, "errors": 0, "rate_limited": 0, "simulated_seconds": 0.0}
+    
+    async def call(self, provider: str):
+        """模拟一次请求：先限流检查，再等待延迟，最后按错误率失败"""
+        self._stats["calls"] += 1
+        if self.bucket is not None and not self.bucket.try_acquire():
+            self._stats["rate_limited"] += 1
+            raise ProviderError(provider, 429, "rate limited (fake)")
+        
+        delay = self.latency.sample(self.rng)
+        self._stats["simulated_seconds"] += delay
+        await asyncio.sleep(delay)
+        
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self._stats["errors"] += 1
+            raise ProviderError(provider, 500, "injected error (fake)")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "simulated_seconds": round(self._stats["simulated_seconds"], 1),
+            "latency": self.latency.spec,
+            "error_rate": self.error_rate,
+            "rate_limit": self.bucket.rate if self.bucket else None,
+        }
+
+
+# 三类模拟服务共用一个随机数发生器，设置 FAKE_SEED 时整次压测可复现
+_rng = random.Random(int(FAKE_SEED)) if FAKE_SEED else random.Random()
+
+
+def _pick(options: List[str], key: bytes) -> str:
+    return options[int(hashlib.md5(key).hexdigest(), 16) % len(options)]
+
+
+def silent_mp3(seconds: float) -> bytes:
+    """生成指定时长的静音MP3（MPEG-1 Layer III, 128kbps, 44.1kHz，每帧约26ms）"""
+    frame = b"\xff\xfb\x90\x64" + b"\x00" * 413
+    return frame * max(int(seconds / 0.026), 1)
+
+
+@register_provider("stt", "fake")
+class FakeSTT(STTProvider):
+    def __init__(self, pools=None):
+        self.behavior = FakeBehavior("stt", _rng)
+    
+    async def transcribe(self, audio: bytes, filename: str, content_type: str) -> str:
+        await self.behavior.call(self.name)
+        return _pick(FAKE_UTTERANCES, audio)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"provider": self.name, **self.behavior.stats()}
+
+
+@register_provider("llm", "fake")
+class FakeLLM(LLMProvider):
+    """首个增量前等待一次服务延迟，之后每隔 FAKE_LLM_TOKEN_MS 输出两个字"""
+    
+    def __init__(self, pools=None):
+        self.behavior = FakeBehavior("llm", _rng)
+        self.token_seconds = FAKE_LLM_TOKEN_MS * FAKE_LATENCY_SCALE / 1000
+    
+    def _reply(self, messages: List[Dict[str, str]]) -> str:
+        last_user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        return _pick(FAKE_REPLIES, last_user.encode("utf-8"))
+    
+    @staticmethod
+    def _chunks(text: str) -> List[str]:
+        return [text[i:i + 2] for i in range(0, len(text), 2)]
+    
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 150,
+        timeout: Optional[float] = None,
+        **options
+    ) -> str:
+        await self.behavior.call(self.name)
+        reply = self._reply(messages)
+        await asyncio.sleep(self.token_seconds * len(self._chunks(reply)))
+        return reply
+    
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 150,
+        **options
+    ) -> AsyncIterator[str]:
+        await self.behavior.call(self.name)
+        for i, chunk in enumerate(self._chunks(self._reply(messages))):
+            if i:
+                await asyncio.sleep(self.token_seconds)
+            yield chunk
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"provider": self.name, **self.behavior.stats()}
+
+
+@register_provider("tts", "fake")
+class FakeTTS(TTSProvider):
+    """返回静音MP3，时长按每字0.25秒估算，响应体大小接近真实合成结果"""
+    
+    model_id = "fake"
+    
+    def __init__(self, pools=None):
+        self.behavior = FakeBehavior("tts", _rng)
+    
+    async def synthesize(self, text: str, voice_id: str, voice_settings: Dict[str, Any]) -> bytes:
+        await self.behavior.call(self.name)
+        return silent_mp3(len(text) * 0.25)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"provider": self.name, **self.behavior.stats()}
+
+
+def create_fake_server():
+    """模拟硅基流动和ElevenLabs的HTTP接口（与真实接口的路径和格式一致）"""
+    import json
+    
+    from fastapi import FastAPI, File, Form, Request, UploadFile
+    from fastapi.responses import JSONResponse, Response, StreamingResponse
+    
+    app = FastAPI(title="YuKeSong Fake Providers")
+    stt, llm, tts = FakeSTT(), FakeLLM(), FakeTTS()
+    
+    def error_response(e: ProviderError) -> JSONResponse:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions(file: UploadFile = File(...), model: str = Form("")):
+        try:
+            text = await stt.transcribe(await file.read(), file.filename, file.content_type)
+        except ProviderError as e:
+            return error_response(e)
+        return {"text": text}
+    
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        if not body.get("stream"):
+            try:
+                reply = await llm.complete(messages)
+            except ProviderError as e:
+                return error_response(e)
+            return {"choices": [{"message": {"role": "assistant", "content": reply}}]}
+        
+        deltas = llm.stream(messages)
+        try:
+            # 限流和错误在开始输出之前发生，返回对应的状态码
+            first = await deltas.__anext__()
+        except ProviderError as e:
+            return error_response(e)
+        
+        async def sse():
+            yield f"data: {json.dumps({'choices': [{'delta': {'content': first}}]}, ensure_ascii=False)}\n\n"
+            async for delta in deltas:
+                yield f"data: {json.dumps({'choices': [{'delta': {'content': delta}}]}, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        
+        return StreamingResponse(sse(), media_type="text/event-stream")
+    
+    @app.post("/v1/text-to-speech/{voice_id}")
+    async def text_to_speech(voice_id: str, request: Request):
+        body = await request.json()
+        try:
+            audio = await tts.synthesize(body.get("text", ""), voice_id, body.get("voice_settings", {}))
+        except ProviderError as e:
+            return error_response(e)
+        return Response(content=audio, media_type="audio/mpeg")
+    
+    @app.get("/stats")
+    async def stats():
+        return {"stt": stt.stats(), "llm": llm.stats(), "tts": tts.stats()}
+    
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    import uvicorn
+    
+    parser = argparse.ArgumentParser(description="本地模拟的STT/LLM/TTS服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+    uvicorn.run(create_fake_server(), host=args.host, port=args.port)
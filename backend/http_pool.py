@@ -0,0 +1,116 @@
+"""
+上游HTTP连接池 - 为每个AI服务商维护长连接（keep-alive / HTTP/2）
+"""
+import importlib.util
+import os
+import time
+from typing import Dict, Any, Optional
+
+import httpx
+
+
+# HTTP/2 需要安装 h2（httpx[http2]），未安装时自动回退到 HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class UpstreamPool:
+    """单个上游服务的连接池（对httpx.AsyncClient的薄封装，附带统计）"""
+    
+    def __init__(self, name: str, base_url: str, http2: bool = True):
+        self.name = name
+        self.base_url = base_url
+        prefix = name.upper()
+        
+        # 全局默认值，可按上游覆盖：例如 SILICONFLOW_MAX_CONNECTIONS
+        self.limits = httpx.Limits(
+            max_connections=_env_int(
+                f"{prefix}_MAX_CONNECTIONS", _env_int("HTTP_MAX_CONNECTIONS", 20)
+            ),
+            max_keepalive_connections=_env_int(
+                f"{prefix}_MAX_KEEPALIVE", _env_int("HTTP_MAX_KEEPALIVE", 10)
+            ),
+            keepalive_expiry=_env_float(
+                f"{prefix}_KEEPALIVE_EXPIRY", _env_float("HTTP_KEEPALIVE_EXPIRY", 60.0)
+            ),
+        )
+        self.timeout = httpx.Timeout(
+            _env_float(f"{prefix}_TIMEOUT", _env_float("HTTP_TIMEOUT", 30.0)),
+            connect=_env_float(
+                f"{prefix}_CONNECT_TIMEOUT", _env_float("HTTP_CONNECT_TIMEOUT", 5.0)
+            ),
+        )
+        self.http2 = http2 and HTTP2_AVAILABLE and os.getenv("HTTP2_ENABLED", "1") != "0"
+        
+        self._client: Optional[httpx.AsyncClient] = None
+        self.created_at: Optional[float] = None
+        self.requests = 0
+        self.errors = 0
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """获取（必要时惰性创建）长连接客户端"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=self.http2,
+                limits=self.limits,
+                timeout=self.timeout,
+                event_hooks={"response": [self._on_response]},
+            )
+            self.created_at = time.time()
+        return self._client
+    
+    async def _on_response(self, response: httpx.Response):
+        self.requests += 1
+        if response.status_code >= 400:
+            self.errors += 1
+    
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """连接池状态（用于监控）"""
+        connections = []
+        pool = None
+        if self._client is not None and not self._client.is_closed:
+            # httpx 未公开连接池状态，这里尽力读取 httpcore 的内部结构
+            transport = getattr(self._client, "_transport", None)
+            pool = getattr(transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []) or [])
+        
+        idle = sum(1 for conn in connections if conn.is_idle())
+        http2_conns = sum(
+            1 for conn in connections
+            if "HTTP/2" in getattr(conn, "info", lambda: "")()
+        )
+        
+        return {
+            "base_url": self.base_url,
+            "open": self._client is not None and not self._client.is_closed,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "connections": len(connections),
+            "idle_connections": idle,
+            "active_connections": len(connections) - idle,
+            "http2_connections": http2_conns,
+            "queued_requests": sum(
+                1 for req in getattr(pool, "_requests", []) or [] if req.is_queued()
+            ),
+            "requests": self.requests,
+            "errors": self.errors,
+            "uptime_seconds": round(time.time() - self.created_at, 1) if self.created_at else 0,
+        }
@@ -0,0 +1,166 @@
+"""
+仪表盘洞察缓存 - 只在出现新对话时重新分析，并尽量增量合并
+"""
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
+
+from database import ChatHistory, InsightsCache, DEFAULT_SESSION_ID
+from ai_services import ai_services
+
+
+# 分析只需要这几列，按列查询返回轻量的Row，不加载完整的ORM实体
+_ANALYSIS_COLUMNS = (ChatHistory.id, ChatHistory.timestamp, ChatHistory.user_text, ChatHistory.ai_text)
+
+# 新增对话超过这个数量时做一次全量分析，而不是增量合并
+INSIGHTS_DELTA_LIMIT = int(os.getenv("INSIGHTS_DELTA_LIMIT", "30"))
+
+# 同一个老人同一时刻只允许一次分析，避免仪表盘轮询触发重复的LLM调用
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def get_insights(db: AsyncSession, session_id: str = DEFAULT_SESSION_ID) -> Optional[Dict[str, Any]]:
+    """
+    获取某个老人的洞察分析结果
+    
+    - 没有新对话：直接返回缓存（毫秒级）
+    - 有少量新对话：只分析新增部分，并与上次结果合并
+    - 没有缓存或新增过多：全量分析最近30轮
+    
+    没有任何对话时返回 None
+    """
+    latest_id = await _latest_conversation_id(db, session_id)
+    if latest_id is None:
+        return None
+    
+    cache = await db.get(InsightsCache, session_id)
+    if cache is not None and cache.last_conversation_id >= latest_id:
+        return _with_cache_info(cache, "cached")
+    
+    lock = _locks.setdefault(session_id, asyncio.Lock())
+    async with lock:
+        # 等锁期间可能已被其他请求刷新
+        db.expire_all()
+        latest_id = await _latest_conversation_id(db, session_id)
+        cache = await db.get(InsightsCache, session_id)
+        if cache is not None and cache.last_conversation_id >= latest_id:
+            return _with_cache_info(cache, "cached")
+        
+        mode = "full"
+        new_conversations = []
+        if cache is not None:
+            new_conversations = (await db.execute(
+                select(*_ANALYSIS_COLUMNS).where(
+                    ChatHistory.session_id == session_id,
+                    ChatHistory.id > cache.last_conversation_id
+                ).order_by(ChatHistory.id.asc()).limit(INSIGHTS_DELTA_LIMIT + 1)
+            )).all()
+        
+        if cache is not None and len(new_conversations) <= INSIGHTS_DELTA_LIMIT:
+            mode = "incremental"
+            # LLM调用耗时较长，先结束读事务把连接还给连接池
+            await db.commit()
+            insights = await ai_services.update_dashboard_insights(
+                json.loads(cache.insights), new_conversations
+            )
+        else:
+            recent_conversations = (await db.execute(
+                select(*_ANALYSIS_COLUMNS).where(
+                    ChatHistory.session_id == session_id
+                ).order_by(ChatHistory.timestamp.desc()).limit(30)
+            )).all()
+            await db.commit()
+            insights = await ai_services.generate_dashboard_insights(recent_conversations)
+        
+        if cache is None:
+            cache = InsightsCache(session_id=session_id)
+            db.add(cache)
+        cache.last_conversation_id = latest_id
+        cache.insights = json.dumps(insights, ensure_ascii=False)
+        cache.updated_at = datetime.utcnow()
+        await db.commit()
+        
+        return _with_cache_info(cache, mode)
+
+
+async def build_dashboard_insights(db: AsyncSession, session_id: str = DEFAULT_SESSION_ID) -> Dict[str, Any]:
+    """仪表盘完整数据：洞察分析（走缓存）+ 统计信息（HTTP端点和后台任务共用）"""
+    if ai_services.llm.name == "fake":
+        # 本地模拟LLM无法分析：只返回统计信息，后台任务记为跳过而不是失败重试
+        return {
+            "summary": "本地模拟LLM，不做洞察分析",
+            "emotion_analysis": {},
+            "cognitive_assessment": {},
+            "key_insights": [],
+            "skipped": "本地模拟LLM，不做洞察分析",
+            "statistics": await conversation_statistics(db, session_id)
+        }
+    
+    insights = await get_insights(db, session_id)
+    
+    if insights is None:
+        return {
+            "summary": "暂无对话数据",
+            "total_conversations": 0,
+            "emotion_analysis": {},
+            "cognitive_assessment": {},
+            "key_insights": []
+        }
+    
+    # 添加统计信息
+    insights["statistics"] = await conversation_statistics(db, session_id)
+    return insights
+
+
+async def conversation_statistics(db: AsyncSession, session_id: str = DEFAULT_SESSION_ID) -> Dict[str, Any]:
+    """对话统计信息（SQL聚合，不加载全部对话）"""
+    total, first_ts, last_ts, avg_length = (await db.execute(
+        select(
+            func.count(ChatHistory.id),
+            func.min(ChatHistory.timestamp),
+            func.max(ChatHistory.timestamp),
+            func.avg(func.length(ChatHistory.user_text))
+        ).where(ChatHistory.session_id == session_id)
+    )).one()
+    
+    recent = (await db.execute(
+        select(*_ANALYSIS_COLUMNS).where(
+            ChatHistory.session_id == session_id
+        ).order_by(ChatHistory.timestamp.desc()).limit(5)
+    )).all()
+    
+    return {
+        "total_conversations": total,
+        "first_conversation": first_ts.isoformat() if first_ts else None,
+        "last_conversation": last_ts.isoformat() if last_ts else None,
+        "avg_user_text_length": float(avg_length or 0),
+        "recent_conversations": [
+            {
+                "user": c.user_text,
+                "ai": c.ai_text,
+                "time": c.timestamp.isoformat()
+            }
+            for c in recent
+        ]
+    }
+
+
+async def _latest_conversation_id(db: AsyncSession, session_id: str) -> Optional[int]:
+    return await db.scalar(
+        select(func.max(ChatHistory.id)).where(ChatHistory.session_id == session_id)
+    )
+
+
+def _with_cache_info(cache: InsightsCache, mode: str) -> Dict[str, Any]:
+    insights = json.loads(cache.insights)
+    insights["cache"] = {
+        "mode": mode,
+        "analyzed_through_conversation_id": cache.last_conversation_id,
+        "updated_at": cache.updated_at.isoformat() if cache.updated_at else None
+    }
+    return insights
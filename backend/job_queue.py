@@ -0,0 +1,294 @@
+"""
+分析任务队列 - 把分析智能体（洞察分析、人生纪要）从HTTP请求中移到后台执行
+
+任务持久化在SQLite的 analysis_jobs 表中，进程重启后未完成的任务会继续执行；
+worker池按上游服务限制并发，并支持把自动触发的任务推迟到夜间低峰时段批量执行
+
+领取任务时写入租约（lease_until），执行期间定期续约；worker所在进程退出后租约过期，
+任务由任意进程重新领取（多个进程共用同一个数据库时不会抢走彼此正在执行的任务）
+"""
+import asyncio
+import json
+import os
+import traceback
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Any
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, AnalysisJob, DEFAULT_SESSION_ID
+
+
+# 任务处理函数：(db, session_id) -> 结果字典
+JobHandler = Callable[[AsyncSession, str], Awaitable[Dict[str, Any]]]
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+# 任务租约时长（秒）；worker每隔三分之一租约续约一次，进程退出后最多这么久任务被重新领取
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+
+# 对话保存后自动排队的任务类型，以及最后一次保存后延迟多久执行（把连续多轮对话合并成一次分析）
+ANALYSIS_AUTO_JOBS = [t for t in os.getenv("ANALYSIS_AUTO_JOBS", "insights,consolidation").split(",") if t]
+ANALYSIS_DEBOUNCE_SECONDS = int(os.getenv("ANALYSIS_DEBOUNCE_SECONDS", "60"))
+# 去抖最多推迟多久（从首次排队算起，秒），一直在聊天的老人也能定期得到分析
+ANALYSIS_DEBOUNCE_MAX_SECONDS = int(os.getenv("ANALYSIS_DEBOUNCE_MAX_SECONDS", "600"))
+
+# 低峰时段（本地时间，小时），例如 "1-5" 表示自动任务推迟到凌晨1点到5点之间执行；留空则不推迟
+ANALYSIS_OFFPEAK_HOURS = os.getenv("ANALYSIS_OFFPEAK_HOURS", "")
+
+
+def _next_offpeak_time(now: datetime) -> datetime:
+    """下一个低峰时段的开始时间（当前已在低峰时段内则返回 now）"""
+    if not ANALYSIS_OFFPEAK_HOURS:
+        return now
+    start_hour, end_hour = (int(h) for h in ANALYSIS_OFFPEAK_HOURS.split("-"))
+    in_window = (
+        start_hour <= now.hour < end_hour if start_hour <= end_hour
+        else now.hour >= start_hour or now.hour < end_hour
+    )
+    if in_window:
+        return now
+    start = now.replace(hour=start_hour, minute=0, second=0, microsecond=0)
+    return start if start > now else start + timedelta(days=1)
+
+
+def job_to_dict(job: AnalysisJob, include_result: bool = False) -> Dict[str, Any]:
+    data = {
+        "job_id": job.id,
+        "job_type": job.job_type,
+        "session_id": job.session_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error,
+        "run_after": job.run_after.isoformat() if job.run_after else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if include_result:
+        data["result"] = json.loads(job.result) if job.result else None
+    return data
+
+
+class JobQueue:
+    """SQLite持久化的分析任务队列 + 异步worker池"""
+    
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self.handlers: Dict[str, Tuple[JobHandler, str]] = {}
+        # 各任务类型在对话保存后延迟多久执行、最多推迟多久（未指定时为 ANALYSIS_DEBOUNCE_SECONDS / _MAX_SECONDS）
+        self.auto_delays: Dict[str, int] = {}
+        self.auto_max_delays: Dict[str, int] = {}
+        self.upstream_limits: Dict[str, asyncio.Semaphore] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = []
+        self._stopping = False
+    
+    def register(
+        self,
+        job_type: str,
+        handler: JobHandler,
+        upstream: str,
+        auto_delay: Optional[int] = None,
+        auto_max_delay: Optional[int] = None
+    ):
+        """
+        注册任务类型；同一上游的任务共享并发上限（JOB_CONCURRENCY_<UPSTREAM>，默认1）
+        
+        auto_delay：自动排队时，最后一次对话保存后延迟多少秒执行（去抖）
+        auto_max_delay：去抖最多推迟到首次排队后多少秒；与 auto_delay 相同时即
+        "对话过的老人每隔这么久执行一次"（节流）
+        """
+        self.handlers[job_type] = (handler, upstream)
+        if auto_delay is not None:
+            self.auto_delays[job_type] = auto_delay
+        if auto_max_delay is not None:
+            self.auto_max_delays[job_type] = auto_max_delay
+        if upstream not in self.upstream_limits:
+            limit = int(os.getenv(f"JOB_CONCURRENCY_{upstream.upper()}", "1"))
+            self.upstream_limits[upstream] = asyncio.Semaphore(limit)
+    
+    # ---------- 入队与查询 ----------
+    
+    async def enqueue(
+        self,
+        job_type: str,
+        session_id: str = DEFAULT_SESSION_ID,
+        run_after: Optional[datetime] = None,
+        max_delay: Optional[timedelta] = None,
+    ) -> AnalysisJob:
+        """
+        加入一个任务；同一老人同类型已有排队中的任务时直接复用它
+        
+        - 未指定 max_delay（手动触发）：取两者中较早的执行时间，不会被自动任务的延迟拖后
+        - 指定 max_delay（去抖）：执行时间推后到 run_after，但不晚于首次排队后 max_delay，
+          也不早于原来的执行时间
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f"未知的任务类型: {job_type}")
+        
+        run_after = run_after or datetime.utcnow()
+        async with SessionLocal() as db:
+            job = await db.scalar(
+                select(AnalysisJob).where(
+                    AnalysisJob.job_type == job_type,
+                    AnalysisJob.session_id == session_id,
+                    AnalysisJob.status == "queued"
+                ).limit(1)
+            )
+            if job is None:
+                job = AnalysisJob(job_type=job_type, session_id=session_id, run_after=run_after)
+                db.add(job)
+            elif max_delay is None:
+                if run_after < job.run_after:
+                    job.run_after = run_after
+            else:
+                job.run_after = max(job.run_after, min(run_after, job.created_at + max_delay))
+            await db.commit()
+            await db.refresh(job)
+        
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+    
+    async def schedule_after_save(self, session_id: str = DEFAULT_SESSION_ID):
+        """对话保存后自动排队分析任务（去抖 + 可选推迟到低峰时段）"""
+        now = datetime.utcnow()
+        for job_type in ANALYSIS_AUTO_JOBS:
+            if job_type not in self.handlers:
+                continue
+            run_after = now + timedelta(seconds=self.auto_delays.get(job_type, ANALYSIS_DEBOUNCE_SECONDS))
+            if ANALYSIS_OFFPEAK_HOURS:
+                local_run_after = datetime.now() + (run_after - now)
+                run_after += _next_offpeak_time(local_run_after) - local_run_after
+            max_delay = timedelta(seconds=max(
+                self.auto_max_delays.get(job_type, ANALYSIS_DEBOUNCE_MAX_SECONDS),
+                self.auto_delays.get(job_type, ANALYSIS_DEBOUNCE_SECONDS)
+            ))
+            await self.enqueue(job_type, session_id, run_after=run_after, max_delay=max_delay)
+    
+    async def get(self, job_id: int) -> Optional[AnalysisJob]:
+        async with SessionLocal() as db:
+            return await db.get(AnalysisJob, job_id)
+    
+    # ---------- worker ----------
+    
+    async def start(self):
+        """启动worker池；异常退出的进程遗留的running任务在租约过期后由 _claim 重新领取"""
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"✅ 分析任务队列已启动（{self.workers}个worker）")
+    
+    async def stop(self):
+        # wait_for 在被唤醒的同时被取消时可能吞掉取消，worker 同时检查停止标记
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    @staticmethod
+    def _claimable(now: datetime):
+        """到期的排队任务，或租约已过期的running任务（执行它的进程已退出；旧版本遗留的任务没有租约）"""
+        return or_(
+            and_(AnalysisJob.status == "queued", AnalysisJob.run_after <= now),
+            and_(
+                AnalysisJob.status == "running",
+                or_(AnalysisJob.lease_until.is_(None), AnalysisJob.lease_until < now)
+            )
+        )
+    
+    async def _claim(self) -> Optional[AnalysisJob]:
+        """原子地领取一个到期的任务（多个worker/进程之间不会重复领取）"""
+        async with SessionLocal() as db:
+            now = datetime.utcnow()
+            candidates = (await db.execute(
+                select(AnalysisJob.id).where(
+                    self._claimable(now),
+                    AnalysisJob.job_type.in_(list(self.handlers))
+                ).order_by(AnalysisJob.run_after.asc(), AnalysisJob.id.asc()).limit(5)
+            )).scalars().all()
+            
+            for job_id in candidates:
+                claimed = (await db.execute(
+                    update(AnalysisJob)
+                    .where(AnalysisJob.id == job_id, self._claimable(now))
+                    .values(
+                        status="running",
+                        started_at=now,
+                        lease_until=now + timedelta(seconds=JOB_LEASE_SECONDS),
+                        attempts=AnalysisJob.attempts + 1
+                    )
+                )).rowcount
+                await db.commit()
+                if claimed:
+                    return await db.get(AnalysisJob, job_id)
+            return None
+    
+    async def _renew_lease(self, job_id: int):
+        """任务执行期间定期续约"""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            async with SessionLocal() as db:
+                await db.execute(
+                    update(AnalysisJob)
+                    .where(AnalysisJob.id == job_id, AnalysisJob.status == "running")
+                    .values(lease_until=datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS))
+                )
+                await db.commit()
+    
+    async def _finish(self, job_id: int, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        async with SessionLocal() as db:
+            job = await db.get(AnalysisJob, job_id)
+            job.lease_until = None
+            if error is None:
+                job.status = "done"
+                job.result = json.dumps(result, ensure_ascii=False)
+                job.error = None
+                job.finished_at = datetime.utcnow()
+            elif job.attempts < JOB_MAX_ATTEMPTS:
+                # 重试：指数退避后重新排队
+                job.status = "queued"
+                job.error = error
+                job.run_after = datetime.utcnow() + timedelta(seconds=30 * 2 ** (job.attempts - 1))
+            else:
+                job.status = "failed"
+                job.error = error
+                job.finished_at = datetime.utcnow()
+            await db.commit()
+    
+    async def _worker(self):
+        while not self._stopping:
+            job = await self._claim()
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            handler, upstream = self.handlers[job.job_type]
+            print(f"🔧 执行分析任务 #{job.id}: {job.job_type} ({job.session_id})")
+            lease = asyncio.create_task(self._renew_lease(job.id))
+            try:
+                async with self.upstream_limits[upstream]:
+                    async with SessionLocal() as db:
+                        result = await handler(db, job.session_id)
+                await self._finish(job.id, result)
+                print(f"✅ 分析任务 #{job.id} 完成")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                await self._finish(job.id, None, str(e))
+                print(f"❌ 分析任务 #{job.id} 失败: {e}")
+            finally:
+                lease.cancel()
+
+
+# 全局实例
+job_queue = JobQueue()
@@ -5,17 +5,37 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, Depends
+from fastapi import FastAPI, UploadFile, File, Form, Query, BackgroundTasks, Depends, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, JSONResponse
-from sqlalchemy.orm import Session
-from datetime import datetime
+from fastapi.responses import Response, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, Field
 from urllib.parse import quote
-import uuid
+import asyncio
+import json
+import re
 
-from database import init_db, get_db, ChatHistory
-from vector_store import vector_store
+from database import init_db, get_db, SessionLocal, DEFAULT_SESSION_ID, SESSION_ID_PATTERN
+from embeddings import embedding_function
+from tts_cache import tts_cache
+from response_cache import response_cache
+from audio_preprocess import audio_preprocessor
 from ai_services import ai_services
+from call_session import CallSession, Utterance, AUDIO_FORMATS
+from timing import StageTimer
+from insights import build_dashboard_insights
+from job_queue import job_queue, job_to_dict
+from persistence import conversation_writer
+from biography import build_biography
+from consolidation import consolidate_memories, CONSOLIDATION_INTERVAL_SECONDS
+from prompt_builder import prompt_builder
+from retrieval import memory_retriever
+from working_set import working_set
+from resilience import resilience, start_turn, end_turn
+from speculation import speculation_stats
+from conversations import list_conversations, export_conversations, parse_fields, EXPORT_FORMATS
+from metrics import cache_stats_collector, render_metrics, METRICS_CONTENT_TYPE
 
 # 初始化FastAPI
 app = FastAPI(title="YuKeSong API", version="1.0.0")
@@ -29,15 +49,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# /metrics 抓取时读取各缓存的命中统计
+cache_stats_collector.register("tts", tts_cache.stats)
+cache_stats_collector.register("response", response_cache.stats)
+cache_stats_collector.register("embeddings", embedding_function.stats)
+cache_stats_collector.register("working_set", working_set.stats)
+
 # 启动时初始化数据库
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    await init_db()
     print("✅ 数据库已初始化")
     print("✅ ChromaDB已就绪")
+    await ai_services.startup()
+    await job_queue.start()
+    await conversation_writer.start()
     print("🚀 服务器启动成功！")
 
 
+# 关闭时写完缓冲中的对话，并释放上游连接池
+@app.on_event("shutdown")
+async def shutdown_event():
+    await conversation_writer.stop()
+    await job_queue.stop()
+    await ai_services.shutdown()
+
+
 @app.get("/")
 async def root():
     """健康检查"""
@@ -63,15 +100,48 @@ async def check_config():
         },
         "elevenlabs": {
             "configured": bool(ai_services.elevenlabs_api_key)
+        },
+        # 当前使用的服务商，fake 为本地模拟服务
+        "providers": {
+            "stt": ai_services.stt.name,
+            "llm": ai_services.llm.name,
+            "tts": ai_services.tts.name
         }
     }
 
 
+@app.get("/api/stats")
+async def get_stats():
+    """运行状态统计（监控用）"""
+    return {
+        "http_pools": ai_services.pool_stats(),
+        "providers": ai_services.provider_stats(),
+        "write_behind": conversation_writer.stats(),
+        "embeddings": embedding_function.stats(),
+        "tts_cache": tts_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "prompt": prompt_builder.stats(),
+        "retrieval": memory_retriever.stats(),
+        "working_set": working_set.stats(),
+        "resilience": resilience.stats(),
+        "speculation": speculation_stats(),
+        "audio_preprocess": audio_preprocessor.stats()
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标：各阶段耗时直方图、上游错误、兜底话术、缓存命中（见 metrics.py）"""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.post("/api/chat")
 async def chat_endpoint(
     audio: UploadFile = File(...),
+    session_id: str = Form(DEFAULT_SESSION_ID, pattern=SESSION_ID_PATTERN),
+    stream: bool = False,
     background_tasks: BackgroundTasks = BackgroundTasks(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     核心交互端点 (F-007)
@@ -82,62 +152,83 @@ async def chat_endpoint(
     3. LLM: Gemini生成回复
     4. TTS: ElevenLabs生成语音
     5. Save: 后台保存到数据库和向量库
+    
+    stream=true 时以分块方式返回音频：LLM每生成完一句就立即合成并下发，
+    此时完整的AI文本无法放进响应头，只返回 X-User-Text
+    
+    各阶段耗时通过 Server-Timing 响应头返回（流式模式只包含开始下发前的阶段），
+    同时记入 /metrics 的阶段耗时直方图
     """
+    timer = StageTimer("chat_stream" if stream else "chat")
     try:
         # 读取音频数据
-        audio_data = await audio.read()
+        with timer.stage("upload"):
+            audio_data = await audio.read()
+        # 本轮的时间预算从收到完整音频开始计算，各阶段的超时由此推出
+        start_turn()
         
         # Step 1: STT - 语音转文字
-        user_text = await ai_services.speech_to_text(audio_data)
+        with timer.stage("stt"):
+            user_text = await ai_services.speech_to_text(audio_data)
         
-        if not user_text or user_text == "语音识别失败，请重试":
+        if not user_text:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "没有检测到语音"}
+            )
+        if user_text == ai_services.STT_FAILED_TEXT:
             return JSONResponse(
                 status_code=400,
                 content={"error": "语音识别失败"}
             )
         
-        # Step 2: 检索相关记忆
-        relevant_memories = vector_store.query_relevant_memories(user_text, n_results=3)
+        # Step 2: 检索相关记忆 + 最近对话历史
+        history_list, relevant_memories = await load_context(db, session_id, user_text, timer)
         
-        # 获取最近对话历史
-        recent_history = db.query(ChatHistory).order_by(
-            ChatHistory.timestamp.desc()
-        ).limit(5).all()
+        # 常见寒暄命中语义缓存时直接复用之前的回复（SEMANTIC_CACHE_ENABLED=1 时启用）
+        with timer.stage("reply_cache"):
+            cached_reply = await response_cache.lookup(session_id, user_text, history_list)
         
-        history_list = [
-            {"user_text": h.user_text, "ai_text": h.ai_text}
-            for h in reversed(recent_history)
-        ]
+        if stream:
+            return _stream_chat_reply(
+                session_id, user_text, history_list, relevant_memories, timer, cached_reply
+            )
         
         # Step 3: LLM - 生成AI回复
-        ai_text = await ai_services.generate_response(
-            user_text=user_text,
-            conversation_history=history_list,
-            relevant_memories=relevant_memories
-        )
+        if cached_reply is not None:
+            ai_text = cached_reply
+        else:
+            with timer.stage("llm"):
+                ai_text = await ai_services.generate_response(
+                    user_text=user_text,
+                    conversation_history=history_list,
+                    relevant_memories=relevant_memories
+                )
+            await response_cache.store(session_id, user_text, ai_text)
         
         # Step 4: TTS - 生成语音
-        audio_response = await ai_services.text_to_speech(ai_text)
+        with timer.stage("tts"):
+            audio_response = await ai_services.text_to_speech(ai_text)
         
         # Step 5: 后台保存（不阻塞响应）
         background_tasks.add_task(
             save_conversation,
-            db=db,
+            session_id=session_id,
             user_text=user_text,
             ai_text=ai_text
         )
         
         # 返回音频和文本（对中文进行URL编码以支持HTTP header）
-        from urllib.parse import quote
         return Response(
             content=audio_response,
             media_type="audio/mpeg",
             headers={
                 "X-AI-Text": quote(ai_text),  # URL编码中文
-                "X-User-Text": quote(user_text)
+                "X-User-Text": quote(user_text),
+                "Server-Timing": _finish_timing(timer)
             }
         )
-        
+    
     except Exception as e:
         print(f"Chat Error: {e}")
         return JSONResponse(
@@ -146,32 +237,234 @@ async def chat_endpoint(
         )
 
 
-def save_conversation(db: Session, user_text: str, ai_text: str):
-    """后台任务：保存对话到数据库和向量库"""
+async def _prepare_call_context(session_id: str, user_text: str) -> dict:
+    """通话中用中间识别结果推测性地准备上下文：记忆、最近对话和组装好的prompt"""
+    async with SessionLocal() as db:
+        history_list, relevant_memories = await load_context(db, session_id, user_text)
+    return {
+        "history": history_list,
+        "memories": relevant_memories,
+        "messages": ai_services.build_companion_messages(user_text, history_list, relevant_memories)
+    }
+
+
+def _finish_timing(timer: StageTimer) -> str:
+    timer.finish()
+    return timer.server_timing()
+
+
+async def load_context(db: AsyncSession, session_id: str, user_text: str, timer: StageTimer = None):
+    """
+    检索该老人的相关记忆和最近5轮对话历史，返回 (history_list, relevant_memories)
+    
+    两者互不依赖，并发执行：ChromaDB的向量化+ANN检索是阻塞调用，放到线程池中；
+    对话历史通常直接取自内存工作集（working_set.py），首次访问时走异步数据库会话
+    """
+    timer = timer or StageTimer()
+    relevant_memories, history_list = await asyncio.gather(
+        timer.run_in_threadpool(
+            "memory", memory_retriever.retrieve,
+            user_text, n_results=3, session_id=session_id
+        ),
+        timer.run("history", working_set.recent(db, session_id)),
+    )
+    return history_list, relevant_memories
+
+
+@app.websocket("/ws/call")
+async def call_websocket(websocket: WebSocket):
+    """
+    全双工通话端点
+    
+    用户说话时音频分片持续上传并增量识别，说完后在同一连接上推送
+    识别结果、逐句的AI文本和音频；一个连接服务整通电话。协议见 call_session.py
+    
+    老人ID通过查询参数传入：/ws/call?session_id=xxx
+    音频格式：format=webm（默认，客户端判断说完）或 format=pcm16（服务端端点检测）
+    """
+    session_id = websocket.query_params.get("session_id", DEFAULT_SESSION_ID)
+    audio_format = websocket.query_params.get("format", "webm")
+    if not re.fullmatch(SESSION_ID_PATTERN, session_id) or audio_format not in AUDIO_FORMATS:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    session = CallSession(
+        websocket, session_id, audio_format,
+        prepare=lambda text: _prepare_call_context(session_id, text)
+    )
+    await session.send_event("ready", format=audio_format)
+    
     try:
-        # 保存到SQLite
-        chat = ChatHistory(
-            session_id="demo_elder",
-            user_text=user_text,
-            ai_text=ai_text,
-            timestamp=datetime.utcnow()
-        )
-        db.add(chat)
-        db.commit()
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            if message.get("bytes") is not None:
+                if await session.add_audio(message["bytes"]):
+                    session.dispatch_turn(_run_call_turn)
+                continue
+            
+            event = json.loads(message.get("text") or "{}")
+            event_type = event.get("type")
+            
+            # 识别和回复在后台进行，接收循环继续收下一句话的音频和插话、挂断
+            if event_type == "end_of_utterance":
+                session.dispatch_turn(_run_call_turn)
+            elif event_type == "cancel":
+                session.reset()
+            elif event_type == "interrupt":
+                await session.interrupt()
+            elif event_type == "hangup":
+                await websocket.close()
+                break
+    
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await session.close()
+        print(f"📴 通话结束，共 {session.turns} 轮")
+
+
+async def _run_call_turn(session: CallSession, utterance: Utterance):
+    """处理通话中的一轮：最终识别 → 检索上下文 → 逐句生成并下发语音 → 保存"""
+    # 本轮结束后清除截止时间，之后的中间识别等后台任务不会继承已过期的截止时间
+    turn = start_turn()
+    try:
+        await _handle_call_turn(session, utterance, StageTimer("call"))
+    finally:
+        end_turn(turn)
+
+
+async def _handle_call_turn(session: CallSession, utterance: Utterance, timer: StageTimer):
+    with timer.stage("stt"):
+        user_text = await session.transcribe(utterance)
+    if not user_text:
+        await session.send_event("no_speech")
+        return
+    if user_text == ai_services.STT_FAILED_TEXT:
+        await session.send_event("error", error="语音识别失败")
+        return
+    await session.send_event("transcript", text=user_text)
+    
+    try:
+        # 说话过程中已用中间识别结果准备好的上下文，与最终文字足够接近时直接复用
+        with timer.stage("speculation"):
+            speculative = await session.take_speculation(utterance, user_text)
+        if speculative is not None:
+            history_list, relevant_memories = speculative["history"], speculative["memories"]
+            messages = speculative["messages"]
+        else:
+            async with SessionLocal() as db:
+                history_list, relevant_memories = await load_context(
+                    db, session.session_id, user_text, timer
+                )
+            messages = None
+        with timer.stage("reply_cache"):
+            cached_reply = await response_cache.lookup(session.session_id, user_text, history_list)
         
-        # 保存到ChromaDB
-        conversation_id = f"conv_{uuid.uuid4().hex[:8]}"
-        vector_store.add_conversation(conversation_id, user_text, ai_text)
+        sentences = []
+        reply_started = timer.total_ms()
+        try:
+            with session.replying():
+                async for sentence, audio_chunk in ai_services.stream_reply(
+                    user_text=user_text,
+                    conversation_history=history_list,
+                    relevant_memories=relevant_memories,
+                    reply_text=cached_reply,
+                    messages=messages
+                ):
+                    if not sentences:
+                        timer.record("first_audio", (timer.total_ms() - reply_started) / 1000)
+                    sentences.append(sentence)
+                    await session.send_sentence(sentence, audio_chunk)
+        except asyncio.CancelledError:
+            # 老人插话或挂断：保存已经说出口的部分
+            if sentences:
+                await save_conversation(session.session_id, user_text, "".join(sentences))
+            raise
+        timer.record("reply", (timer.total_ms() - reply_started) / 1000)
         
-        print(f"✅ 对话已保存: {user_text[:20]}...")
+        ai_text = "".join(sentences)
+        await session.send_event("turn_end", ai_text=ai_text, timings=timer.finish())
         
+        if ai_text:
+            await save_conversation(session.session_id, user_text, ai_text)
+            if cached_reply is None:
+                await response_cache.store(session.session_id, user_text, ai_text)
+    except Exception as e:
+        print(f"Call Turn Error: {e}")
+        await session.send_event("error", error=str(e))
+
+
+def _stream_chat_reply(
+    session_id: str,
+    user_text: str,
+    history_list: list,
+    relevant_memories: list,
+    timer: StageTimer,
+    cached_reply: str = None
+) -> StreamingResponse:
+    """流式模式：边生成边合成，逐句下发MP3音频块"""
+    sentences = []
+    completed = False
+    
+    async def audio_chunks():
+        nonlocal completed
+        reply_started = timer.total_ms()
+        async for sentence, audio_chunk in ai_services.stream_reply(
+            user_text=user_text,
+            conversation_history=history_list,
+            relevant_memories=relevant_memories,
+            reply_text=cached_reply
+        ):
+            if not sentences:
+                timer.record("first_audio", (timer.total_ms() - reply_started) / 1000)
+            sentences.append(sentence)
+            if audio_chunk:
+                yield audio_chunk
+        timer.record("reply", (timer.total_ms() - reply_started) / 1000)
+        completed = True
+    
+    async def save_streamed_reply():
+        timer.finish()
+        # 响应结束后再保存（客户端中途断开时只保存已生成的部分）
+        if sentences:
+            await save_conversation(session_id, user_text, "".join(sentences))
+        # 只缓存完整生成的回复
+        if completed and cached_reply is None:
+            await response_cache.store(session_id, user_text, "".join(sentences))
+    
+    return StreamingResponse(
+        audio_chunks(),
+        media_type="audio/mpeg",
+        headers={
+            "X-User-Text": quote(user_text),
+            "Server-Timing": timer.server_timing()
+        },
+        background=BackgroundTask(save_streamed_reply)
+    )
+
+
+async def save_conversation(session_id: str, user_text: str, ai_text: str):
+    """
+    保存对话到数据库和向量库
+    
+    只写入内存缓冲和本地日志，由 conversation_writer 按批次落库（见 persistence.py）
+    """
+    try:
+        await conversation_writer.add(session_id, user_text, ai_text)
+        working_set.append(session_id, user_text, ai_text)
     except Exception as e:
         print(f"保存失败: {e}")
-        db.rollback()
 
 
 @app.get("/api/generate_biography")
-async def generate_biography(db: Session = Depends(get_db)):
+async def generate_biography(
+    session_id: str = Query(DEFAULT_SESSION_ID, pattern=SESSION_ID_PATTERN),
+    db: AsyncSession = Depends(get_db)
+):
     """
     演示端点 (F-008)
     
@@ -180,34 +473,8 @@ async def generate_biography(db: Session = Depends(get_db)):
     2. 认知健康评估（JSON）
     """
     try:
-        # 获取所有对话记录
-        all_conversations = db.query(ChatHistory).order_by(
-            ChatHistory.timestamp.asc()
-        ).all()
-        
-        if not all_conversations:
-            return {
-                "biography": "## 暂无对话记录\n\n请先与老人进行对话。",
-                "cognitive_assessment": {
-                    "overall_risk": "未评估",
-                    "memory_score": 0,
-                    "time_orientation": 0,
-                    "language_fluency": 0,
-                    "concerns": ["暂无数据"]
-                },
-                "total_conversations": 0
-            }
-        
-        # 调用AI生成传记和评估
-        result = await ai_services.generate_biography(all_conversations)
-        
-        return {
-            **result,
-            "total_conversations": len(all_conversations),
-            "first_conversation": all_conversations[0].timestamp.isoformat(),
-            "last_conversation": all_conversations[-1].timestamp.isoformat()
-        }
-        
+        return await build_biography(db, session_id)
+    
     except Exception as e:
         print(f"Biography Error: {e}")
         return JSONResponse(
@@ -217,28 +484,58 @@ async def generate_biography(db: Session = Depends(get_db)):
 
 
 @app.get("/api/conversations")
-async def get_conversations(limit: int = 50, db: Session = Depends(get_db)):
-    """获取对话历史（调试用）"""
-    conversations = db.query(ChatHistory).order_by(
-        ChatHistory.timestamp.desc()
-    ).limit(limit).all()
+async def get_conversations(
+    limit: int = Query(50, ge=1),
+    cursor: str = None,
+    fields: str = None,
+    session_id: str = Query(DEFAULT_SESSION_ID, pattern=SESSION_ID_PATTERN),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    获取某个老人的对话历史（按时间倒序分页）
     
-    return {
-        "total": len(conversations),
-        "conversations": [
-            {
-                "id": conv.id,
-                "user_text": conv.user_text,
-                "ai_text": conv.ai_text,
-                "timestamp": conv.timestamp.isoformat()
-            }
-            for conv in conversations
-        ]
-    }
+    - cursor：上一页返回的 next_cursor，翻页成本与页码无关
+    - fields：只返回指定的列，逗号分隔，例如 fields=user_text,timestamp
+    """
+    try:
+        return await list_conversations(db, session_id, limit, cursor, parse_fields(fields))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+
+@app.get("/api/conversations/export")
+async def export_conversations_endpoint(
+    format: str = "ndjson",
+    fields: str = None,
+    session_id: str = Query(DEFAULT_SESSION_ID, pattern=SESSION_ID_PATTERN)
+):
+    """
+    导出某个老人的全部对话（按时间正序，NDJSON或CSV）
+    
+    边查询边下发，内存占用与对话总数无关
+    """
+    if format not in EXPORT_FORMATS:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"不支持的导出格式: {format}（可选: {', '.join(EXPORT_FORMATS)}）"}
+        )
+    try:
+        columns = parse_fields(fields)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    
+    return StreamingResponse(
+        export_conversations(session_id, format, columns),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{session_id}_conversations.{format}"'}
+    )
 
 
 @app.get("/api/dashboard/insights")
-async def get_dashboard_insights(db: Session = Depends(get_db)):
+async def get_dashboard_insights(
+    session_id: str = Query(DEFAULT_SESSION_ID, pattern=SESSION_ID_PATTERN),
+    db: AsyncSession = Depends(get_db)
+):
     """
     仪表盘端点 - 对话洞察分析
     
@@ -247,43 +544,14 @@ async def get_dashboard_insights(db: Session = Depends(get_db)):
     2. 情感分析（用户情绪、需求）
     3. 认知能力评估（记忆、时间定向、语言能力）
     4. 关键信息提取
+    
+    分析结果按老人缓存，只有出现新对话时才重新分析（少量新增时增量合并），
+    仪表盘轮询大多直接命中缓存
     """
     try:
-        # 获取所有对话记录
-        all_conversations = db.query(ChatHistory).order_by(
-            ChatHistory.timestamp.desc()
-        ).all()
-        
-        if not all_conversations:
-            return {
-                "summary": "暂无对话数据",
-                "total_conversations": 0,
-                "emotion_analysis": {},
-                "cognitive_assessment": {},
-                "key_insights": []
-            }
-        
-        # 调用AI进行深度分析
-        insights = await ai_services.generate_dashboard_insights(all_conversations)
-        
-        # 添加统计信息
-        insights["statistics"] = {
-            "total_conversations": len(all_conversations),
-            "first_conversation": all_conversations[-1].timestamp.isoformat(),
-            "last_conversation": all_conversations[0].timestamp.isoformat(),
-            "avg_user_text_length": sum(len(c.user_text) for c in all_conversations) / len(all_conversations),
-            "recent_conversations": [
-                {
-                    "user": c.user_text,
-                    "ai": c.ai_text,
-                    "time": c.timestamp.isoformat()
-                }
-                for c in all_conversations[:5]
-            ]
-        }
-        
-        return insights
-        
+        # 有缓存且没有新对话时直接返回；有新对话时只分析新增部分
+        return await build_dashboard_insights(db, session_id)
+    
     except Exception as e:
         print(f"Dashboard Insights Error: {e}")
         import traceback
@@ -294,6 +562,51 @@ async def get_dashboard_insights(db: Session = Depends(get_db)):
         )
 
 
+class JobRequest(BaseModel):
+    job_type: str                  # insights / biography / consolidation
+    session_id: str = Field(DEFAULT_SESSION_ID, pattern=SESSION_ID_PATTERN)
+
+
+@app.post("/api/jobs")
+async def enqueue_job(request: JobRequest):
+    """手动排队一个后台分析任务（同一老人同类型已有排队中的任务时复用）"""
+    try:
+        job = await job_queue.enqueue(request.job_type, request.session_id)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return job_to_dict(job)
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: int):
+    """查询后台分析任务的状态"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "任务不存在"})
+    return job_to_dict(job)
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: int):
+    """获取后台分析任务的结果（任务未完成时返回409）"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "任务不存在"})
+    if job.status != "done":
+        return JSONResponse(status_code=409, content=job_to_dict(job))
+    return job_to_dict(job, include_result=True)
+
+
+# 注册后台分析任务：洞察分析、记忆整理走硅基流动，人生纪要走Gemini，各自限制并发
+# 记忆整理在首次排队后 CONSOLIDATION_INTERVAL_SECONDS 执行，不随后续对话推迟（每个老人大约每天一次）
+job_queue.register("insights", build_dashboard_insights, upstream="siliconflow")
+job_queue.register("biography", build_biography, upstream="gemini")
+job_queue.register(
+    "consolidation", consolidate_memories, upstream="siliconflow",
+    auto_delay=CONSOLIDATION_INTERVAL_SECONDS, auto_max_delay=CONSOLIDATION_INTERVAL_SECONDS
+)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
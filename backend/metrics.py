@@ -0,0 +1,142 @@
+"""
+Prometheus 监控指标 - 通过 /metrics 暴露
+
+- yukesong_stage_duration_seconds：各阶段耗时直方图（STT、记忆检索、历史查询、LLM、TTS、落库……），
+  按入口（chat / chat_stream / call / write_behind）区分，由 StageTimer 自动记录
+- yukesong_upstream_errors_total：上游服务商调用失败次数（按类别、服务商、HTTP状态码）
+- yukesong_fallbacks_total：返回兜底话术的次数（例如"语音识别失败，请重试"）
+- yukesong_upstream_retries_total / yukesong_upstream_hedges_total / yukesong_circuit_open：
+  上游调用的重试、对冲次数和熔断状态（见 resilience.py）
+- yukesong_cache_hits_total / yukesong_cache_misses_total：各缓存的命中情况，
+  抓取时直接读取各缓存已有的 stats()，不重复计数
+"""
+import os
+from typing import Any, Callable, Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily
+
+
+# 阶段耗时的直方图分桶（秒）：覆盖从几毫秒的缓存查询到十几秒的LLM长回复
+STAGE_BUCKETS = tuple(
+    float(b) for b in os.getenv(
+        "METRICS_STAGE_BUCKETS",
+        "0.005,0.01,0.025,0.05,0.1,0.25,0.5,0.75,1,1.5,2,3,5,8,13,20,30"
+    ).split(",")
+)
+
+
+STAGE_SECONDS = Histogram(
+    "yukesong_stage_duration_seconds",
+    "各处理阶段耗时（秒）",
+    ["route", "stage"],
+    buckets=STAGE_BUCKETS
+)
+
+UPSTREAM_ERRORS = Counter(
+    "yukesong_upstream_errors_total",
+    "上游服务商调用失败次数（status 为HTTP状态码，网络错误等为 exception）",
+    ["kind", "provider", "status"]
+)
+
+FALLBACKS = Counter(
+    "yukesong_fallbacks_total",
+    "返回兜底结果的次数",
+    ["reason"]
+)
+
+
+UPSTREAM_RETRIES = Counter(
+    "yukesong_upstream_retries_total",
+    "上游调用失败后的重试次数",
+    ["kind", "provider"]
+)
+
+UPSTREAM_HEDGES = Counter(
+    "yukesong_upstream_hedges_total",
+    "超过p95耗时后发出的对冲请求数",
+    ["kind", "provider"]
+)
+
+CIRCUIT_OPEN = Gauge(
+    "yukesong_circuit_open",
+    "上游是否处于熔断状态（1为熔断）",
+    ["upstream"]
+)
+
+
+def observe_stage(route: str, stage: str, seconds: float):
+    STAGE_SECONDS.labels(route=route, stage=stage).observe(seconds)
+
+
+def record_upstream_error(kind: str, provider: str, error: Exception):
+    """记录一次上游调用失败；ProviderError 带HTTP状态码，其他异常记为 exception"""
+    status = getattr(error, "status_code", None)
+    UPSTREAM_ERRORS.labels(
+        kind=kind, provider=provider, status=str(status) if status is not None else "exception"
+    ).inc()
+
+
+def record_fallback(reason: str):
+    FALLBACKS.labels(reason=reason).inc()
+
+
+def record_retry(kind: str, provider: str):
+    UPSTREAM_RETRIES.labels(kind=kind, provider=provider).inc()
+
+
+def record_hedge(kind: str, provider: str):
+    UPSTREAM_HEDGES.labels(kind=kind, provider=provider).inc()
+
+
+def set_circuit_open(upstream: str, is_open: bool):
+    CIRCUIT_OPEN.labels(upstream=upstream).set(1 if is_open else 0)
+
+
+class CacheStatsCollector:
+    """
+    抓取时把各缓存 stats() 中的命中/未命中计数转换为 Prometheus 计数器
+    
+    键名以 hits 结尾的是命中（memory_hits → tier="memory"，hits → tier="all"），
+    misses 为未命中
+    """
+    
+    def __init__(self):
+        self.sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+    
+    def register(self, cache: str, stats: Callable[[], Dict[str, Any]]):
+        self.sources[cache] = stats
+    
+    def collect(self):
+        hits = CounterMetricFamily(
+            "yukesong_cache_hits", "缓存命中次数", labels=["cache", "tier"]
+        )
+        misses = CounterMetricFamily(
+            "yukesong_cache_misses", "缓存未命中次数", labels=["cache"]
+        )
+        for cache, stats in self.sources.items():
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"⚠️  读取缓存统计失败（{cache}）: {e}")
+                continue
+            for key, value in values.items():
+                if key.endswith("hits"):
+                    tier = key[:-len("hits")].rstrip("_") or "all"
+                    hits.add_metric([cache, tier], value)
+                elif key == "misses":
+                    misses.add_metric([cache], value)
+        yield hits
+        yield misses
+
+
+def render_metrics() -> bytes:
+    """Prometheus 文本格式的全部指标"""
+    return generate_latest(REGISTRY)
+
+
+# 全局实例
+cache_stats_collector = CacheStatsCollector()
+REGISTRY.register(cache_stats_collector)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -0,0 +1,333 @@
+"""
+对话写入缓冲（write-behind）- 把每轮对话的落库从请求路径中移出，并批量写入
+
+每轮对话先进入内存缓冲并追加到本地日志文件（JSONL，在线程池中写入并fsync，同时到达的多条合并为一次写入），
+达到条数或时间阈值后：
+1. 一次批量 INSERT 写入 chat_history（一个事务，一次fsync）
+2. 按老人分组，一次 upsert 写入 ChromaDB
+3. 为涉及的老人排队后台分析任务
+
+进程崩溃时尚未落库的对话保留在日志文件中，下次启动时重放；
+写入失败（数据库锁定、连接断开、向量库不可用）时按指数退避重试，记录一直保留，不会因为一段时间的故障丢失；
+只有记录本身有问题（违反约束、数据错误）、重试也不会成功时才移到死信文件，不再阻塞后续批次
+"""
+import asyncio
+import json
+import os
+import time
+import traceback
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.exc import DataError, IntegrityError
+
+from database import SessionLocal, ChatHistory, DEFAULT_SESSION_ID
+from vector_store import vector_store
+from job_queue import job_queue
+from timing import StageTimer
+
+
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "20"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "2.0"))
+WRITE_JOURNAL_PATH = os.getenv("WRITE_JOURNAL_PATH", "./write_journal.jsonl")
+# 写入失败后的退避：第一次等待多少秒，之后每次翻倍，最多等待多少秒
+WRITE_RETRY_BASE_SECONDS = float(os.getenv("WRITE_RETRY_BASE_SECONDS", str(WRITE_FLUSH_INTERVAL)))
+WRITE_RETRY_MAX_SECONDS = float(os.getenv("WRITE_RETRY_MAX_SECONDS", "60"))
+# 重试也不会成功的记录移到死信文件（保留原始记录，可人工重放）
+WRITE_DEAD_LETTER_PATH = os.getenv("WRITE_DEAD_LETTER_PATH", "./write_dead_letter.jsonl")
+
+# 记录本身的问题（违反约束、数据错误）：重试不会成功。数据库锁定、连接断开等其他错误都会重试
+PERMANENT_WRITE_ERRORS = (IntegrityError, DataError)
+
+
+class ConversationWriter:
+    """对话写入缓冲：内存队列 + 本地日志，按批次写入SQLite和ChromaDB"""
+    
+    def __init__(
+        self,
+        batch_size: int = WRITE_BATCH_SIZE,
+        flush_interval: float = WRITE_FLUSH_INTERVAL,
+        journal_path: str = WRITE_JOURNAL_PATH,
+        retry_base: float = WRITE_RETRY_BASE_SECONDS,
+        retry_max: float = WRITE_RETRY_MAX_SECONDS,
+        dead_letter_path: str = WRITE_DEAD_LETTER_PATH,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal_path = journal_path
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.dead_letter_path = dead_letter_path
+        # 连续失败次数和下次允许写入的时间（time.monotonic()），用于指数退避
+        self._consecutive_failures = 0
+        self._retry_at = 0.0
+        
+        # 每条记录：session_id / user_text / ai_text / timestamp / conversation_id / stored / attempts
+        # stored=True 表示已写入SQLite、只差向量库（向量库写入失败时保留重试）
+        self._buffer: List[Dict[str, Any]] = []
+        # 正在写入的批次（提交前仍对 pending() 可见）
+        self._inflight: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        # 尚未写入日志文件的行；日志文件的追加和重写都在此锁内进行
+        self._journal_lines: List[str] = []
+        self._journal_lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        
+        self._stats = {
+            "written": 0,
+            "batches": 0,
+            "failures": 0,
+            "replayed": 0,
+            "dead_lettered": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+        }
+    
+    # ---------- 写入 ----------
+    
+    async def add(self, session_id: str, user_text: str, ai_text: str):
+        """记录一轮对话（写入内存和本地日志，日志落盘后返回）"""
+        record = {
+            "session_id": session_id,
+            "user_text": user_text,
+            "ai_text": ai_text,
+            "timestamp": datetime.utcnow().isoformat(),
+            "conversation_id": f"conv_{uuid.uuid4().hex[:8]}",
+            "stored": False,
+            "attempts": 0,
+        }
+        self._buffer.append(record)
+        self._journal_lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        await self._sync_journal()
+    
+    def pending(self, session_id: str = DEFAULT_SESSION_ID) -> List[Dict[str, Any]]:
+        """某个老人尚未写入SQLite的对话（含正在写入的批次，按时间正序），用于补全最近对话历史"""
+        return [
+            record for record in self._inflight + self._buffer
+            if record["session_id"] == session_id and not record["stored"]
+        ]
+    
+    async def flush(self):
+        """把缓冲区中的对话批量写入SQLite和ChromaDB；失败的记录留在缓冲区，退避后重试"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            if not self._stopping and time.monotonic() < self._retry_at:
+                # 上次写入失败，退避期间不再尝试（记录仍在缓冲区和日志中）
+                return
+            
+            batch, self._buffer = self._buffer, []
+            self._inflight = batch
+            timer = StageTimer("write_behind")
+            try:
+                written, retry, dead = await self._write(batch, timer)
+            except BaseException:
+                # 被取消（停止服务）：整批放回，日志中的记录不受影响
+                self._buffer = batch + self._buffer
+                raise
+            finally:
+                self._inflight = []
+            
+            # 放回队首，保持时间顺序
+            self._buffer = retry + self._buffer
+            if dead:
+                await self._dead_letter(dead)
+            await self._rewrite_journal()
+            
+            if retry:
+                self._consecutive_failures += 1
+                delay = min(self.retry_base * 2 ** (self._consecutive_failures - 1), self.retry_max)
+                self._retry_at = time.monotonic() + delay
+                print(f"⏳ {len(retry)}条对话{delay:g}秒后重试写入（连续失败{self._consecutive_failures}次）")
+            else:
+                self._consecutive_failures = 0
+                self._retry_at = 0.0
+            if not written:
+                return
+            
+            self._stats["written"] += len(written)
+            self._stats["batches"] += 1
+            self._stats["last_batch_size"] = len(written)
+            self._stats["last_flush_ms"] = timer.finish()["total"]
+            print(f"✅ 对话已批量保存: {len(written)}条")
+        
+        # 排队后台分析任务（去抖，可推迟到低峰时段）
+        for session_id in dict.fromkeys(record["session_id"] for record in written):
+            await job_queue.schedule_after_save(session_id)
+    
+    async def _write(self, batch: List[Dict[str, Any]], timer: StageTimer):
+        """写入一批记录，返回 (已写入, 稍后重试, 移到死信) 三组记录"""
+        try:
+            await self._write_batch(batch, timer)
+            return batch, [], []
+        except PERMANENT_WRITE_ERRORS as e:
+            self._stats["failures"] += 1
+            if len(batch) == 1:
+                print(f"❌ 对话写入失败，重试也无法成功: {e}")
+                return [], [], batch
+            # 批次中有记录本身有问题：逐条写入，只有出问题的记录移到死信文件
+            print(f"❌ 对话批量写入失败（{len(batch)}条），逐条重写: {e}")
+            written, retry, dead = [], [], []
+            for record in batch:
+                ok, again, bad = await self._write([record], timer)
+                written += ok
+                retry += again
+                dead += bad
+            return written, retry, dead
+        except Exception as e:
+            traceback.print_exc()
+            self._stats["failures"] += 1
+            print(f"❌ 对话批量写入失败（{len(batch)}条，稍后重试）: {e}")
+            for record in batch:
+                record["attempts"] = record.get("attempts", 0) + 1
+            return [], batch, []
+    
+    async def _write_batch(self, batch: List[Dict[str, Any]], timer: StageTimer):
+        new_rows = [record for record in batch if not record["stored"]]
+        if new_rows:
+            with timer.stage("sqlite"):
+                await self._insert_rows(new_rows)
+            for record in new_rows:
+                record["stored"] = True
+        
+        # 向量化是阻塞调用，放到线程池中；按ID upsert，重试不会产生重复
+        await timer.run_in_threadpool("vectors", vector_store.add_conversations, batch)
+    
+    async def _insert_rows(self, new_rows: List[Dict[str, Any]]):
+        async with SessionLocal() as db:
+            await db.execute(insert(ChatHistory), [
+                {
+                    "session_id": record["session_id"],
+                    "user_text": record["user_text"],
+                    "ai_text": record["ai_text"],
+                    "timestamp": datetime.fromisoformat(record["timestamp"]),
+                }
+                for record in new_rows
+            ])
+            await db.commit()
+    
+    # ---------- 后台刷写 ----------
+    
+    async def start(self):
+        """重放上次未写完的日志，并启动定时刷写"""
+        await self._replay_journal()
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ 对话写入缓冲已启动（每{self.batch_size}条或{self.flush_interval}秒写入一次）")
+    
+    async def stop(self):
+        """停止定时刷写，并把剩余的对话写完"""
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+    
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    # ---------- 本地日志 ----------
+    
+    async def _sync_journal(self):
+        """把尚未落盘的日志行追加到日志文件；等锁期间已被其他请求一并写入时直接返回"""
+        async with self._journal_lock:
+            lines, self._journal_lines = self._journal_lines, []
+            if lines:
+                await run_in_threadpool(_append_lines, self.journal_path, lines)
+    
+    async def _rewrite_journal(self):
+        """日志只保留仍在缓冲区中的记录（先写临时文件再替换，避免写一半时崩溃）"""
+        async with self._journal_lock:
+            # 缓冲区已包含所有尚未落盘的行，一并写入新日志
+            self._journal_lines = []
+            lines = [json.dumps(record, ensure_ascii=False) + "\n" for record in self._buffer]
+            await run_in_threadpool(_replace_file, self.journal_path, lines)
+    
+    async def _dead_letter(self, records: List[Dict[str, Any]]):
+        lines = [json.dumps(record, ensure_ascii=False) + "\n" for record in records]
+        await run_in_threadpool(_append_lines, self.dead_letter_path, lines)
+        self._stats["dead_lettered"] += len(records)
+        print(f"☠️  {len(records)}条对话无法写入，已移到死信文件 {self.dead_letter_path}")
+    
+    async def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        
+        records = []
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 崩溃时最后一行可能只写了一半
+                    continue
+        if not records:
+            return
+        
+        # 崩溃可能发生在SQLite提交之后、日志清理之前：已落库的记录标记为stored，避免重复插入
+        keys = [(r["session_id"], datetime.fromisoformat(r["timestamp"])) for r in records]
+        async with SessionLocal() as db:
+            existing = {tuple(row) for row in (await db.execute(
+                select(ChatHistory.session_id, ChatHistory.timestamp).where(
+                    tuple_(ChatHistory.session_id, ChatHistory.timestamp).in_(keys)
+                )
+            )).all()}
+        for record, key in zip(records, keys):
+            if key in existing:
+                record["stored"] = True
+        
+        self._buffer = records + self._buffer
+        self._stats["replayed"] += len(records)
+        print(f"🔁 重放未写完的对话: {len(records)}条")
+        await self.flush()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "buffered": len(self._buffer),
+            "inflight": len(self._inflight),
+            "consecutive_failures": self._consecutive_failures,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+        }
+
+
+def _append_lines(path: str, lines: List[str]):
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _replace_file(path: str, lines: List[str]):
+    if not lines:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# 全局实例
+conversation_writer = ConversationWriter()
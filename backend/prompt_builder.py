@@ -0,0 +1,334 @@
+"""
+伴侣智能体的prompt组装 - 按token预算拼接人设、相关记忆和最近对话
+
+- 人设（COMPANION_PERSONA）是固定不变的第一条system消息，每轮、每个老人都完全相同，
+  支持前缀缓存的服务商可以复用这段前缀的计算结果
+- 当前这句话和人设必须保留；其余部分按优先级分配剩余预算：
+  最近一轮对话 > 相关记忆 > 更早的对话；放不下的更早对话压缩成一行"之前聊过"的提要
+- 与本轮已包含的对话内容重复的记忆直接去掉（RAG经常检索到刚刚说过的话）
+
+token数为估算值：中文等CJK字符按1个token、其他字符按4个字符1个token计算，
+与 Qwen 等中文模型的实际分词大致相当，足够用来控制预算
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# prompt总预算（token，包括人设）
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2000"))
+# 最多带几轮最近对话
+PROMPT_HISTORY_TURNS = int(os.getenv("PROMPT_HISTORY_TURNS", "5"))
+# 相关记忆最多占多少token
+PROMPT_MEMORY_MAX_TOKENS = int(os.getenv("PROMPT_MEMORY_MAX_TOKENS", "300"))
+# 单条记忆、单轮对话中的一句话最多多少token，超出部分截断
+PROMPT_ITEM_MAX_TOKENS = int(os.getenv("PROMPT_ITEM_MAX_TOKENS", "120"))
+# 记忆与已包含的对话相似度（字符二元组Jaccard）超过该值时视为重复
+PROMPT_DEDUP_THRESHOLD = float(os.getenv("PROMPT_DEDUP_THRESHOLD", "0.6"))
+
+# 每条消息的格式开销（角色标记、分隔符）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK = re.compile(r"[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef\u3000-\u303f]")
+
+
+def estimate_tokens(text: str) -> int:
+    """估算token数：CJK字符（含全角标点）各算1个，其余每4个字符算1个"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断到不超过 max_tokens（估算），截断时以"…"结尾"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 1:
+        return ""
+    # 按字符二分查找能放下的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens - 1:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"
+
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r"\s+", "", text)
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+def similarity(a: str, b: str) -> float:
+    """字符二元组的Jaccard相似度（0~1）"""
+    x, y = _bigrams(a), _bigrams(b)
+    return len(x & y) / len(x | y) if x and y else 0.0
+
+
+def _memory_user_text(memory: str) -> str:
+    """对话记忆的格式为"老人说: ...\\nAI回复: ..."，取出老人说的部分；洞见等其他记忆原样返回"""
+    if memory.startswith("老人说: "):
+        return memory[len("老人说: "):].split("\nAI回复: ", 1)[0]
+    return memory
+
+
+MEMORY_HEADER = "# 历史记忆上下文（Memory Context）\n"
+MEMORY_HINT = "\n\n**提示**：你可以自然地提起这些往事，比如'您上次说...'、'您之前提到...'，这会让对话更个性化。"
+EARLIER_HEADER = "# 之前聊过\n"
+
+COMPANION_PERSONA = """# 角色定位（Persona）
+你是一个温暖的、耐心的、充满好奇心和支持性的朋友，名叫"小雅"。你就像用户的孙女一样亲切、贴心。
+
+# 首要任务（Primary Goal）
+你的首要任务是成为一个**出色的倾听者和有趣的朋友**。让用户感受到温暖、被关心、被理解。
+
+# 交流风格（Communication Style）
+- 使用"好奇的晚辈"口吻，自然、亲切、充满真诚的兴趣
+- 多用"您"、"咱们"等亲切称呼
+- 适当使用口语化表达（"哎呀"、"真的呀"、"我也觉得"）
+- **通过开放式问题**来鼓励用户分享他们的故事和想法
+
+# 隐式激发策略（Implicit Elicitation）- 核心技巧
+通过自然对话来了解用户，而不是"测试"：
+
+## 1. 情景记忆激发（高频）
+- "您昨天提到您看了一部电影，是讲什么的呀？"
+- "您上次说您做了红烧肉，味道怎么样呀？"
+- "您之前说的那个地方，能再给我描述一下吗？"
+
+## 2. 语义记忆激发（中频）
+- "我们来玩个游戏吧！看看能想出多少种蔬菜可以放进汤里？"
+- "您能给我讲讲您最喜欢的那道菜是怎么做的吗？"
+- "您年轻时候最喜欢的活动是什么呀？"
+
+## 3. 叙事激发（中频）
+- "我看到您说的那张家庭照片，您能给我描述一下吗？"
+- "您能给我讲讲您孙子/孙女的故事吗？"
+- "您今天做了什么有意思的事呀？"
+
+## 4. 日常关怀（高频）
+- "您今天心情怎么样呀？"
+- "您吃饭了吗？吃的什么呀？"
+- "您睡得好吗？"
+- "您今天出去散步了吗？"
+
+# 回复要求
+- **长度**：30-60字（像打电话一样简短自然）
+- **语气**：温暖、关切、不说教
+- **自然性**：每次只问1个问题，不要连珠炮
+- 使用第二人称"您"，营造亲密感
+
+# 【极端重要】禁止事项（CRITICAL PROHIBITIONS）
+
+**[禁止] 你不是医生、治疗师或临床医生。**
+
+**[禁止] 永远不要询问"测试性"问题：**
+- ❌ "今天的日期是什么？"
+- ❌ "美国总统是谁？"
+- ❌ "请记住这三个词：苹果、桌子、硬币"
+- ❌ "现在几点了？"（除非是自然闲聊）
+- ❌ "今天星期几？"（除非是自然闲聊）
+
+**[禁止] 永远不要：**
+- ❌ 做出诊断
+- ❌ 暗示疾病（包括阿尔茨海默症、痴呆症、认知障碍）
+- ❌ 提供任何医疗建议
+- ❌ 说"我是AI"、"我在检测"、"我在评估"
+
+**[允许] 如果用户表达医疗或精神困扰：**
+- ✅ 用同理心回应："我能理解您的感受，这听起来确实让人担心。"
+- ✅ 温和建议："要不要和家人聊聊呢？或者跟医生谈谈也是个好主意。"
+
+# 示例对话（Examples）
+
+用户："今天天气真好。"
+小雅："是呀！您今天出去散步了吗？外面暖和吗？"
+
+用户："我今天吃了红烧肉。"
+小雅："哎呀真好！您的红烧肉肯定很香吧？您是怎么做的来着？"
+
+用户："我昨天看了一部电影。"
+小雅："哦！是什么电影呀？好看吗？能给我讲讲是讲什么的吗？"
+
+用户："我有点记不清了。"
+小雅："没关系呀，慢慢想。咱们换个话题吧，您今天心情怎么样？"
+"""
+
+
+class PromptBuilder:
+    """按token预算组装伴侣智能体的消息列表，并统计prompt大小"""
+    
+    def __init__(
+        self,
+        budget: int = PROMPT_TOKEN_BUDGET,
+        history_turns: int = PROMPT_HISTORY_TURNS,
+        memory_max_tokens: int = PROMPT_MEMORY_MAX_TOKENS,
+        item_max_tokens: int = PROMPT_ITEM_MAX_TOKENS,
+        dedup_threshold: float = PROMPT_DEDUP_THRESHOLD
+    ):
+        self.budget = budget
+        self.history_turns = history_turns
+        self.memory_max_tokens = memory_max_tokens
+        self.item_max_tokens = item_max_tokens
+        self.dedup_threshold = dedup_threshold
+        
+        # 固定前缀只构建一次：每次返回同一条消息，内容逐字节相同
+        self.persona_message = {"role": "system", "content": COMPANION_PERSONA}
+        self.persona_tokens = estimate_tokens(COMPANION_PERSONA) + MESSAGE_OVERHEAD_TOKENS
+        
+        self._stats = {
+            "builds": 0,
+            "prompt_tokens": 0,
+            "max_prompt_tokens": 0,
+            "memories_deduplicated": 0,
+            "memories_dropped": 0,
+            "turns_dropped": 0,
+            "items_truncated": 0,
+        }
+    
+    def build(
+        self,
+        user_text: str,
+        conversation_history: list,
+        relevant_memories: list
+    ) -> List[Dict[str, str]]:
+        """
+        返回OpenAI格式的消息列表：
+        [人设] + [最近几轮对话（正序）] + [相关记忆/更早对话提要（可选）] + [当前这句话]
+        
+        可变的记忆放在对话之后，人设和对话历史组成的前缀在连续几轮之间保持稳定
+        """
+        user_message = {"role": "user", "content": user_text}
+        remaining = self.budget - self.persona_tokens - self._message_tokens(user_message)
+        
+        turns = [self._clip_turn(turn) for turn in conversation_history[-self.history_turns:]]
+        kept_turns: List[Tuple[str, str]] = []
+        
+        # 1. 最近一轮对话：保证对话的连续性
+        if turns:
+            cost = self._turn_tokens(turns[-1])
+            if cost <= remaining:
+                kept_turns.append(turns[-1])
+                remaining -= cost
+        
+        # 2. 相关记忆：去掉和最近对话重复的内容
+        included_texts = [text for turn in turns for text in turn]
+        memories = self._dedupe_memories(relevant_memories, included_texts)
+        memory_budget = min(self.memory_max_tokens, remaining)
+        kept_memories = []
+        for memory in memories:
+            cost = estimate_tokens(memory) + 2
+            if not kept_memories:
+                # 第一条记忆连同标题、提示和消息本身的开销一起计算
+                cost += estimate_tokens(MEMORY_HEADER + MEMORY_HINT) + MESSAGE_OVERHEAD_TOKENS
+            if cost > memory_budget:
+                self._stats["memories_dropped"] += 1
+                continue
+            kept_memories.append(memory)
+            memory_budget -= cost
+            remaining -= cost
+        
+        # 3. 更早的对话：从新到旧，放不下的压缩成提要
+        older = turns[:-1]
+        dropped: List[Tuple[str, str]] = []
+        for turn in reversed(older):
+            cost = self._turn_tokens(turn)
+            if not dropped and cost <= remaining:
+                kept_turns.append(turn)
+                remaining -= cost
+            else:
+                dropped.append(turn)
+        kept_turns.reverse()
+        
+        context = self._context_message(kept_memories, list(reversed(dropped)), remaining)
+        
+        messages = [self.persona_message]
+        for turn_user, turn_ai in kept_turns:
+            messages.append({"role": "user", "content": turn_user})
+            messages.append({"role": "assistant", "content": turn_ai})
+        if context is not None:
+            messages.append(context)
+        messages.append(user_message)
+        
+        self._record(messages, dropped)
+        return messages
+    
+    def _clip_turn(self, turn: Dict[str, Any]) -> Tuple[str, str]:
+        return self._clip(turn["user_text"]), self._clip(turn["ai_text"])
+    
+    def _clip(self, text: str) -> str:
+        clipped = truncate_to_tokens(text, self.item_max_tokens)
+        if clipped != text:
+            self._stats["items_truncated"] += 1
+        return clipped
+    
+    def _turn_tokens(self, turn: Tuple[str, str]) -> int:
+        return sum(estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS for text in turn)
+    
+    def _message_tokens(self, message: Dict[str, str]) -> int:
+        return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+    
+    def _dedupe_memories(self, memories: list, included_texts: List[str]) -> List[str]:
+        unique: List[str] = []
+        for memory in memories or []:
+            said = _memory_user_text(memory)
+            if any(
+                similarity(said, text) >= self.dedup_threshold
+                for text in included_texts + [_memory_user_text(m) for m in unique]
+            ):
+                self._stats["memories_deduplicated"] += 1
+                continue
+            unique.append(self._clip(memory))
+        return unique
+    
+    def _context_message(
+        self,
+        memories: List[str],
+        dropped_turns: List[Tuple[str, str]],
+        remaining: int
+    ) -> Optional[Dict[str, str]]:
+        parts = []
+        if memories:
+            memory_text = "\n".join(f"  - {memory}" for memory in memories)
+            parts.append(MEMORY_HEADER + memory_text + MEMORY_HINT)
+        
+        if dropped_turns:
+            # 更早的对话只保留老人说过的话的开头，放得下几句算几句
+            budget = remaining - estimate_tokens(EARLIER_HEADER) - (1 if parts else MESSAGE_OVERHEAD_TOKENS)
+            lines = []
+            for turn_user, _ in dropped_turns:
+                line = f"  - 老人说: {truncate_to_tokens(turn_user, 30)}"
+                cost = estimate_tokens(line) + 1
+                if cost > budget:
+                    break
+                lines.append(line)
+                budget -= cost
+            if lines:
+                parts.append(EARLIER_HEADER + "\n".join(lines))
+        
+        if not parts:
+            return None
+        return {"role": "system", "content": "\n\n".join(parts)}
+    
+    def _record(self, messages: List[Dict[str, str]], dropped: list):
+        tokens = sum(self._message_tokens(message) for message in messages)
+        self._stats["builds"] += 1
+        self._stats["prompt_tokens"] += tokens
+        self._stats["max_prompt_tokens"] = max(self._stats["max_prompt_tokens"], tokens)
+        self._stats["turns_dropped"] += len(dropped)
+    
+    def stats(self) -> Dict[str, Any]:
+        builds = self._stats["builds"]
+        return {
+            **self._stats,
+            "budget": self.budget,
+            "persona_tokens": self.persona_tokens,
+            "avg_prompt_tokens": round(self._stats["prompt_tokens"] / builds, 1) if builds else None,
+        }
+
+
+# 全局实例
+prompt_builder = PromptBuilder()
@@ -0,0 +1,333 @@
+"""
+AI服务商接口 - 语音识别（STT）、对话模型（LLM）、语音合成（TTS）可插拔
+
+每类服务定义一个接口，具体服务商按名称注册，通过环境变量选择（真实服务商未配置API Key时启动即报错）：
+- STT_PROVIDER：siliconflow（TeleAI/TeleSpeechASR）、fake
+- LLM_PROVIDER：siliconflow（Qwen）、gemini、fake
+- BIOGRAPHY_LLM_PROVIDER：人生纪要使用的对话模型，gemini（Gemini 1.5 Pro）、siliconflow、fake
+- TTS_PROVIDER：elevenlabs、fake
+
+fake 为本地模拟服务（见 fake_providers.py），可模拟延迟分布、流式输出、错误率和限流，
+用于离线压测整条 /api/chat 流水线；只在显式设置为 fake 时使用，模拟的对话不能混进老人的真实记录
+"""
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from http_pool import UpstreamPool
+
+
+class ProviderError(Exception):
+    """服务商返回错误（非200、限流等）；status_code 为HTTP状态码"""
+    
+    def __init__(self, provider: str, status_code: int, message: str = ""):
+        super().__init__(f"{provider} [{status_code}]: {message}")
+        self.provider = provider
+        self.status_code = status_code
+
+
+class STTProvider(ABC):
+    """语音识别：音频文件 → 文本；api_key_env 为必须配置的API Key环境变量（本地服务为空）"""
+    
+    name = "stt"
+    api_key_env = ""
+    
+    @abstractmethod
+    async def transcribe(self, audio: bytes, filename: str, content_type: str) -> str:
+        ...
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"provider": self.name}
+
+
+class LLMProvider(ABC):
+    """对话模型：OpenAI格式的 messages → 回复文本（整段或流式增量）"""
+    
+    name = "llm"
+    api_key_env = ""
+    
+    @abstractmethod
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 150,
+        timeout: Optional[float] = None,
+        **options
+    ) -> str:
+        ...
+    
+    @abstractmethod
+    def stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 150,
+        **options
+    ) -> AsyncIterator[str]:
+        ...
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"provider": self.name}
+
+
+class TTSProvider(ABC):
+    """语音合成：一句话 → MP3音频；model_id 参与语音缓存键，不同服务商的音频不会混用"""
+    
+    name = "tts"
+    model_id = ""
+    api_key_env = ""
+    
+    @abstractmethod
+    async def synthesize(self, text: str, voice_id: str, voice_settings: Dict[str, Any]) -> bytes:
+        ...
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"provider": self.name}
+
+
+# 已注册的服务商：类别 -> 名称 -> 工厂函数(上游连接池字典)
+PROVIDERS: Dict[str, Dict[str, Callable[[Dict[str, UpstreamPool]], Any]]] = {
+    "stt": {},
+    "llm": {},
+    "tts": {},
+}
+
+
+def register_provider(kind: str, name: str):
+    """类装饰器：把服务商注册到 PROVIDERS[kind][name]"""
+    def decorator(cls):
+        cls.name = name
+        PROVIDERS[kind][name] = cls
+        return cls
+    return decorator
+
+
+def create_provider(kind: str, name: str, pools: Dict[str, UpstreamPool]):
+    if name not in PROVIDERS[kind]:
+        raise ValueError(f"未知的{kind.upper()}服务商: {name}（可选: {', '.join(PROVIDERS[kind])}）")
+    cls = PROVIDERS[kind][name]
+    if cls.api_key_env and not os.getenv(cls.api_key_env):
+        raise ValueError(
+            f"{kind.upper()}服务商 {name} 需要配置 {cls.api_key_env}"
+            f"（离线压测请显式设置 {kind.upper()}_PROVIDER=fake）"
+        )
+    return cls(pools)
+
+
+# ============================================
+# 真实服务商
+# ============================================
+
+@register_provider("stt", "siliconflow")
+class SiliconFlowSTT(STTProvider):
+    """硅基流动语音识别 - TeleAI/TeleSpeechASR（/v1/audio/transcriptions）"""
+    
+    MODEL = "TeleAI/TeleSpeechASR"
+    api_key_env = "SILICONFLOW_API_KEY"
+    
+    def __init__(self, pools: Dict[str, UpstreamPool]):
+        self.pool = pools["siliconflow"]
+        self.api_key = os.getenv("SILICONFLOW_API_KEY", "")
+    
+    async def transcribe(self, audio: bytes, filename: str, content_type: str) -> str:
+        response = await self.pool.client.post(
+            "/v1/audio/transcriptions",
+            files={"file": (filename, audio, content_type)},
+            data={"model": self.MODEL},
+            headers={"Authorization": f"Bearer {self.api_key}"}
+        )
+        if response.status_code != 200:
+            raise ProviderError(self.name, response.status_code, response.text)
+        return response.json().get("text", "").strip()
+
+
+@register_provider("llm", "siliconflow")
+class SiliconFlowLLM(LLMProvider):
+    """硅基流动对话模型 - Qwen（OpenAI兼容的 /v1/chat/completions）"""
+    
+    MODEL = "Qwen/Qwen2.5-7B-Instruct"
+    api_key_env = "SILICONFLOW_API_KEY"
+    
+    def __init__(self, pools: Dict[str, UpstreamPool]):
+        self.pool = pools["siliconflow"]
+        self.api_key = os.getenv("SILICONFLOW_API_KEY", "")
+    
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 150,
+        timeout: Optional[float] = None,
+        **options
+    ) -> str:
+        kwargs = {"timeout": timeout} if timeout else {}
+        response = await self.pool.client.post(
+            "/v1/chat/completions",
+            headers=self._headers(),
+            json={
+                "model": self.MODEL,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                **options
+            },
+            **kwargs
+        )
+        if response.status_code != 200:
+            raise ProviderError(self.name, response.status_code, response.text)
+        return response.json()["choices"][0]["message"]["content"].strip()
+    
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 150,
+        **options
+    ) -> AsyncIterator[str]:
+        async with self.pool.client.stream(
+            "POST",
+            "/v1/chat/completions",
+            headers=self._headers(),
+            json={
+                "model": self.MODEL,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True,
+                **options
+            }
+        ) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                raise ProviderError(self.name, response.status_code, body.decode(errors="ignore"))
+            
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                
+                chunk = json.loads(payload)
+                choices = chunk.get("choices") or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if delta:
+                    yield delta
+
+
+@register_provider("llm", "gemini")
+class GeminiLLM(LLMProvider):
+    """Google Gemini（/v1beta/models/{model}:generateContent）；system 消息转为 systemInstruction"""
+    
+    MODEL = "gemini-1.5-pro"
+    api_key_env = "GEMINI_API_KEY"
+    
+    def __init__(self, pools: Dict[str, UpstreamPool]):
+        self.pool = pools["gemini"]
+        self.api_key = os.getenv("GEMINI_API_KEY", "")
+    
+    def _body(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int, **options) -> Dict[str, Any]:
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        body: Dict[str, Any] = {
+            "contents": [
+                {"role": "model" if m["role"] == "assistant" else "user", "parts": [{"text": m["content"]}]}
+                for m in messages if m["role"] != "system"
+            ],
+            "generationConfig": {
+                "temperature": temperature,
+                "maxOutputTokens": max_tokens,
+                **options
+            }
+        }
+        if system:
+            body["systemInstruction"] = {"parts": [{"text": system}]}
+        return body
+    
+    @staticmethod
+    def _text(data: Dict[str, Any]) -> str:
+        candidates = data.get("candidates") or []
+        if not candidates:
+            return ""
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        return "".join(part.get("text", "") for part in parts)
+    
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 150,
+        timeout: Optional[float] = None,
+        **options
+    ) -> str:
+        kwargs = {"timeout": timeout} if timeout else {}
+        response = await self.pool.client.post(
+            f"/v1beta/models/{self.MODEL}:generateContent",
+            params={"key": self.api_key},
+            json=self._body(messages, temperature, max_tokens, **options),
+            **kwargs
+        )
+        if response.status_code != 200:
+            raise ProviderError(self.name, response.status_code, response.text)
+        return self._text(response.json()).strip()
+    
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 150,
+        **options
+    ) -> AsyncIterator[str]:
+        async with self.pool.client.stream(
+            "POST",
+            f"/v1beta/models/{self.MODEL}:streamGenerateContent",
+            params={"key": self.api_key, "alt": "sse"},
+            json=self._body(messages, temperature, max_tokens, **options)
+        ) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                raise ProviderError(self.name, response.status_code, body.decode(errors="ignore"))
+            
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                delta = self._text(json.loads(line[len("data:"):].strip()))
+                if delta:
+                    yield delta
+
+
+@register_provider("tts", "elevenlabs")
+class ElevenLabsTTS(TTSProvider):
+    """ElevenLabs语音合成（/v1/text-to-speech/{voice_id}）"""
+    
+    model_id = "eleven_multilingual_v2"
+    api_key_env = "ELEVENLABS_API_KEY"
+    
+    def __init__(self, pools: Dict[str, UpstreamPool]):
+        self.pool = pools["elevenlabs"]
+        self.api_key = os.getenv("ELEVENLABS_API_KEY", "")
+    
+    async def synthesize(self, text: str, voice_id: str, voice_settings: Dict[str, Any]) -> bytes:
+        response = await self.pool.client.post(
+            f"/v1/text-to-speech/{voice_id}",
+            headers={
+                "Accept": "audio/mpeg",
+                "xi-api-key": self.api_key,
+                "Content-Type": "application/json"
+            },
+            json={
+                "text": text,
+                "model_id": self.model_id,
+                "voice_settings": voice_settings
+            }
+        )
+        if response.status_code != 200:
+            raise ProviderError(self.name, response.status_code, response.text)
+        return response.content
@@ -0,0 +1,408 @@
+"""
+上游调用的容错与尾延迟控制 - 熔断、重试预算、对冲请求、分阶段超时
+
+老人感受到的"卡住"来自慢的那几次调用（尾延迟），而不是平均延迟。每个上游（类别+服务商，
+例如 stt:siliconflow）各自维护：
+- 熔断器：连续失败 RESILIENCE_BREAKER_FAILURES 次后熔断 RESILIENCE_BREAKER_OPEN_SECONDS 秒，
+  期间直接失败（走兜底话术），不再让每次调用都等到超时；之后放行一次试探，成功则恢复
+- 重试预算：只重试可恢复的错误（超时、网络错误、429、5xx），指数退避加随机抖动；
+  重试（含对冲）总数不超过请求数的 RESILIENCE_RETRY_RATIO，上游整体故障时不会被重试放大流量
+  （超时会用完本阶段的时间，慢请求靠对冲处理，重试针对的是很快就返回的错误）
+- 对冲请求：调用超过该上游最近的 p95 耗时仍未返回时，再发一个相同的请求，先返回的为准
+- 分阶段超时：每轮对话有总预算 RESILIENCE_TURN_BUDGET_SECONDS，按比例分给 STT / LLM / TTS，
+  且不超过本轮剩余时间（start_turn 开始计时、end_turn 结束；不在对话中的调用只受阶段上限约束）；
+  预算按一句普通长度的话估算，STT 另按音频时长追加时间（一句话最长可达30秒）
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar, Token
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+
+from providers import ProviderError
+from metrics import record_hedge, record_retry, set_circuit_open
+
+
+T = TypeVar("T")
+
+# 每轮对话的总时间预算（秒），以及各阶段所占比例
+RESILIENCE_TURN_BUDGET_SECONDS = float(os.getenv("RESILIENCE_TURN_BUDGET_SECONDS", "15"))
+RESILIENCE_STAGE_SHARES = {
+    kind: float(share)
+    for kind, share in (
+        item.split(":") for item in os.getenv("RESILIENCE_STAGE_SHARES", "stt:0.25,llm:0.5,tts:0.25").split(",")
+    )
+}
+# 本轮剩余时间不足时，每个阶段至少保留的时间（秒），保证后面的阶段仍有一次尝试的机会
+RESILIENCE_MIN_STAGE_SECONDS = float(os.getenv("RESILIENCE_MIN_STAGE_SECONDS", "1.0"))
+# 每秒音频给STT追加的时间（秒），同时延后本轮截止时间
+RESILIENCE_STT_SECONDS_PER_AUDIO_SECOND = float(os.getenv("RESILIENCE_STT_SECONDS_PER_AUDIO_SECOND", "0.25"))
+
+# 每次调用最多尝试几次（含第一次），退避的基数和上限（秒）
+RESILIENCE_MAX_ATTEMPTS = int(os.getenv("RESILIENCE_MAX_ATTEMPTS", "2"))
+RESILIENCE_BACKOFF_BASE = float(os.getenv("RESILIENCE_BACKOFF_BASE", "0.1"))
+RESILIENCE_BACKOFF_MAX = float(os.getenv("RESILIENCE_BACKOFF_MAX", "1.0"))
+# 重试预算：重试+对冲数不超过最近 RESILIENCE_RETRY_WINDOW 秒内请求数的这个比例（另有每秒1次的保底）
+RESILIENCE_RETRY_RATIO = float(os.getenv("RESILIENCE_RETRY_RATIO", "0.2"))
+RESILIENCE_RETRY_WINDOW = float(os.getenv("RESILIENCE_RETRY_WINDOW", "10"))
+
+# 熔断：连续失败多少次后熔断，熔断多久（秒）
+RESILIENCE_BREAKER_FAILURES = int(os.getenv("RESILIENCE_BREAKER_FAILURES", "5"))
+RESILIENCE_BREAKER_OPEN_SECONDS = float(os.getenv("RESILIENCE_BREAKER_OPEN_SECONDS", "20"))
+
+# 对冲：哪些类别启用（LLM按token计费且有限流，默认不对冲），至少积累多少个耗时样本后才启用
+RESILIENCE_HEDGE_KINDS = [k for k in os.getenv("RESILIENCE_HEDGE_KINDS", "stt,tts").split(",") if k]
+RESILIENCE_HEDGE_MIN_SAMPLES = int(os.getenv("RESILIENCE_HEDGE_MIN_SAMPLES", "20"))
+RESILIENCE_LATENCY_WINDOW = int(os.getenv("RESILIENCE_LATENCY_WINDOW", "200"))
+
+
+# 本轮对话的截止时间（time.monotonic()），由 start_turn 设置；后台任务中为 None
+_turn_deadline: ContextVar[Optional[float]] = ContextVar("turn_deadline", default=None)
+
+
+def start_turn(budget: float = RESILIENCE_TURN_BUDGET_SECONDS) -> Token:
+    """
+    开始一轮对话的计时（在请求处理协程中调用，之后创建的任务继承同一截止时间）
+    
+    返回的 token 交给 end_turn；一个连接处理多轮对话时（/ws/call），每轮结束必须调用 end_turn，
+    否则之后创建的后台任务（如中间识别）会继承已过期的截止时间
+    """
+    return _turn_deadline.set(time.monotonic() + budget)
+
+
+def end_turn(token: Token):
+    """结束一轮对话的计时，恢复 start_turn 之前的截止时间"""
+    _turn_deadline.reset(token)
+
+
+def extend_turn(seconds: float):
+    """本轮对话的截止时间延后（例如长语音的识别）；不在对话中时不做任何事，end_turn 照常恢复"""
+    deadline = _turn_deadline.get()
+    if deadline is not None and seconds > 0:
+        _turn_deadline.set(deadline + seconds)
+
+
+def stage_timeout(kind: str, extra_seconds: float = 0.0) -> float:
+    """
+    某个阶段的超时：预算中该阶段的份额加上 extra_seconds，且不超过本轮剩余时间（但不少于保底时间）
+    """
+    cap = RESILIENCE_TURN_BUDGET_SECONDS * RESILIENCE_STAGE_SHARES.get(kind, 1.0) + extra_seconds
+    deadline = _turn_deadline.get()
+    if deadline is None:
+        return cap
+    return max(RESILIENCE_MIN_STAGE_SECONDS, min(cap, deadline - time.monotonic()))
+
+
+class CircuitOpenError(ProviderError):
+    """上游处于熔断状态，本次没有发出请求"""
+    
+    def __init__(self, provider: str):
+        super().__init__(provider, 503, "熔断中，暂不调用")
+
+
+def is_retryable(error: BaseException) -> bool:
+    """超时、网络错误、限流和服务端错误可以重试；熔断、参数错误、鉴权失败等不重试"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, ProviderError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """连续失败计数的熔断器：closed → open（熔断）→ half_open（放行一次试探）"""
+    
+    def __init__(self, key: str, failures: int = RESILIENCE_BREAKER_FAILURES, open_seconds: float = RESILIENCE_BREAKER_OPEN_SECONDS):
+        self.key = key
+        self.failure_threshold = failures
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.opens = 0
+        self.rejected = 0
+    
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = "half_open"
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+    
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._probing = False
+        if self.state != "closed":
+            print(f"✅ 上游恢复，关闭熔断: {self.key}")
+            self.state = "closed"
+            set_circuit_open(self.key, False)
+    
+    def release_probe(self):
+        """试探请求被取消（不能说明上游是否恢复）：保持半开，下一次调用重新试探"""
+        self._probing = False
+    
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.state == "half_open" or (
+            self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+        ):
+            print(f"🔌 上游连续失败 {self.consecutive_failures} 次，熔断 {self.open_seconds:.0f}s: {self.key}")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.opens += 1
+            set_circuit_open(self.key, True)
+
+
+class RetryBudget:
+    """重试预算：滑动窗口内 重试数 ≤ max(每秒1次保底, 请求数 × ratio)"""
+    
+    def __init__(self, ratio: float = RESILIENCE_RETRY_RATIO, window: float = RESILIENCE_RETRY_WINDOW):
+        self.ratio = ratio
+        self.window = window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+    
+    def _trim(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and events[0] < now - self.window:
+                events.popleft()
+    
+    def record_request(self):
+        self._requests.append(time.monotonic())
+    
+    def try_spend(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= max(self.window, len(self._requests) * self.ratio):
+            return False
+        self._retries.append(now)
+        return True
+
+
+class LatencyTracker:
+    """最近若干次成功调用的耗时，用于计算对冲的触发时间（p95）"""
+    
+    def __init__(self, window: int = RESILIENCE_LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=window)
+    
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+    
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._samples) < RESILIENCE_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Upstream:
+    """单个上游（类别+服务商）的熔断器、重试预算和耗时统计"""
+    
+    def __init__(self, kind: str, provider: str):
+        self.kind = kind
+        self.provider = provider
+        self.key = f"{kind}:{provider}"
+        self.breaker = CircuitBreaker(self.key)
+        self.budget = RetryBudget()
+        self.latency = LatencyTracker()
+        self.hedge = kind in RESILIENCE_HEDGE_KINDS
+        self._stats = {"calls": 0, "failures": 0, "timeouts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0}
+    
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.latency.percentile(0.95)
+        return {
+            **self._stats,
+            "state": self.breaker.state,
+            "opens": self.breaker.opens,
+            "rejected": self.breaker.rejected,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class Resilience:
+    """按上游包装STT、LLM、TTS调用（见 ai_services.py）"""
+    
+    def __init__(self, max_attempts: int = RESILIENCE_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self._upstreams: Dict[str, Upstream] = {}
+    
+    def upstream(self, kind: str, provider: str) -> Upstream:
+        key = f"{kind}:{provider}"
+        if key not in self._upstreams:
+            self._upstreams[key] = Upstream(kind, provider)
+        return self._upstreams[key]
+    
+    async def call(
+        self, kind: str, provider: str, request: Callable[[], Awaitable[T]], extra_seconds: float = 0.0
+    ) -> T:
+        """
+        调用上游：熔断检查 → 发出请求（超过p95未返回时对冲）→ 可恢复的错误在阶段超时内退避重试
+        
+        request 每次调用发出一个新请求；最终失败时抛出最后一个异常（超时为 504 的 ProviderError）。
+        extra_seconds 是这次调用在阶段份额之外需要的时间（如长语音的识别），本轮截止时间一并延后
+        """
+        upstream = self.upstream(kind, provider)
+        extend_turn(extra_seconds)
+        deadline = time.monotonic() + stage_timeout(kind, extra_seconds)
+        upstream._stats["calls"] += 1
+        upstream.budget.record_request()
+        
+        attempt = 1
+        while True:
+            if not upstream.breaker.allow():
+                raise CircuitOpenError(provider)
+            probing = upstream.breaker.state == "half_open"
+            try:
+                return await self._attempt(upstream, request, deadline)
+            except Exception as e:
+                delay = self._retry_delay(upstream, e, attempt, deadline)
+                if delay is None:
+                    raise
+            except BaseException:
+                # 被取消（如客户端断开）：没有结果，放还试探机会，避免熔断器一直停在半开
+                if probing:
+                    upstream.breaker.release_probe()
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    async def stream(self, kind: str, provider: str, request: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        流式调用：首个增量在阶段超时内返回才算成功，此前失败可以重试；
+        开始产出之后不再重试（已下发的内容无法撤回）
+        """
+        upstream = self.upstream(kind, provider)
+        deadline = time.monotonic() + stage_timeout(kind)
+        upstream._stats["calls"] += 1
+        upstream.budget.record_request()
+        
+        attempt = 1
+        while True:
+            if not upstream.breaker.allow():
+                raise CircuitOpenError(provider)
+            probing = upstream.breaker.state == "half_open"
+            started = time.monotonic()
+            deltas = request()
+            try:
+                first = await asyncio.wait_for(deltas.__anext__(), deadline - started)
+                break
+            except StopAsyncIteration:
+                upstream.breaker.record_success()
+                return
+            except Exception as e:
+                await deltas.aclose()
+                error = self._timeout_error(upstream, e)
+                self._record_failure(upstream, error)
+                delay = self._retry_delay(upstream, error, attempt, deadline)
+                if delay is None:
+                    raise error
+            except BaseException:
+                if probing:
+                    upstream.breaker.release_probe()
+                await deltas.aclose()
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+        
+        upstream.latency.record(time.monotonic() - started)
+        upstream.breaker.record_success()
+        yield first
+        try:
+            async for delta in deltas:
+                yield delta
+        finally:
+            await deltas.aclose()
+    
+    async def _attempt(self, upstream: Upstream, request: Callable[[], Awaitable[T]], deadline: float) -> T:
+        """发出一次请求，超过 p95 仍未返回时对冲；返回最先成功的结果"""
+        started: Dict[asyncio.Future, float] = {}
+        
+        def launch() -> asyncio.Future:
+            task = asyncio.ensure_future(request())
+            started[task] = time.monotonic()
+            return task
+        
+        first = launch()
+        pending = {first}
+        error: Optional[BaseException] = None
+        try:
+            hedge_delay = upstream.latency.percentile(0.95) if upstream.hedge else None
+            if hedge_delay is not None and time.monotonic() + hedge_delay < deadline:
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+                if not done and upstream.breaker.state == "closed" and upstream.budget.try_spend():
+                    upstream._stats["hedges"] += 1
+                    record_hedge(upstream.kind, upstream.provider)
+                    pending.add(launch())
+            
+            while pending:
+                remaining = deadline - time.monotonic()
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    error = self._timeout_error(upstream, asyncio.TimeoutError())
+                    self._record_failure(upstream, error)
+                    raise error
+                for task in done:
+                    if task.exception() is None:
+                        upstream.latency.record(time.monotonic() - started[task])
+                        upstream.breaker.record_success()
+                        if task is not first:
+                            upstream._stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+                    self._record_failure(upstream, error)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def _retry_delay(self, upstream: Upstream, error: BaseException, attempt: int, deadline: float) -> Optional[float]:
+        """
+        可恢复的错误、未达到次数上限、阶段剩余时间和重试预算都允许时，返回退避时间；否则返回 None
+        
+        退避使用完全随机抖动（full jitter），避免大量请求同时重试
+        """
+        if not is_retryable(error) or attempt >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(RESILIENCE_BACKOFF_MAX, RESILIENCE_BACKOFF_BASE * 2 ** (attempt - 1)))
+        if time.monotonic() + delay >= deadline or not upstream.budget.try_spend():
+            return None
+        upstream._stats["retries"] += 1
+        record_retry(upstream.kind, upstream.provider)
+        print(f"🔁 重试 {upstream.key}（第{attempt + 1}次）: {error}")
+        return delay
+    
+    @staticmethod
+    def _timeout_error(upstream: Upstream, error: BaseException) -> BaseException:
+        """阶段超时转换为 504 的 ProviderError，与上游返回的错误一样走兜底"""
+        if not isinstance(error, asyncio.TimeoutError):
+            return error
+        upstream._stats["timeouts"] += 1
+        return ProviderError(upstream.provider, 504, f"超过阶段时限未返回（{upstream.kind}）")
+    
+    @staticmethod
+    def _record_failure(upstream: Upstream, error: BaseException):
+        """可恢复的错误计入熔断；其他错误（如参数错误）说明上游仍在正常应答"""
+        upstream._stats["failures"] += 1
+        if is_retryable(error):
+            upstream.breaker.record_failure()
+        else:
+            upstream.breaker.record_success()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {key: upstream.stats() for key, upstream in self._upstreams.items()}
+
+
+# 全局实例
+resilience = Resilience()
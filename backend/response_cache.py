@@ -0,0 +1,158 @@
+"""
+语义回复缓存（可选）- 老人反复说的寒暄（"今天天气真好"）直接复用之前的回复
+
+按老人隔离；查找时对老人这句话做向量化，在该老人近期（SEMANTIC_CACHE_TTL 内）的缓存中找相似度超过阈值的条目。
+同一句话积累了多条回复时轮换使用，并避开上一轮刚说过的那句，避免小雅"复读"。
+只缓存短句寒暄，较长、信息量大的话总是交给LLM
+
+缓存键不包含检索到的记忆：每轮对话都会写入记忆，检索结果几乎每轮都不同，按记忆区分会让缓存永远无法命中；
+寒暄的回复与记忆关系不大，由相似度阈值和TTL限制复用范围
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from ai_services import ai_services
+from embeddings import embedding_function
+
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+# 超过这个字数的话不走缓存
+SEMANTIC_CACHE_MAX_CHARS = int(os.getenv("SEMANTIC_CACHE_MAX_CHARS", "20"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "200"))
+
+
+class ResponseCache:
+    """按老人隔离的语义缓存：老人这句话的向量 -> 回复"""
+    
+    def __init__(
+        self,
+        enabled: bool = SEMANTIC_CACHE_ENABLED,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: int = SEMANTIC_CACHE_TTL,
+        max_chars: int = SEMANTIC_CACHE_MAX_CHARS,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+    ):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self.max_entries = max_entries
+        
+        # session_id -> [{"vector", "user_text", "reply", "created_at"}]
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "skipped": 0, "expired": 0}
+    
+    def _cacheable(self, user_text: str) -> bool:
+        return self.enabled and 0 < len(user_text.strip()) <= self.max_chars
+    
+    async def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray((await run_in_threadpool(embedding_function, [text]))[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    async def lookup(
+        self,
+        session_id: str,
+        user_text: str,
+        conversation_history: list
+    ) -> Optional[str]:
+        """查找可复用的回复，没有时返回 None"""
+        if not self._cacheable(user_text):
+            self._stats["skipped"] += 1
+            return None
+        
+        entries = self._live_entries(session_id)
+        if not entries:
+            self._stats["misses"] += 1
+            return None
+        
+        vector = await self._embed(user_text)
+        scores = np.stack([entry["vector"] for entry in entries]) @ vector
+        
+        # 上一轮刚说过的回复不再重复
+        last_reply = conversation_history[-1]["ai_text"] if conversation_history else None
+        matches = [
+            (score, entry) for score, entry in zip(scores, entries)
+            if score >= self.threshold and entry["reply"] != last_reply
+        ]
+        if not matches:
+            self._stats["misses"] += 1
+            return None
+        
+        # 多条相近的回复中选最久没用过的，让同样的寒暄有不同的回答
+        _, entry = min(matches, key=lambda item: item[1].get("used_at", 0))
+        entry["used_at"] = time.time()
+        self._stats["hits"] += 1
+        return entry["reply"]
+    
+    async def store(
+        self,
+        session_id: str,
+        user_text: str,
+        reply: str
+    ):
+        """记录一条LLM生成的回复（兜底话术不缓存）"""
+        if not reply or reply in ai_services.FALLBACK_REPLIES or not self._cacheable(user_text):
+            return
+        
+        if any(e["reply"] == reply for e in self._live_entries(session_id)):
+            return
+        vector = await self._embed(user_text)
+        
+        # 计算向量期间该老人的条目可能已过期被清理：重新取列表
+        if session_id not in self._entries:
+            self._sweep()
+        entries = self._entries.setdefault(session_id, [])
+        if any(e["reply"] == reply for e in entries):
+            return
+        entries.append({
+            "vector": vector,
+            "user_text": user_text,
+            "reply": reply,
+            "created_at": time.time(),
+        })
+        if len(entries) > self.max_entries:
+            del entries[:len(entries) - self.max_entries]
+        self._stats["stores"] += 1
+    
+    def _live_entries(self, session_id: str) -> List[Dict[str, Any]]:
+        """该老人未过期的缓存条目（顺带清理过期条目，全部过期时删除该老人的键）"""
+        entries = self._entries.get(session_id)
+        if entries is None:
+            return []
+        cutoff = time.time() - self.ttl
+        live = [entry for entry in entries if entry["created_at"] >= cutoff]
+        if len(live) != len(entries):
+            self._stats["expired"] += len(entries) - len(live)
+            entries[:] = live
+        if not entries:
+            del self._entries[session_id]
+        return entries
+    
+    def _sweep(self):
+        """删除所有条目都已过期的老人（新增老人时执行，不再访问的老人也不会一直占着内存）"""
+        cutoff = time.time() - self.ttl
+        for session_id, entries in list(self._entries.items()):
+            if all(entry["created_at"] < cutoff for entry in entries):
+                self._stats["expired"] += len(entries)
+                del self._entries[session_id]
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "sessions": len(self._entries),
+            "entries": sum(len(entries) for entries in self._entries.values()),
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+        }
+
+
+# 全局实例
+response_cache = ResponseCache()
@@ -0,0 +1,324 @@
+"""
+记忆检索 - 关键词 + 向量的混合检索
+
+1. 向量检索（ChromaDB）和关键词检索（本地BM25索引，按中文字符二元组切词）各取一批候选
+2. 按排名做倒数排名融合（RRF），两路都靠前的记忆得分最高
+3. 两路都不够相关的候选直接丢弃（相似度阈值），宁缺毋滥
+4. 对话记忆按时间衰减：同样相关时，最近聊过的优先；洞见不衰减
+5. 用MMR挑选最终结果，避免几条内容几乎相同的记忆同时进入prompt
+
+关键词索引按老人建在内存中：第一次检索时从ChromaDB加载，之后随向量库写入同步更新
+"""
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import DEFAULT_SESSION_ID
+from vector_store import vector_store
+from prompt_builder import similarity
+
+
+# 每一路检索取多少个候选
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+# RRF常数：越大，排名靠后的候选与靠前的差距越小
+RETRIEVAL_RRF_K = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+# 相关性阈值：向量余弦相似度、关键词匹配度（0~1）都低于阈值的候选丢弃
+RETRIEVAL_MIN_SIMILARITY = float(os.getenv("RETRIEVAL_MIN_SIMILARITY", "0.35"))
+RETRIEVAL_MIN_LEXICAL = float(os.getenv("RETRIEVAL_MIN_LEXICAL", "0.2"))
+# 时间衰减：半衰期（天），以及衰减在得分中所占的比重（0为不考虑时间）
+RETRIEVAL_HALF_LIFE_DAYS = float(os.getenv("RETRIEVAL_HALF_LIFE_DAYS", "30"))
+RETRIEVAL_RECENCY_WEIGHT = float(os.getenv("RETRIEVAL_RECENCY_WEIGHT", "0.3"))
+# MMR：越接近1越看重相关性，越接近0越看重多样性
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.7"))
+# 与已选结果的相似度（字符二元组Jaccard）超过该值的候选视为重复，直接跳过
+RETRIEVAL_DUPLICATE_THRESHOLD = float(os.getenv("RETRIEVAL_DUPLICATE_THRESHOLD", "0.8"))
+# 内存中最多保留多少个老人的关键词索引（LRU）
+RETRIEVAL_INDEX_SESSIONS = int(os.getenv("RETRIEVAL_INDEX_SESSIONS", "200"))
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def char_bigrams(text: str) -> List[str]:
+    """按标点、空白断开后切成字符二元组（中文不需要分词词典）；单字片段保留为一元"""
+    terms = []
+    for piece in _NON_WORD.split(text.lower()):
+        if len(piece) == 1:
+            terms.append(piece)
+        terms.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+    return terms
+
+
+def _index_text(document: str, metadata: Dict[str, Any]) -> str:
+    # 对话记忆只索引老人说的话：AI的回复大多是通用的追问，会稀释关键词
+    if metadata.get("type") == "conversation" and metadata.get("user_text"):
+        return metadata["user_text"]
+    return document
+
+
+class BM25Index:
+    """一个老人的关键词倒排索引（BM25），支持按ID覆盖写入"""
+    
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.total_length = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+    
+    def upsert(self, doc_id: str, document: str, metadata: Dict[str, Any]):
+        terms = Counter(char_bigrams(_index_text(document, metadata)))
+        with self.lock:
+            self._remove(doc_id)
+            length = sum(terms.values())
+            self.docs[doc_id] = {"document": document, "metadata": metadata, "length": length}
+            self.total_length += length
+            for term, tf in terms.items():
+                self.postings[term][doc_id] = tf
+    
+    def remove(self, doc_id: str):
+        with self.lock:
+            self._remove(doc_id)
+    
+    def _remove(self, doc_id: str):
+        old = self.docs.pop(doc_id, None)
+        if old is None:
+            return
+        self.total_length -= old["length"]
+        for term in set(char_bigrams(_index_text(old["document"], old["metadata"]))):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+    
+    def search(self, query: str, n: int) -> List[Tuple[str, float]]:
+        """
+        返回 [(doc_id, 匹配度)]，匹配度为BM25得分除以"命中全部查询词各一次"的得分（0~1），
+        约等于按idf加权的查询词命中比例；索引中没有的查询词按只出现过一次计算
+        
+        只遍历查询词的倒排表，成本与记忆总数无关
+        """
+        terms = set(char_bigrams(query))
+        with self.lock:
+            total = len(self.docs)
+            if not terms or not total:
+                return []
+            avg_length = self.total_length / total or 1
+            
+            scores: Dict[str, float] = defaultdict(float)
+            best_possible = 0.0
+            for term in terms:
+                postings = self.postings.get(term, {})
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                best_possible += min(idf, math.log(1 + (total - 0.5) / 1.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.docs[doc_id]["length"] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        
+        top = heapq.nlargest(n, scores.items(), key=lambda item: item[1])
+        return [(doc_id, min(score / best_possible, 1.0)) for doc_id, score in top]
+    
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return self.docs.get(doc_id)
+
+
+class MemoryRetriever:
+    """混合检索：向量 + BM25 → RRF融合 → 阈值过滤 → 时间衰减 → MMR"""
+    
+    def __init__(
+        self,
+        candidates: int = RETRIEVAL_CANDIDATES,
+        rrf_k: int = RETRIEVAL_RRF_K,
+        min_similarity: float = RETRIEVAL_MIN_SIMILARITY,
+        min_lexical: float = RETRIEVAL_MIN_LEXICAL,
+        half_life_days: float = RETRIEVAL_HALF_LIFE_DAYS,
+        recency_weight: float = RETRIEVAL_RECENCY_WEIGHT,
+        mmr_lambda: float = RETRIEVAL_MMR_LAMBDA,
+        duplicate_threshold: float = RETRIEVAL_DUPLICATE_THRESHOLD,
+        max_sessions: int = RETRIEVAL_INDEX_SESSIONS
+    ):
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.min_similarity = min_similarity
+        self.min_lexical = min_lexical
+        self.half_life_days = half_life_days
+        self.recency_weight = recency_weight
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.max_sessions = max_sessions
+        
+        self._indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "queries": 0,
+            "vector_candidates": 0,
+            "lexical_candidates": 0,
+            "below_cutoff": 0,
+            "duplicates": 0,
+            "returned": 0,
+            "index_loads": 0,
+            "index_load_ms": 0.0,
+        }
+        
+        # 向量库写入新记忆时同步更新已加载的关键词索引
+        vector_store.add_listener(self._on_add)
+        vector_store.add_remove_listener(self._on_remove)
+    
+    def retrieve(self, query_text: str, n_results: int = 3, session_id: str = DEFAULT_SESSION_ID) -> List[str]:
+        """检索该老人与当前这句话最相关的记忆（最多 n_results 条，可能更少或为空）"""
+        self._stats["queries"] += 1
+        vector_hits = vector_store.query_candidates(query_text, self.candidates, session_id)
+        if not vector_hits:
+            return []
+        index = self._index_for(session_id)
+        lexical_hits = index.search(query_text, self.candidates)
+        self._stats["vector_candidates"] += len(vector_hits)
+        self._stats["lexical_candidates"] += len(lexical_hits)
+        
+        # RRF融合：每一路按排名贡献 1/(k+排名)
+        candidates: Dict[str, Dict[str, Any]] = {}
+        for rank, hit in enumerate(vector_hits, start=1):
+            candidates[hit["id"]] = {
+                "document": hit["document"],
+                "metadata": hit["metadata"],
+                "similarity": hit["similarity"],
+                "lexical": 0.0,
+                "score": 1 / (self.rrf_k + rank),
+            }
+        for rank, (doc_id, lexical) in enumerate(lexical_hits, start=1):
+            candidate = candidates.get(doc_id)
+            if candidate is None:
+                doc = index.get(doc_id)
+                if doc is None:
+                    continue
+                candidate = candidates[doc_id] = {
+                    "document": doc["document"],
+                    "metadata": doc["metadata"],
+                    "similarity": 0.0,
+                    "lexical": 0.0,
+                    "score": 0.0,
+                }
+            candidate["lexical"] = lexical
+            candidate["score"] += 1 / (self.rrf_k + rank)
+        
+        # 相关性阈值 + 时间衰减
+        now = time.time()
+        relevant = []
+        for candidate in candidates.values():
+            if candidate["similarity"] < self.min_similarity and candidate["lexical"] < self.min_lexical:
+                self._stats["below_cutoff"] += 1
+                continue
+            candidate["score"] *= self._recency(candidate["metadata"], now)
+            relevant.append(candidate)
+        
+        selected = self._mmr(relevant, n_results)
+        self._stats["returned"] += len(selected)
+        return [candidate["document"] for candidate in selected]
+    
+    def _recency(self, metadata: Dict[str, Any], now: float) -> float:
+        """时间衰减系数：刚说过的为1，每过一个半衰期衰减部分减半；洞见和没有时间的旧记忆不衰减"""
+        timestamp = metadata.get("timestamp")
+        if metadata.get("type") != "conversation" or not timestamp or self.half_life_days <= 0:
+            return 1.0
+        age_days = max(now - float(timestamp), 0) / 86400
+        decay = 0.5 ** (age_days / self.half_life_days)
+        return 1 - self.recency_weight + self.recency_weight * decay
+    
+    def _mmr(self, candidates: List[Dict[str, Any]], n: int) -> List[Dict[str, Any]]:
+        """最大边际相关性：每次选"相关性高、且与已选结果不重复"的候选"""
+        if not candidates:
+            return []
+        top_score = max(candidate["score"] for candidate in candidates)
+        remaining = sorted(candidates, key=lambda c: c["score"], reverse=True)
+        selected: List[Dict[str, Any]] = []
+        while remaining and len(selected) < n:
+            best, best_value = None, -math.inf
+            for candidate in list(remaining):
+                redundancy = max(
+                    (similarity(candidate["document"], chosen["document"]) for chosen in selected),
+                    default=0.0
+                )
+                if redundancy >= self.duplicate_threshold:
+                    self._stats["duplicates"] += 1
+                    remaining.remove(candidate)
+                    continue
+                value = (
+                    self.mmr_lambda * candidate["score"] / top_score
+                    - (1 - self.mmr_lambda) * redundancy
+                )
+                if value > best_value:
+                    best, best_value = candidate, value
+            if best is None:
+                break
+            selected.append(best)
+            remaining.remove(best)
+        return selected
+    
+    def _index_for(self, session_id: str) -> BM25Index:
+        load = False
+        with self._lock:
+            index = self._indexes.get(session_id)
+            if index is not None:
+                self._indexes.move_to_end(session_id)
+            else:
+                # 先登记再加载：加载期间的新写入也会进入索引
+                index = self._indexes[session_id] = BM25Index()
+                load = True
+                while len(self._indexes) > self.max_sessions:
+                    self._indexes.popitem(last=False)
+        if load:
+            self._load(session_id, index)
+        else:
+            index.ready.wait()
+        return index
+    
+    def _load(self, session_id: str, index: BM25Index):
+        start = time.perf_counter()
+        try:
+            ids, documents, metadatas = vector_store.all_documents(session_id)
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                index.upsert(doc_id, document, metadata or {})
+            self._stats["index_loads"] += 1
+            self._stats["index_load_ms"] += round((time.perf_counter() - start) * 1000, 1)
+            print(f"✅ 记忆关键词索引已加载: {session_id}（{len(ids)}条）")
+        except Exception:
+            # 加载失败时丢掉这个索引，下次检索重试
+            with self._lock:
+                if self._indexes.get(session_id) is index:
+                    del self._indexes[session_id]
+            raise
+        finally:
+            index.ready.set()
+    
+    def _on_add(self, session_id: str, ids: list, documents: list, metadatas: list):
+        index = self._indexes.get(session_id)
+        if index is None:
+            return
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            index.upsert(doc_id, document, metadata or {})
+    
+    def _on_remove(self, session_id: str, ids: list):
+        index = self._indexes.get(session_id)
+        if index is None:
+            return
+        for doc_id in ids:
+            index.remove(doc_id)
+    
+    def stats(self) -> Dict[str, Any]:
+        queries = self._stats["queries"]
+        return {
+            **self._stats,
+            "indexed_sessions": len(self._indexes),
+            "avg_returned": round(self._stats["returned"] / queries, 2) if queries else None,
+        }
+
+
+# 全局实例
+memory_retriever = MemoryRetriever()
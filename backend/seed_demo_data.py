@@ -1,10 +1,21 @@
 """
 生成演示数据 - 用于黑客松演示
 运行此脚本可以快速填充数据库，展示仪表盘效果
+
+压测用的大批量数据（见 benchmark.py）：
+    python seed_demo_data.py --bulk 100000 --sessions 200
+生成 bench_elder_0000 ~ bench_elder_0199 共10万条对话，分批写入数据库；
+默认不写向量库（百万级向量化太慢），需要时加 --vectors
 """
-from database import init_db, SessionLocal, ChatHistory
+from database import init_db, SessionLocal, ChatHistory, InsightsCache
 from vector_store import vector_store
 from datetime import datetime, timedelta
+from sqlalchemy import insert, select, func
+import argparse
+import asyncio
+import json
+import random
+import time
 import uuid
 
 # 演示对话数据
@@ -92,18 +103,18 @@ DEMO_CONVERSATIONS = [
 ]
 
 
-def seed_data():
+async def seed_data():
     """填充演示数据"""
     print("🌱 开始生成演示数据...")
     
     # 初始化数据库
-    init_db()
+    await init_db()
     db = SessionLocal()
     
     try:
         # 清空现有数据（可选）
-        # db.query(ChatHistory).delete()
-        # db.commit()
+        # await db.execute(delete(ChatHistory))
+        # await db.commit()
         
         base_time = datetime.utcnow() - timedelta(days=3)
         
@@ -149,17 +160,119 @@ def seed_data():
             vector_store.add_insight(insight_id, insight, category)
             print(f"   ✓ 洞见 {idx + 1}/{len(insights)}: {category}")
         
-        db.commit()
+        await db.commit()
         print(f"\n✅ 成功生成 {len(DEMO_CONVERSATIONS)} 条对话和 {len(insights)} 条洞见")
         print(f"📊 现在可以访问仪表盘查看效果: http://localhost:8080")
-        
+    
     except Exception as e:
         print(f"❌ 生成失败: {e}")
-        db.rollback()
+        await db.rollback()
     finally:
-        db.close()
+        await db.close()
+
+
+# 压测数据的老人ID前缀
+BENCH_SESSION_PREFIX = "bench_elder_"
+
+# 预置的仪表盘洞察（让压测中的 /api/dashboard/insights 走缓存路径，不调用分析智能体）
+BENCH_INSIGHTS = {
+    "clinical_biomarkers": {},
+    "overall_assessment": {"cognitive_risk_level": "低风险", "summary": "压测数据", "recommendations": []},
+    "emotion_analysis": {"overall_mood": "积极", "emotional_needs": [], "concerns": [], "stress_level": "低"},
+    "personal_info": {"hobbies": [], "daily_routine": "", "relationships": [], "important_memories": []},
+}
+
+
+def bench_session_ids(sessions: int):
+    return [f"{BENCH_SESSION_PREFIX}{i:04d}" for i in range(sessions)]
+
+
+async def seed_bulk(
+    rows: int,
+    sessions: int = 100,
+    days: int = 365,
+    batch_size: int = 5000,
+    with_vectors: bool = False,
+    with_insights: bool = True,
+    seed: int = 42
+):
+    """
+    批量生成压测数据：rows 条对话均匀分给 sessions 个老人，时间分散在最近 days 天内
+    
+    每批一次批量INSERT、一次提交；对话内容从演示对话中随机抽取
+    """
+    print(f"🌱 开始生成压测数据: {rows}条对话, {sessions}个老人...")
+    await init_db()
+    rng = random.Random(seed)
+    session_ids = bench_session_ids(sessions)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    
+    written = 0
+    async with SessionLocal() as db:
+        while written < rows:
+            count = min(batch_size, rows - written)
+            records = []
+            for _ in range(count):
+                conv = rng.choice(DEMO_CONVERSATIONS)
+                records.append({
+                    "session_id": rng.choice(session_ids),
+                    "user_text": conv["user"],
+                    "ai_text": conv["ai"],
+                    "timestamp": now - timedelta(seconds=rng.uniform(0, days * 86400)),
+                })
+            await db.execute(insert(ChatHistory), records)
+            await db.commit()
+            
+            if with_vectors:
+                await asyncio.to_thread(vector_store.add_conversations, [
+                    {**record, "conversation_id": f"bench_{uuid.uuid4().hex[:12]}"}
+                    for record in records
+                ])
+            
+            written += count
+            elapsed = time.perf_counter() - started
+            print(f"   ✓ {written}/{rows}（{written / elapsed:.0f} 条/秒）")
+        
+        if with_insights:
+            # 以每个老人当前最新的对话ID为准写入洞察缓存
+            latest = (await db.execute(
+                select(ChatHistory.session_id, func.max(ChatHistory.id)).where(
+                    ChatHistory.session_id.in_(session_ids)
+                ).group_by(ChatHistory.session_id)
+            )).all()
+            for session_id, latest_id in latest:
+                await db.merge(InsightsCache(
+                    session_id=session_id,
+                    last_conversation_id=latest_id,
+                    insights=json.dumps(BENCH_INSIGHTS, ensure_ascii=False),
+                    updated_at=now
+                ))
+            await db.commit()
+            print(f"   ✓ 洞察缓存: {len(latest)}个老人")
+    
+    print(f"\n✅ 压测数据生成完成，用时 {time.perf_counter() - started:.1f} 秒")
 
 
 if __name__ == "__main__":
-    seed_data()
+    parser = argparse.ArgumentParser(description="生成演示数据或压测数据")
+    parser.add_argument("--bulk", type=int, default=0, help="生成多少条压测对话（不指定则生成演示数据）")
+    parser.add_argument("--sessions", type=int, default=100, help="压测数据的老人数量")
+    parser.add_argument("--days", type=int, default=365, help="对话时间分散在最近多少天内")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每批写入条数")
+    parser.add_argument("--vectors", action="store_true", help="同时写入向量库（很慢）")
+    parser.add_argument("--no-insights", action="store_true", help="不预置仪表盘洞察缓存")
+    args = parser.parse_args()
+    
+    if args.bulk:
+        asyncio.run(seed_bulk(
+            args.bulk,
+            sessions=args.sessions,
+            days=args.days,
+            batch_size=args.batch_size,
+            with_vectors=args.vectors,
+            with_insights=not args.no_insights
+        ))
+    else:
+        asyncio.run(seed_data())
 
@@ -0,0 +1,102 @@
+"""
+推测性上下文 - 老人还在说话时，用中间识别结果提前检索记忆、组装prompt
+
+通话（/ws/call）中每次中间识别出文字后，后台用这段文字准备上下文（记忆检索 + 最近对话 + prompt）；
+说完后拿最终识别结果比对（difflib 相似度）：
+- 与推测时的文字完全相同（中间识别已覆盖全部音频时很常见）：上下文和prompt都直接复用
+- 足够接近（≥ SPECULATIVE_MIN_RATIO）：复用检索到的记忆和对话历史，只用最终文字重新组装prompt
+- 差别较大：丢弃推测结果，按原流程检索
+
+检索与老人说话的时间重叠，说完到开始回复之间的等待因此缩短
+"""
+import asyncio
+import difflib
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+SPECULATIVE_CONTEXT_ENABLED = os.getenv("SPECULATIVE_CONTEXT_ENABLED", "1") != "0"
+# 最终文字与推测时的文字相似度达到多少时复用推测结果
+SPECULATIVE_MIN_RATIO = float(os.getenv("SPECULATIVE_MIN_RATIO", "0.85"))
+# 中间识别结果少于这么多字时不做推测（"嗯"、"那个"检索不出有用的记忆）
+SPECULATIVE_MIN_CHARS = int(os.getenv("SPECULATIVE_MIN_CHARS", "4"))
+
+# 准备上下文的函数：文字 → {"history", "memories", "messages"}
+Prepare = Callable[[str], Awaitable[Dict[str, Any]]]
+
+_stats = {"started": 0, "superseded": 0, "reused": 0, "prompt_reused": 0, "discarded": 0, "failed": 0}
+
+
+def text_ratio(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+class SpeculativeContext:
+    """一次通话中当前这句话的推测性上下文（同一时刻最多一个后台准备任务）"""
+    
+    def __init__(self, prepare: Prepare):
+        self.prepare = prepare
+        self.text = ""
+        self._task: Optional[asyncio.Task] = None
+    
+    def update(self, text: str):
+        """收到新的中间识别结果；与正在准备的文字足够接近时沿用，否则重新准备"""
+        if not SPECULATIVE_CONTEXT_ENABLED or len(text) < SPECULATIVE_MIN_CHARS:
+            return
+        if self._task is not None:
+            if text_ratio(text, self.text) >= SPECULATIVE_MIN_RATIO:
+                return
+            self._task.cancel()
+            _stats["superseded"] += 1
+        self.text = text
+        self._task = asyncio.create_task(self.prepare(text))
+        _stats["started"] += 1
+    
+    async def resolve(self, final_text: str) -> Optional[Dict[str, Any]]:
+        """
+        用最终识别结果取出推测的上下文；不可复用时返回 None
+        
+        文字与推测时不完全相同时不返回 messages（调用方用最终文字重新组装prompt）
+        """
+        task, text = self._task, self.text
+        self._task, self.text = None, ""
+        if task is None:
+            return None
+        if text_ratio(final_text, text) < SPECULATIVE_MIN_RATIO:
+            task.cancel()
+            _stats["discarded"] += 1
+            return None
+        try:
+            context = await task
+        except Exception as e:
+            print(f"⚠️  推测性上下文准备失败: {e}")
+            _stats["failed"] += 1
+            return None
+        
+        _stats["reused"] += 1
+        if final_text == text:
+            _stats["prompt_reused"] += 1
+            return context
+        return {**context, "messages": None}
+    
+    def detach(self) -> "SpeculativeContext":
+        """这句话说完：推测交给返回的新对象，本对象留给下一句话"""
+        detached = SpeculativeContext(self.prepare)
+        detached._task, detached.text = self._task, self.text
+        self._task, self.text = None, ""
+        return detached
+    
+    def cancel(self):
+        """这句话被丢弃（取消、咳嗽声、挂断）"""
+        if self._task is not None:
+            self._task.cancel()
+        self._task, self.text = None, ""
+
+
+def speculation_stats() -> Dict[str, Any]:
+    finished = _stats["reused"] + _stats["discarded"] + _stats["failed"]
+    return {
+        **_stats,
+        "enabled": SPECULATIVE_CONTEXT_ENABLED,
+        "reuse_rate": round(_stats["reused"] / finished, 3) if finished else 0.0,
+    }
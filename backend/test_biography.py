@@ -0,0 +1,66 @@
+"""
+biography.py 的测试：只配置了 Gemini（对话用本地模拟服务）时的人生纪要，以及按当地日期切分对话
+
+运行：cd backend && python -m pytest -q test_biography.py
+"""
+import asyncio
+import os
+import tempfile
+from datetime import datetime
+
+# 数据库、向量库和缓存文件都写到临时目录
+os.chdir(tempfile.mkdtemp())
+# 只配置 Gemini：实时对话使用显式指定的本地模拟服务，人生纪要和摘要使用 Gemini
+os.environ.update({
+    "DATABASE_URL": "sqlite+aiosqlite:///./test.db",
+    "GEMINI_API_KEY": "test-key",
+    "STT_PROVIDER": "fake",
+    "LLM_PROVIDER": "fake",
+    "TTS_PROVIDER": "fake",
+    "BIOGRAPHY_UTC_OFFSET_HOURS": "8",
+})
+
+from sqlalchemy import select  # noqa: E402
+
+import biography  # noqa: E402
+from ai_services import ai_services  # noqa: E402
+from database import ChatHistory, ConversationSummary, SessionLocal, init_db  # noqa: E402
+
+
+def test_gemini_only_biography_summarizes_by_local_date(monkeypatch):
+    prompts = []
+    
+    async def complete(messages, **options):
+        prompts.append(messages[-1]["content"])
+        if "生成两部分内容" in prompts[-1]:
+            return '{"biography": "## 人生纪要", "cognitive_assessment": {"overall_risk": "低风险"}}'
+        return "摘要"
+    
+    assert ai_services.llm.name == "fake"
+    assert ai_services.biography_llm.name == "gemini"
+    monkeypatch.setattr(ai_services.biography_llm, "complete", complete)
+    
+    async def run():
+        await init_db()
+        async with SessionLocal() as db:
+            # UTC 1月31日 20:00 是当地（UTC+8）2月1日凌晨4点
+            db.add(ChatHistory(session_id="elder_bio", user_text="我年轻时在上海", ai_text="真好",
+                               timestamp=datetime(2024, 1, 31, 20, 0)))
+            db.add(ChatHistory(session_id="elder_bio", user_text="今天去了公园", ai_text="天气好吗",
+                               timestamp=datetime(2024, 1, 31, 10, 0)))
+            await db.commit()
+            result = await biography.build_biography(db, "elder_bio")
+        async with SessionLocal() as db:
+            rows = (await db.execute(
+                select(ConversationSummary.level, ConversationSummary.period).where(
+                    ConversationSummary.session_id == "elder_bio"
+                )
+            )).all()
+        return result, sorted(rows)
+    
+    result, rows = asyncio.run(run())
+    assert result["biography"] == "## 人生纪要"
+    assert result["total_conversations"] == 2
+    assert rows == [("day", "2024-01-31"), ("day", "2024-02-01"), ("month", "2024-01"), ("month", "2024-02")]
+    # 摘要中的时间为当地时间
+    assert any("[04:00]" in prompt for prompt in prompts)
@@ -0,0 +1,120 @@
+"""
+resilience.py 的测试：半开状态下被取消的试探请求、每轮对话截止时间的清理、长语音的识别超时
+
+运行：cd backend && python -m pytest -q test_resilience.py
+"""
+import asyncio
+
+import pytest
+
+import resilience as resilience_module
+from providers import ProviderError
+from resilience import RESILIENCE_STAGE_SHARES, RESILIENCE_TURN_BUDGET_SECONDS, Resilience, end_turn, stage_timeout, start_turn
+
+
+def _half_open(resilience: Resilience, kind: str, provider: str):
+    """让上游进入熔断，且熔断时间已过（下一次调用就是试探）"""
+    breaker = resilience.upstream(kind, provider).breaker
+    breaker.open_seconds = 0
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+
+async def _cancel_while_running(coro):
+    task = asyncio.ensure_future(coro)
+    await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def test_cancelled_probe_is_released():
+    resilience = Resilience()
+    breaker = _half_open(resilience, "stt", "test")
+    
+    async def hang():
+        await asyncio.sleep(10)
+    
+    asyncio.run(_cancel_while_running(resilience.call("stt", "test", hang)))
+    
+    # 试探被取消不算成功也不算失败，下一次调用可以重新试探
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_cancelled_stream_probe_is_released():
+    resilience = Resilience()
+    breaker = _half_open(resilience, "llm", "test")
+    
+    async def hang():
+        await asyncio.sleep(10)
+        yield "你好"
+    
+    async def consume():
+        async for _ in resilience.stream("llm", "test", hang):
+            pass
+    
+    asyncio.run(_cancel_while_running(consume()))
+    
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_probe_success_closes_breaker():
+    resilience = Resilience()
+    breaker = _half_open(resilience, "tts", "test")
+    
+    async def ok():
+        return b"audio"
+    
+    assert asyncio.run(resilience.call("tts", "test", ok)) == b"audio"
+    assert breaker.state == "closed"
+
+
+def test_end_turn_clears_deadline_for_later_tasks():
+    async def connection():
+        # 同一个连接先处理一轮对话，之后再创建后台任务
+        turn = start_turn(budget=0)
+        try:
+            assert stage_timeout("stt") == resilience_module.RESILIENCE_MIN_STAGE_SECONDS
+        finally:
+            end_turn(turn)
+        
+        async def background():
+            return stage_timeout("stt")
+        
+        return await asyncio.create_task(background())
+    
+    # 不再受已过期的截止时间约束，只剩阶段上限
+    assert asyncio.run(connection()) == RESILIENCE_TURN_BUDGET_SECONDS * RESILIENCE_STAGE_SHARES["stt"]
+
+
+def test_long_utterance_extends_stt_deadline(monkeypatch):
+    # 缩小预算：STT份额 0.1 秒，一次识别需要 0.3 秒
+    monkeypatch.setattr(resilience_module, "RESILIENCE_TURN_BUDGET_SECONDS", 0.4)
+    monkeypatch.setattr(resilience_module, "RESILIENCE_MIN_STAGE_SECONDS", 0.0)
+    resilience = Resilience(max_attempts=1)
+    
+    async def transcribe():
+        await asyncio.sleep(0.3)
+        return "今天天气真好"
+    
+    async def turn(extra_seconds: float):
+        token = start_turn(budget=0.4)
+        try:
+            return await resilience.call("stt", "test", transcribe, extra_seconds=extra_seconds)
+        finally:
+            end_turn(token)
+    
+    # 按普通长度估算的预算不够
+    with pytest.raises(ProviderError) as error:
+        asyncio.run(turn(0.0))
+    assert error.value.status_code == 504
+    
+    # 按音频时长追加时间后，阶段超时和本轮截止时间都足够完成识别
+    assert asyncio.run(turn(0.5)) == "今天天气真好"
@@ -0,0 +1,70 @@
+"""
+分阶段耗时统计 - 记录一轮对话中各阶段（STT、记忆检索、LLM、TTS等）的耗时
+
+指定 route 时，每个阶段同时记入 Prometheus 直方图（见 metrics.py）
+"""
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, Callable, Any
+
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import observe_stage
+
+
+class StageTimer:
+    """记录各阶段耗时（毫秒），可输出为标准的 Server-Timing 响应头"""
+    
+    def __init__(self, route: str = ""):
+        self.route = route
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._finished = False
+    
+    def record(self, name: str, seconds: float):
+        self.stages[name] = round(seconds * 1000, 1)
+        if self.route:
+            observe_stage(self.route, name, seconds)
+    
+    def finish(self) -> Dict[str, float]:
+        """本轮结束：记录总耗时（只记一次）并返回各阶段耗时"""
+        if not self._finished:
+            self._finished = True
+            if self.route:
+                observe_stage(self.route, "total", time.perf_counter() - self.started_at)
+        return self.as_dict()
+    
+    @contextmanager
+    def stage(self, name: str):
+        """计时一段同步或异步代码：with timer.stage("stt"): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+    
+    async def run_in_threadpool(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """在线程池中执行阻塞函数并计时，避免阻塞事件循环"""
+        start = time.perf_counter()
+        try:
+            return await run_in_threadpool(func, *args, **kwargs)
+        finally:
+            self.record(name, time.perf_counter() - start)
+    
+    async def run(self, name: str, awaitable: Awaitable) -> Any:
+        """等待一个协程并计时，便于和 asyncio.gather 组合"""
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record(name, time.perf_counter() - start)
+    
+    def total_ms(self) -> float:
+        return round((time.perf_counter() - self.started_at) * 1000, 1)
+    
+    def as_dict(self) -> Dict[str, float]:
+        return {**self.stages, "total": self.total_ms()}
+    
+    def server_timing(self) -> str:
+        """格式化为 Server-Timing 头，例如 "stt;dur=812.4, memory;dur=35.2, total;dur=2301.7" """
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.as_dict().items())
@@ -0,0 +1,171 @@
+"""
+语音合成缓存 - 相同的句子（同一音色、模型和参数）只合成一次
+
+伴侣智能体的回复里有大量重复的短句（问候、追问、兜底话术），命中缓存时
+省掉一次ElevenLabs网络往返和付费合成。两级缓存：
+- 内存LRU：按字节数限制
+- 磁盘：tts_cache/ 目录下按内容哈希存放MP3，超过容量时删除最久未使用的文件
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import aiofiles
+
+
+TTS_CACHE_MEMORY_MB = float(os.getenv("TTS_CACHE_MEMORY_MB", "32"))
+# 磁盘缓存目录，留空关闭磁盘缓存
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "./tts_cache")
+TTS_CACHE_DISK_MB = float(os.getenv("TTS_CACHE_DISK_MB", "512"))
+
+
+def tts_cache_key(text: str, voice_id: str, model_id: str, voice_settings: Dict[str, Any]) -> str:
+    """缓存键：文本 + 音色 + 模型 + 合成参数，任一变化都会生成新的音频"""
+    payload = json.dumps(
+        {"text": text, "voice_id": voice_id, "model_id": model_id, "voice_settings": voice_settings},
+        ensure_ascii=False,
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """内存LRU + 磁盘两级的MP3缓存"""
+    
+    def __init__(
+        self,
+        memory_bytes: int = int(TTS_CACHE_MEMORY_MB * 1024 * 1024),
+        disk_dir: str = TTS_CACHE_DIR,
+        disk_bytes: int = int(TTS_CACHE_DISK_MB * 1024 * 1024),
+    ):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        
+        # 磁盘索引：key -> (文件大小, 最近使用时间)，启动时从目录重建
+        self._disk_index: Dict[str, list] = {}
+        self._disk_size = 0
+        self._disk_lock = asyncio.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+        
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return audio
+        
+        # 读文件期间同一条目可能被并发的淘汰删掉：出错时按未命中处理，缓存问题不影响TTS请求
+        entry = self._disk_index.get(key)
+        if entry is not None:
+            try:
+                async with aiofiles.open(self._path(key), "rb") as f:
+                    audio = await f.read()
+            except OSError:
+                self._forget_disk(key)
+            else:
+                # 同时更新文件时间，重启后重建索引仍能保留使用顺序
+                entry[1] = time.time()
+                try:
+                    os.utime(self._path(key))
+                except OSError:
+                    pass
+                self._stats["disk_hits"] += 1
+                self._remember(key, audio)
+                return audio
+        
+        self._stats["misses"] += 1
+        return None
+    
+    async def put(self, key: str, audio: bytes):
+        if not audio:
+            return
+        self._remember(key, audio)
+        
+        if not self.disk_dir:
+            return
+        async with self._disk_lock:
+            # 在锁内检查：同一句话的两次并发写入只有一次计入磁盘占用
+            if key in self._disk_index:
+                return
+            path = self._path(key)
+            tmp_path = f"{path}.tmp"
+            try:
+                async with aiofiles.open(tmp_path, "wb") as f:
+                    await f.write(audio)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️  TTS缓存写入失败: {e}")
+                return
+            self._disk_index[key] = [len(audio), time.time()]
+            self._disk_size += len(audio)
+            self._evict_disk()
+    
+    def _remember(self, key: str, audio: bytes):
+        if len(audio) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+    
+    def _evict_disk(self):
+        """磁盘超过容量时，按最近使用时间删除最旧的文件"""
+        if self._disk_size <= self.disk_bytes:
+            return
+        for key, _ in sorted(self._disk_index.items(), key=lambda item: item[1][1]):
+            if self._disk_size <= self.disk_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self._forget_disk(key)
+            self._stats["evictions"] += 1
+    
+    def _forget_disk(self, key: str):
+        entry = self._disk_index.pop(key, None)
+        if entry is not None:
+            self._disk_size -= entry[0]
+    
+    def _load_disk_index(self):
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".mp3"):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            self._disk_index[name[:-len(".mp3")]] = [stat.st_size, stat.st_mtime]
+            self._disk_size += stat.st_size
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.mp3")
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+        return {
+            **self._stats,
+            "memory_entries": len(self._memory),
+            "memory_mb": round(self._memory_size / 1024 / 1024, 2),
+            "disk_entries": len(self._disk_index),
+            "disk_mb": round(self._disk_size / 1024 / 1024, 2),
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+        }
+
+
+# 全局实例
+tts_cache = TTSCache()
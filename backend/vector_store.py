@@ -2,7 +2,15 @@
 ChromaDB向量存储 - 用于RAG记忆检索
 """
 import chromadb
+import hashlib
 import os
+import re
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from database import DEFAULT_SESSION_ID
+from embeddings import embedding_function
 
 
 class VectorStore:
@@ -14,49 +22,207 @@ class VectorStore:
             path="./chroma_data"
         )
         
+        # 每个老人一个collection，检索成本只与该老人的记忆量相关
+        self._collections = {}
+        
+        # 写入后的回调 (session_id, ids, documents, metadatas)，例如同步更新关键词索引（retrieval.py）
+        self._listeners: List[Callable[[str, list, list, list], None]] = []
+        # 移除后的回调 (session_id, ids)
+        self._remove_listeners: List[Callable[[str, list], None]] = []
+        
         # 获取或创建collection
-        self.collection = self.client.get_or_create_collection(
-            name="elder_memories",
-            metadata={"description": "老人的对话记忆和洞见"}
+        self.collection = self.collection_for(DEFAULT_SESSION_ID)
+    
+    def collection_for(self, session_id: str):
+        """获取（必要时创建）某个老人的记忆collection"""
+        if session_id not in self._collections:
+            self._collections[session_id] = self.client.get_or_create_collection(
+                name=self._collection_name(session_id),
+                embedding_function=embedding_function,
+                metadata={"description": "老人的对话记忆和洞见", "session_id": session_id}
+            )
+        return self._collections[session_id]
+    
+    def archive_for(self, session_id: str):
+        """某个老人的归档collection：已整理为洞见的旧对话移到这里，不参与日常检索"""
+        name = self._collection_name(session_id) + "_archive"
+        if len(name) > 63:
+            name = f"elder_archive_{hashlib.sha1(session_id.encode()).hexdigest()[:16]}"
+        return self.client.get_or_create_collection(
+            name=name,
+            embedding_function=embedding_function,
+            metadata={"description": "已整理为洞见的旧对话", "session_id": session_id}
         )
     
-    def add_conversation(self, conversation_id: str, user_text: str, ai_text: str):
+    def add_listener(self, listener: Callable[[str, list, list, list], None]):
+        self._listeners.append(listener)
+    
+    def add_remove_listener(self, listener: Callable[[str, list], None]):
+        self._remove_listeners.append(listener)
+    
+    def _upsert(self, session_id: str, ids: list, documents: list, metadatas: list):
+        self.collection_for(session_id).upsert(documents=documents, metadatas=metadatas, ids=ids)
+        for listener in self._listeners:
+            listener(session_id, ids, documents, metadatas)
+    
+    @staticmethod
+    def _collection_name(session_id: str) -> str:
+        # 默认老人沿用原来的collection，已有数据无需迁移
+        if session_id == DEFAULT_SESSION_ID:
+            return "elder_memories"
+        
+        # ChromaDB要求名称3-63个字符、首尾为字母数字；不满足时使用哈希
+        name = f"elder_memories_{session_id}"
+        if len(name) <= 63 and re.fullmatch(r"[A-Za-z0-9_-]+", name) and name[-1].isalnum():
+            return name
+        return f"elder_memories_{hashlib.sha1(session_id.encode()).hexdigest()[:16]}"
+    
+    def add_conversation(
+        self,
+        conversation_id: str,
+        user_text: str,
+        ai_text: str,
+        session_id: str = DEFAULT_SESSION_ID
+    ):
         """添加对话到向量库"""
-        combined_text = f"老人说: {user_text}\nAI回复: {ai_text}"
+        self.add_conversations([{
+            "conversation_id": conversation_id,
+            "user_text": user_text,
+            "ai_text": ai_text,
+            "session_id": session_id
+        }])
+    
+    def add_conversations(self, records: list):
+        """
+        批量添加对话到向量库（写入缓冲刷写时使用）
         
-        self.collection.add(
-            documents=[combined_text],
-            metadatas=[{
-                "user_text": user_text,
-                "ai_text": ai_text,
-                "type": "conversation"
-            }],
-            ids=[conversation_id]
-        )
+        按老人分组，每个collection一次upsert；按ID写入，重复写入不会产生重复记忆
+        """
+        by_session = {}
+        for record in records:
+            by_session.setdefault(record.get("session_id", DEFAULT_SESSION_ID), []).append(record)
+        
+        for session_id, items in by_session.items():
+            self._upsert(
+                session_id,
+                ids=[r["conversation_id"] for r in items],
+                documents=[
+                    f"老人说: {r['user_text']}\nAI回复: {r['ai_text']}" for r in items
+                ],
+                metadatas=[
+                    {
+                        "user_text": r["user_text"],
+                        "ai_text": r["ai_text"],
+                        "type": "conversation",
+                        "session_id": session_id,
+                        "timestamp": _epoch(r.get("timestamp"))
+                    }
+                    for r in items
+                ]
+            )
     
-    def add_insight(self, insight_id: str, insight_text: str, category: str = "general"):
-        """添加洞见到向量库（例如：发现老人喜欢红烧肉）"""
-        self.collection.add(
+    def add_insight(
+        self,
+        insight_id: str,
+        insight_text: str,
+        category: str = "general",
+        session_id: str = DEFAULT_SESSION_ID,
+        metadata: Optional[dict] = None
+    ):
+        """添加洞见到向量库（例如：发现老人喜欢红烧肉）；同一ID重复添加时覆盖"""
+        self._upsert(
+            session_id,
+            ids=[insight_id],
             documents=[insight_text],
             metadatas=[{
                 "category": category,
-                "type": "insight"
-            }],
-            ids=[insight_id]
+                "type": "insight",
+                "session_id": session_id,
+                "timestamp": time.time(),
+                **(metadata or {})
+            }]
+        )
+    
+    def archive_conversations(self, session_id: str, ids: list, embeddings: list, documents: list, metadatas: list):
+        """把对话从日常检索的collection移到归档collection（沿用已有向量，不重新向量化）"""
+        if not ids:
+            return
+        self.archive_for(session_id).upsert(
+            ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas
         )
+        self.collection_for(session_id).delete(ids=ids)
+        for listener in self._remove_listeners:
+            listener(session_id, ids)
     
-    def query_relevant_memories(self, query_text: str, n_results: int = 3):
-        """根据当前对话检索相关记忆"""
-        results = self.collection.query(
+    def query_relevant_memories(
+        self,
+        query_text: str,
+        n_results: int = 3,
+        session_id: str = DEFAULT_SESSION_ID
+    ):
+        """根据当前对话检索该老人的相关记忆"""
+        collection = self.collection_for(session_id)
+        if collection.count() == 0:
+            return []
+        
+        results = collection.query(
             query_texts=[query_text],
-            n_results=n_results
+            n_results=min(n_results, collection.count())
         )
         
         if results['documents']:
             return results['documents'][0]
         return []
+    
+    def query_candidates(
+        self,
+        query_text: str,
+        n_results: int = 20,
+        session_id: str = DEFAULT_SESSION_ID
+    ) -> List[dict]:
+        """
+        向量检索的候选结果（按相似度从高到低），附带ID、元数据和余弦相似度，供混合检索使用
+        
+        collection默认使用平方L2距离；向量已归一化时，余弦相似度 = 1 - 距离 / 2
+        """
+        collection = self.collection_for(session_id)
+        count = collection.count()
+        if count == 0:
+            return []
+        
+        results = collection.query(
+            query_texts=[query_text],
+            n_results=min(n_results, count),
+            include=["documents", "metadatas", "distances"]
+        )
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        return [
+            {
+                "id": doc_id,
+                "document": document,
+                "metadata": metadata or {},
+                "similarity": 1 - distance / 2 if space == "l2" else 1 - distance
+            }
+            for doc_id, document, metadata, distance in zip(
+                results["ids"][0], results["documents"][0],
+                results["metadatas"][0], results["distances"][0]
+            )
+        ]
+    
+    def all_documents(self, session_id: str = DEFAULT_SESSION_ID):
+        """某个老人的全部记忆 (ids, documents, metadatas)，用于重建关键词索引"""
+        results = self.collection_for(session_id).get(include=["documents", "metadatas"])
+        return results["ids"], results["documents"], results["metadatas"]
+
+
+def _epoch(timestamp) -> float:
+    """对话时间（datetime 或 ISO 字符串，UTC）→ Unix时间戳，用于检索时的时间衰减"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if isinstance(timestamp, datetime):
+        return (timestamp - datetime(1970, 1, 1)).total_seconds()
+    return time.time()
 
 
 # 全局实例
 vector_store = VectorStore()
-
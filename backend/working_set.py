@@ -0,0 +1,159 @@
+"""
+最近对话工作集 - 每个老人最近几轮对话常驻内存，每轮对话不再查询 chat_history
+
+- 每个老人一个定长环形缓冲（deque），保存最近 WORKING_SET_TURNS 轮
+- 保存对话时直接追加；某个老人第一次访问时才从数据库（加上写入缓冲中尚未落库的对话）加载，
+  同一个老人同时只有一个请求加载，其他请求等它的结果
+- 最多保留 WORKING_SET_MAX_SESSIONS 个老人，按最近访问淘汰（LRU）；
+  超过 WORKING_SET_IDLE_SECONDS 没有对话的老人也会被移出，下次访问时重新加载
+
+对话只由本进程写入（写入缓冲同样是进程内的），缓存中的历史与数据库保持一致
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import ChatHistory, DEFAULT_SESSION_ID
+from persistence import conversation_writer
+from prompt_builder import PROMPT_HISTORY_TURNS
+
+
+# 每个老人保留多少轮（默认与prompt中的对话轮数一致）
+WORKING_SET_TURNS = int(os.getenv("WORKING_SET_TURNS", str(PROMPT_HISTORY_TURNS)))
+# 最多缓存多少个老人
+WORKING_SET_MAX_SESSIONS = int(os.getenv("WORKING_SET_MAX_SESSIONS", "1000"))
+# 多久没有对话的老人移出缓存（秒）
+WORKING_SET_IDLE_SECONDS = float(os.getenv("WORKING_SET_IDLE_SECONDS", "1800"))
+
+
+class Turn:
+    """一轮对话（__slots__，不带实例字典）"""
+    
+    __slots__ = ("user_text", "ai_text")
+    
+    def __init__(self, user_text: str, ai_text: str):
+        self.user_text = user_text
+        self.ai_text = ai_text
+    
+    def as_dict(self) -> Dict[str, str]:
+        return {"user_text": self.user_text, "ai_text": self.ai_text}
+
+
+class _SessionTurns:
+    __slots__ = ("turns", "last_access")
+    
+    def __init__(self, turns: Deque[Turn]):
+        self.turns = turns
+        self.last_access = time.monotonic()
+
+
+class WorkingSet:
+    """按老人缓存最近几轮对话（LRU + 空闲淘汰）"""
+    
+    def __init__(
+        self,
+        turns: int = WORKING_SET_TURNS,
+        max_sessions: int = WORKING_SET_MAX_SESSIONS,
+        idle_seconds: float = WORKING_SET_IDLE_SECONDS
+    ):
+        self.turns = turns
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, _SessionTurns]" = OrderedDict()
+        # 正在加载的老人 -> 加载结果（加载失败时为 None）
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+    
+    async def recent(self, db: AsyncSession, session_id: str = DEFAULT_SESSION_ID) -> List[Dict[str, str]]:
+        """该老人最近几轮对话（按时间正序）；不在缓存中时用 db 加载"""
+        entry = self._touch(session_id)
+        if entry is not None:
+            self._stats["hits"] += 1
+        elif session_id in self._loading:
+            # 已有请求在加载：等它的结果，不重复查询，也不会用自己较旧的结果覆盖之后追加的对话；
+            # shield 保证等待方被取消时不影响加载方
+            entry = await asyncio.shield(self._loading[session_id])
+            if entry is None:
+                # 加载方失败或被取消：自己重新加载
+                return await self.recent(db, session_id)
+        else:
+            self._stats["misses"] += 1
+            entry = await self._load_once(db, session_id)
+        return [turn.as_dict() for turn in entry.turns]
+    
+    def append(self, session_id: str, user_text: str, ai_text: str):
+        """保存对话时追加一轮；该老人不在缓存中时不处理（下次访问时从数据库加载）"""
+        entry = self._touch(session_id)
+        if entry is not None:
+            entry.turns.append(Turn(user_text, ai_text))
+    
+    def _touch(self, session_id: str) -> Optional[_SessionTurns]:
+        self._evict_idle()
+        entry = self._sessions.get(session_id)
+        if entry is not None:
+            entry.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return entry
+    
+    def _insert(self, session_id: str, turns: Deque[Turn]) -> _SessionTurns:
+        entry = self._sessions[session_id] = _SessionTurns(turns)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self._stats["evictions"] += 1
+        return entry
+    
+    def _evict_idle(self):
+        """最久未访问的在最前面，从头部移出空闲的老人"""
+        deadline = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if entry.last_access >= deadline:
+                break
+            del self._sessions[session_id]
+            self._stats["evictions"] += 1
+    
+    async def _load_once(self, db: AsyncSession, session_id: str) -> _SessionTurns:
+        """加载并放入缓存；加载期间等待的请求通过 self._loading 拿到同一个结果"""
+        loading = self._loading[session_id] = asyncio.get_running_loop().create_future()
+        entry = None
+        try:
+            turns = await self._load(db, session_id)
+            entry = self._touch(session_id) or self._insert(session_id, turns)
+            return entry
+        finally:
+            del self._loading[session_id]
+            loading.set_result(entry)
+    
+    async def _load(self, db: AsyncSession, session_id: str) -> Deque[Turn]:
+        """从数据库加载最近几轮，加上写入缓冲中尚未落库的对话"""
+        rows = (await db.execute(
+            select(ChatHistory.user_text, ChatHistory.ai_text).where(
+                ChatHistory.session_id == session_id
+            ).order_by(
+                ChatHistory.timestamp.desc()
+            ).limit(self.turns)
+        )).all()
+        
+        turns: Deque[Turn] = deque(maxlen=self.turns)
+        turns.extend(Turn(row.user_text, row.ai_text) for row in reversed(rows))
+        turns.extend(Turn(p["user_text"], p["ai_text"]) for p in conversation_writer.pending(session_id))
+        return turns
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            "sessions": len(self._sessions),
+            "turns": sum(len(entry.turns) for entry in self._sessions.values()),
+            "max_sessions": self.max_sessions,
+        }
+
+
+# 全局实例
+working_set = WorkingSet()
@@ -2,6 +2,9 @@ import React, { useState, useEffect, useRef } from 'react'
 import VoiceActivityDetector from './VoiceActivityDetector'
 import './InCallView.css'
 
+// 老人ID：通过页面URL的 ?session_id=xxx 指定，默认演示账号
+const SESSION_ID = new URLSearchParams(window.location.search).get('session_id') || 'demo_elder'
+
 /**
  * F-003: 通话中视图 - 像素级复刻iOS通话界面
  */
@@ -10,7 +13,12 @@ function InCallView({ callState, onEndCall }) {
   const [isMuted, setIsMuted] = useState(false)
   const [isSpeaker, setIsSpeaker] = useState(true)
   const [isAISpeaking, setIsAISpeaking] = useState(false)
+  const [isUserSpeaking, setIsUserSpeaking] = useState(false)
   const audioRef = useRef(null)
+  const [isSocketReady, setIsSocketReady] = useState(false)
+  const socketRef = useRef(null)
+  const audioQueueRef = useRef([])
+  const isPlayingRef = useRef(false)
 
   // 通话计时器
   useEffect(() => {
@@ -22,6 +30,93 @@ function InCallView({ callState, onEndCall }) {
     }
   }, [callState])
 
+  // 全双工通话连接：一通电话一个WebSocket，连不上时回退到 /api/chat
+  // 上传16kHz PCM，由服务端判断老人什么时候说完（format=pcm16）
+  useEffect(() => {
+    if (callState !== 'connected') return
+
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws'
+    const socket = new WebSocket(
+      `${protocol}://${window.location.host}/ws/call?session_id=${encodeURIComponent(SESSION_ID)}&format=pcm16`
+    )
+    socket.binaryType = 'blob'
+
+    socket.onmessage = (event) => {
+      // 二进制帧：紧跟在 ai_text 之后的这句话的MP3音频
+      if (typeof event.data !== 'string') {
+        enqueueAudio(event.data)
+        return
+      }
+
+      const message = JSON.parse(event.data)
+      if (message.type === 'speech_start') {
+        setIsUserSpeaking(true)
+      } else if (message.type === 'no_speech') {
+        setIsUserSpeaking(false)
+      } else if (message.type === 'partial_transcript') {
+        console.log('用户:', message.text)
+      } else if (message.type === 'transcript') {
+        setIsUserSpeaking(false)
+        console.log('用户:', message.text)
+      } else if (message.type === 'ai_text') {
+        console.log('AI:', message.text)
+      } else if (message.type === 'error') {
+        console.error('通话错误:', message.error)
+      }
+    }
+
+    socket.onopen = () => {
+      setIsSocketReady(true)
+    }
+
+    socket.onclose = () => {
+      socketRef.current = null
+      setIsSocketReady(false)
+    }
+
+    socketRef.current = socket
+
+    return () => {
+      if (socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ type: 'hangup' }))
+      }
+      socket.close()
+      socketRef.current = null
+    }
+  }, [callState])
+
+  // 逐句播放AI语音
+  const enqueueAudio = (audioBlob) => {
+    if (audioBlob.size === 0) return
+    audioQueueRef.current.push(audioBlob)
+    if (!isPlayingRef.current) {
+      playNextAudio()
+    }
+  }
+
+  const playNextAudio = () => {
+    const nextBlob = audioQueueRef.current.shift()
+    if (!nextBlob || !audioRef.current) {
+      isPlayingRef.current = false
+      setIsAISpeaking(false)
+      return
+    }
+
+    isPlayingRef.current = true
+    setIsAISpeaking(true)
+    audioRef.current.src = URL.createObjectURL(new Blob([nextBlob], { type: 'audio/mpeg' }))
+    audioRef.current.play()
+  }
+
+  const isSocketOpen = () => socketRef.current && socketRef.current.readyState === WebSocket.OPEN
+
+  // 流式上传：持续发送PCM分片，开始/结束说话由服务端检测
+  const handlePcmChunk = (chunk) => {
+    if (isSocketOpen()) {
+      socketRef.current.send(chunk)
+    }
+  }
+
   // 格式化通话时长
   const formatDuration = (seconds) => {
     const mins = Math.floor(seconds / 60)
@@ -34,6 +129,7 @@ function InCallView({ callState, onEndCall }) {
     try {
       const formData = new FormData()
       formData.append('audio', audioBlob, 'user_speech.webm')
+      formData.append('session_id', SESSION_ID)
 
       const response = await fetch('/api/chat', {
         method: 'POST',
@@ -63,9 +159,9 @@ function InCallView({ callState, onEndCall }) {
     }
   }
 
-  // 音频播放结束
+  // 音频播放结束：继续播放队列中的下一句
   const handleAudioEnded = () => {
-    setIsAISpeaking(false)
+    playNextAudio()
   }
 
   return (
@@ -101,7 +197,10 @@ function InCallView({ callState, onEndCall }) {
       {/* VAD语音活动检测 */}
       {callState === 'connected' && (
         <VoiceActivityDetector 
+          key={isSocketReady ? 'stream' : 'upload'}
           onSpeechDetected={handleUserSpeech}
+          onPcmChunk={isSocketReady ? handlePcmChunk : undefined}
+          isUserSpeaking={isUserSpeaking}
           isEnabled={!isAISpeaking && !isMuted}
         />
       )}
@@ -1,11 +1,19 @@
 import React, { useEffect, useRef, useState } from 'react'
 import './VoiceActivityDetector.css'
 
+// 流式模式：16kHz 单声道 16-bit PCM，每个分片约128ms
+const PCM_SAMPLE_RATE = 16000
+const PCM_BUFFER_SIZE = 2048
+
 /**
  * F-004: 语音活动检测 (VAD)
  * 自动检测用户说话，无需"按住说话"
+ *
+ * 传入 onPcmChunk 时进入流式模式：持续回调PCM分片（ArrayBuffer），
+ * 什么时候开始说话、什么时候说完由服务端判断，通过 isUserSpeaking 回传显示状态；
+ * 否则在本地按音量和静音时长切分录音，回调 onSpeechDetected(整段录音)
  */
-function VoiceActivityDetector({ onSpeechDetected, isEnabled }) {
+function VoiceActivityDetector({ onSpeechDetected, onPcmChunk, isUserSpeaking, isEnabled }) {
   const [isListening, setIsListening] = useState(false)
   const [isRecording, setIsRecording] = useState(false)
   const mediaRecorderRef = useRef(null)
@@ -13,6 +21,8 @@ function VoiceActivityDetector({ onSpeechDetected, isEnabled }) {
   const analyserRef = useRef(null)
   const silenceTimerRef = useRef(null)
   const recordingChunksRef = useRef([])
+  const streamRef = useRef(null)
+  const processorRef = useRef(null)
 
   useEffect(() => {
     if (!isEnabled) {
@@ -36,6 +46,13 @@ function VoiceActivityDetector({ onSpeechDetected, isEnabled }) {
           autoGainControl: true
         } 
       })
+      streamRef.current = stream
+
+      if (onPcmChunk) {
+        startPcmStreaming(stream)
+        setIsListening(true)
+        return
+      }
 
       // 创建音频上下文
       audioContextRef.current = new (window.AudioContext || window.webkitAudioContext)()
@@ -72,11 +89,38 @@ function VoiceActivityDetector({ onSpeechDetected, isEnabled }) {
     }
   }
 
+  // 流式模式：重采样到16kHz，转换为16-bit PCM后持续上传（浏览器自带回声消除）
+  const startPcmStreaming = (stream) => {
+    const audioContext = new (window.AudioContext || window.webkitAudioContext)({ sampleRate: PCM_SAMPLE_RATE })
+    const source = audioContext.createMediaStreamSource(stream)
+    const processor = audioContext.createScriptProcessor(PCM_BUFFER_SIZE, 1, 1)
+
+    processor.onaudioprocess = (event) => {
+      const samples = event.inputBuffer.getChannelData(0)
+      const pcm = new Int16Array(samples.length)
+      for (let i = 0; i < samples.length; i++) {
+        const s = Math.max(-1, Math.min(1, samples[i]))
+        pcm[i] = s < 0 ? s * 0x8000 : s * 0x7fff
+      }
+      onPcmChunk(pcm.buffer)
+    }
+
+    source.connect(processor)
+    processor.connect(audioContext.destination)
+    audioContextRef.current = audioContext
+    processorRef.current = processor
+  }
+
   const stopListening = () => {
     if (mediaRecorderRef.current && mediaRecorderRef.current.state === 'recording') {
       mediaRecorderRef.current.stop()
     }
 
+    if (processorRef.current) {
+      processorRef.current.disconnect()
+      processorRef.current = null
+    }
+
     if (audioContextRef.current) {
       audioContextRef.current.close()
     }
@@ -85,6 +129,11 @@ function VoiceActivityDetector({ onSpeechDetected, isEnabled }) {
       clearTimeout(silenceTimerRef.current)
     }
 
+    if (streamRef.current) {
+      streamRef.current.getTracks().forEach(track => track.stop())
+      streamRef.current = null
+    }
+
     setIsListening(false)
     setIsRecording(false)
   }
@@ -149,15 +198,17 @@ function VoiceActivityDetector({ onSpeechDetected, isEnabled }) {
     checkAudio()
   }
 
+  const showRecording = onPcmChunk ? isUserSpeaking : isRecording
+
   return (
     <div className="vad-indicator">
       {isListening && (
         <>
-          <div className={`vad-status ${isRecording ? 'recording' : 'listening'}`}>
+          <div className={`vad-status ${showRecording ? 'recording' : 'listening'}`}>
             <div className="vad-dot" />
-            <span>{isRecording ? '正在聆听您说话...' : '等待您说话'}</span>
+            <span>{showRecording ? '正在聆听您说话...' : '等待您说话'}</span>
           </div>
-          {isRecording && (
+          {showRecording && (
             <div className="vad-animation">
               <div className="vad-bar"></div>
               <div className="vad-bar"></div>